@@ -4,7 +4,7 @@ from django.contrib import messages
 from django.urls import path
 from django.shortcuts import redirect
 from django.http import HttpResponseRedirect
-from .models import Region, City, Terminal, ModeOfTransport, Route, RouteStop, CachedExport, UserProfile
+from .models import Region, City, Terminal, ModeOfTransport, Route, RouteStop, CachedExport, UserProfile, TransferEdge
 
 
 @admin.register(UserProfile)
@@ -85,6 +85,13 @@ class RouteStopAdmin(admin.ModelAdmin):
             kwargs["empty_label"] = "--- No Terminal (Regular Stop) ---"
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
     
+@admin.register(TransferEdge)
+class TransferEdgeAdmin(admin.ModelAdmin):
+    list_display = ('stop', 'terminal', 'distance_m', 'walk_time_ms', 'updated_at')
+    list_select_related = ('stop', 'terminal')
+    search_fields = ('stop__stop_name', 'terminal__name')
+    readonly_fields = ('stop', 'terminal', 'distance_m', 'walk_time_ms', 'updated_at')
+
 @admin.register(CachedExport)
 class CachedExportAdmin(admin.ModelAdmin):
     list_display = ('export_type', 'data_version', 'last_updated', 'file_size_kb', 'record_count')
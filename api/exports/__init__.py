@@ -0,0 +1 @@
+# Bulk exports of the verified transit network
@@ -0,0 +1,152 @@
+"""
+GeoJSON Export
+
+Streams every verified terminal (Point) and route (LineString) as one GeoJSON
+FeatureCollection. Rows are read in fixed-size keyset pages (`id > last_id`), each
+route page together with the stops of just those routes, and every feature is
+serialized as soon as it is built, so memory use stays flat however large the tables
+grow.
+
+Route geometry is the stored `Route.polyline`; routes without one are drawn through
+their origin terminal and stops. Coordinates follow GeoJSON order: [longitude, latitude].
+"""
+
+import json
+
+from api.utils.geo import coerce_polyline
+
+CHUNK_SIZE = 500
+WRITE_SIZE = 64 * 1024
+LAYERS = ('terminals', 'routes')
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _pages(queryset, fields, size=CHUNK_SIZE):
+    """Yield lists of value dicts from `queryset`, paging on primary key"""
+    last_id = 0
+    while True:
+        page = list(queryset.filter(id__gt=last_id).order_by('id').values(*fields)[:size])
+        if not page:
+            return
+        yield page
+        last_id = page[-1]['id']
+
+
+def terminal_features(size=CHUNK_SIZE):
+    from api.models import Terminal
+
+    fields = (
+        'id', 'name', 'description', 'latitude', 'longitude', 'rating',
+        'city_id', 'city__name', 'city__region_id', 'city__region__name',
+    )
+    for page in _pages(Terminal.objects.filter(verified=True), fields, size):
+        for row in page:
+            yield {
+                'type': 'Feature',
+                'id': f"terminal.{row['id']}",
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [float(row['longitude']), float(row['latitude'])],
+                },
+                'properties': {
+                    'feature_type': 'terminal',
+                    'id': row['id'],
+                    'name': row['name'],
+                    'description': row['description'],
+                    'rating': row['rating'],
+                    'city_id': row['city_id'],
+                    'city': row['city__name'],
+                    'region_id': row['city__region_id'],
+                    'region': row['city__region__name'],
+                    'verified': True,
+                },
+            }
+
+
+def route_features(size=CHUNK_SIZE):
+    from api.models import Route, RouteStop
+
+    fields = (
+        'id', 'terminal_id', 'terminal__latitude', 'terminal__longitude', 'destination_name',
+        'description', 'polyline', 'mode__mode_name', 'mode__fare_type',
+    )
+    routes = Route.objects.filter(verified=True, terminal__verified=True)
+    for page in _pages(routes, fields, size):
+        stops = {}
+        for stop in RouteStop.objects.filter(route_id__in=[row['id'] for row in page]).order_by(
+            'route_id', 'order'
+        ).values('id', 'route_id', 'stop_name', 'terminal_id', 'fare', 'distance', 'time', 'order', 'latitude', 'longitude'):
+            stops.setdefault(stop.pop('route_id'), []).append(stop)
+
+        for row in page:
+            route_stops = [
+                {
+                    'id': stop['id'],
+                    'stop_name': stop['stop_name'],
+                    'order': stop['order'],
+                    'terminal_id': stop['terminal_id'],
+                    'fare': _float(stop['fare']),
+                    'distance': _float(stop['distance']),
+                    'time': stop['time'],
+                    'latitude': _float(stop['latitude']),
+                    'longitude': _float(stop['longitude']),
+                }
+                for stop in stops.get(row['id'], [])
+            ]
+
+            coordinates = [[lng, lat] for lat, lng in coerce_polyline(row['polyline'])]
+            if len(coordinates) < 2:
+                coordinates = [[float(row['terminal__longitude']), float(row['terminal__latitude'])]] + [
+                    [stop['longitude'], stop['latitude']]
+                    for stop in route_stops
+                    if stop['latitude'] is not None and stop['longitude'] is not None
+                ]
+
+            yield {
+                'type': 'Feature',
+                'id': f"route.{row['id']}",
+                'geometry': {'type': 'LineString', 'coordinates': coordinates} if len(coordinates) >= 2 else None,
+                'properties': {
+                    'feature_type': 'route',
+                    'id': row['id'],
+                    'terminal_id': row['terminal_id'],
+                    'destination_name': row['destination_name'],
+                    'description': row['description'],
+                    'mode': row['mode__mode_name'],
+                    'fare_type': row['mode__fare_type'],
+                    'verified': True,
+                    'stops': route_stops,
+                },
+            }
+
+
+def feature_collection(layers=LAYERS, export_timestamp=None):
+    """
+    Yield a GeoJSON FeatureCollection as text chunks, one feature at a time.
+
+    Args:
+        layers: Any of 'terminals' and 'routes'
+    """
+    header = {'type': 'FeatureCollection'}
+    if export_timestamp is not None:
+        header['export_timestamp'] = export_timestamp
+    yield json.dumps(header)[:-1] + ', "features": ['
+
+    # Features are batched into ~64 KB writes
+    buffer, buffered, separator = [], 0, ''
+    for layer, features in (('terminals', terminal_features), ('routes', route_features)):
+        if layer not in layers:
+            continue
+        for feature in features():
+            text = separator + json.dumps(feature)
+            separator = ','
+            buffer.append(text)
+            buffered += len(text)
+            if buffered >= WRITE_SIZE:
+                yield ''.join(buffer)
+                buffer, buffered = [], 0
+    buffer.append(']}\n')
+    yield ''.join(buffer)
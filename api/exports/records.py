@@ -0,0 +1,374 @@
+"""
+Export Records
+
+Fast path for the bulk JSON exports (`/complete/`, `/export/*` and update_export_cache,
+see CachedExportBuild).
+Builds exactly what RegionSerializer, TerminalSerializer and RouteSerializer return,
+but from `.values_list()` tuples assembled straight into dicts, one query per level of
+the tree, without instantiating models or serializer fields per row.
+
+Decimals are formatted the way DRF's DecimalField does (as strings with the model
+field's decimal places, which is how the database already returns them), and route
+geometry columns are only read when the requested polyline format uses them. The output
+is identical to the serializers'; api/tests.py checks the two stay in step. Use the
+serializers for anything that is not a bulk export.
+"""
+
+import itertools
+import json
+import operator
+import tempfile
+
+from api.serializers import represent_polyline
+
+# Rows fetched per database round trip and JSON text kept in memory per spooled export
+CHUNK_SIZE = 2000
+SPOOL_MAX_BYTES = 4 * 1024 * 1024
+WRITE_SIZE = 64 * 1024
+# Characters of an export handed to the database and compressors at a time
+READ_SIZE = 1024 * 1024
+
+ROUTE_COLUMNS = ('id', 'terminal_id', 'mode_id', 'verified', 'description', 'added_by_id')
+STOP_COLUMNS = ('id', 'route_id', 'stop_name', 'fare', 'distance', 'time', 'order', 'latitude', 'longitude', 'terminal_id')
+TERMINAL_COLUMNS = (
+    'id', 'name', 'description', 'latitude', 'longitude', 'city_id', 'city__name', 'city__region_id',
+    'verified', 'rating', 'added_by_id',
+)
+
+
+def _decimal(value):
+    # DecimalField values come back from the database at the field's scale already
+    return f'{value:f}' if value is not None else None
+
+
+def _geometry_columns(context):
+    """Route columns `represent_polyline` reads for the requested format"""
+    polyline_format = context.get('polyline', 'raw')
+    if polyline_format == 'none':
+        return ()
+    columns = ('polyline',) if polyline_format == 'raw' else ('encoded_polyline',)
+    if polyline_format == 'encoded' or context.get('simplify'):
+        columns += ('polyline_precision',)
+    if context.get('simplify'):
+        columns += ('polyline_variants',)
+    return columns
+
+
+def _mode_rows():
+    from api.models import ModeOfTransport
+
+    return list(ModeOfTransport.objects.values_list('id', 'mode_name', 'fare_type'))
+
+
+def _modes(rows):
+    from api.models import ModeOfTransport
+
+    labels = dict(ModeOfTransport.MODE_CHOICES)
+    return {
+        mode_id: {
+            'id': mode_id,
+            'mode_name': mode_name,
+            'mode_display': str(labels.get(mode_name, mode_name)),
+            'fare_type': fare_type,
+        }
+        for mode_id, mode_name, fare_type in rows
+    }
+
+
+def _stops_by_route(rows):
+    stops = {}
+    for stop_id, route_id, name, fare, distance, time, order, lat, lng, terminal_id in rows:
+        stops.setdefault(route_id, []).append({
+            'id': stop_id,
+            'stop_name': name,
+            'fare': _decimal(fare),
+            'distance': _decimal(distance),
+            'time': time,
+            'order': order,
+            'latitude': _decimal(lat),
+            'longitude': _decimal(lng),
+            'terminal': terminal_id,
+        })
+    return stops
+
+
+def _routes(rows, stops, modes, context):
+    """(terminal_id, route dict) for every row read with ROUTE_COLUMNS + `_geometry_columns(context)`"""
+    geometry_columns = _geometry_columns(context)
+    records = []
+    for route_id, terminal_id, mode_id, verified, description, added_by, *geometry in rows:
+        geometry = dict(zip(geometry_columns, geometry))
+        data = {
+            'id': route_id,
+            'mode': modes[mode_id],
+            'verified': verified,
+            'description': description,
+            'polyline': geometry.get('polyline'),
+            'stops': stops.get(route_id, []),
+            'added_by': added_by,
+        }
+        records.append((terminal_id, represent_polyline(
+            data,
+            geometry.get('encoded_polyline'),
+            geometry.get('polyline_precision'),
+            geometry.get('polyline_variants'),
+            context,
+        )))
+    return records
+
+
+def _terminals(rows, routes_by_terminal):
+    return [
+        {
+            'id': terminal_id,
+            'name': name,
+            'description': description,
+            'latitude': _decimal(lat),
+            'longitude': _decimal(lng),
+            'city': {'id': city_id, 'name': city_name, 'region': region_id},
+            'verified': verified,
+            'rating': rating,
+            'routes': routes_by_terminal.get(terminal_id, []),
+            'added_by': added_by,
+        }
+        for terminal_id, name, description, lat, lng, city_id, city_name, region_id, verified, rating, added_by in rows
+    ]
+
+
+def _regions(region_rows, city_rows, terminals):
+    terminals_by_city = {}
+    for data in terminals:
+        terminals_by_city.setdefault(data['city']['id'], []).append(data)
+
+    cities_by_region = {}
+    for city_id, name, region_id in city_rows:
+        cities_by_region.setdefault(region_id, []).append({
+            'id': city_id,
+            'name': name,
+            'region': region_id,
+            'terminals': terminals_by_city.get(city_id, []),
+        })
+
+    return [
+        {'id': region_id, 'name': name, 'cities': cities_by_region.get(region_id, [])}
+        for region_id, name in region_rows
+    ]
+
+
+def _group(records):
+    grouped = {}
+    for key, data in records:
+        grouped.setdefault(key, []).append(data)
+    return grouped
+
+
+def _route_records(routes, context):
+    from api.models import RouteStop
+
+    rows = list(routes.values_list(*ROUTE_COLUMNS, *_geometry_columns(context)))
+    stops = RouteStop.objects.filter(route_id__in=[row[0] for row in rows]).values_list(*STOP_COLUMNS)
+    return _routes(rows, _stops_by_route(stops), _modes(_mode_rows()), context)
+
+
+def route_records(routes, context=None):
+    """RouteSerializer(routes, many=True, context=context).data as plain dicts"""
+    return [data for _, data in _route_records(routes, context or {})]
+
+
+def terminal_records(terminals, context=None):
+    """TerminalSerializer(terminals, many=True, context=context).data as plain dicts"""
+    from api.models import Route
+
+    rows = list(terminals.values_list(*TERMINAL_COLUMNS))
+    verified_routes = Route.objects.filter(verified=True, terminal_id__in=[row[0] for row in rows])
+    return _terminals(rows, _group(_route_records(verified_routes, context or {})))
+
+
+def region_records(regions, context=None):
+    """RegionSerializer(regions, many=True, context=context).data as plain dicts"""
+    from api.models import City, Terminal
+
+    regions = list(regions.values_list('id', 'name'))
+    cities = list(City.objects.filter(region_id__in=[row[0] for row in regions]).values_list('id', 'name', 'region_id'))
+    terminals = terminal_records(Terminal.objects.filter(city_id__in=[row[0] for row in cities]), context)
+    return _regions(regions, cities, terminals)
+
+
+class _Spool:
+    """JSON text written piecewise to a spooled temporary file, measuring it on the way"""
+
+    def __init__(self, max_size):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_size, mode='w+', encoding='utf-8')
+        self.buffer = []
+        self.buffered = 0
+        self.size = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        self.size += len(text)
+        if self.buffered >= WRITE_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.file.write(''.join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def chunks(self, size):
+        """Yield the text written so far in pieces of at most `size` characters"""
+        self.flush()
+        self.file.seek(0)
+        while True:
+            text = self.file.read(size)
+            if not text:
+                return
+            yield text
+
+    def close(self):
+        self.file.close()
+
+
+class _Groups:
+    """Consecutive rows of a sorted row iterator sharing the value at `key_index`"""
+
+    def __init__(self, rows, key_index):
+        self.groups = itertools.groupby(rows, key=operator.itemgetter(key_index))
+        self._advance()
+
+    def _advance(self):
+        self.key, self.rows = next(self.groups, (None, None))
+
+    def take(self, key):
+        """Yield the rows for `key` (parents are walked in the same order as the rows)"""
+        if self.rows is None or self.key != key:
+            return
+        yield from self.rows
+        self._advance()
+
+
+def _open(data, children):
+    """JSON text of `data` up to the opening bracket of its `children` list"""
+    return json.dumps({**data, children: []})[:-2]
+
+
+class CachedExportBuild:
+    """
+    The four cached exports, streamed as JSON text into spooled temporary files.
+
+    Regions and cities (bounded by geography) are read up front; terminals, verified
+    routes and their stops are walked with `.iterator()` in the same region -> city ->
+    terminal -> route order and merged group by group, so only one terminal's routes and
+    stops are in memory at a time. Each terminal and route is written once as JSON text to
+    every export that contains it while sizes and record counts are tallied, and spools
+    larger than `spool_size` move to disk. The complete and regions exports share one
+    spooled region tree; the terminals and routes exports list their records in tree order.
+
+    `payloads()` hands each export back in pieces of at most `read_size` characters, so
+    nothing downstream has to hold a whole export either.
+    """
+
+    chunk_size = CHUNK_SIZE
+    spool_size = SPOOL_MAX_BYTES
+    read_size = READ_SIZE
+
+    def __init__(self, context=None, chunk_size=None, spool_size=None, read_size=None):
+        self.context = context or {}
+        self.chunk_size = chunk_size or self.chunk_size
+        self.spool_size = spool_size or self.spool_size
+        self.read_size = read_size or self.read_size
+
+    def build(self):
+        from api.models import City, Region, Route, RouteStop, Terminal
+
+        self.tree = _Spool(self.spool_size)
+        self.terminals = _Spool(self.spool_size)
+        self.routes = _Spool(self.spool_size)
+        self.region_count = self.terminal_count = self.route_count = 0
+
+        regions = list(Region.objects.order_by('id').values_list('id', 'name'))
+        cities = {}
+        for city_id, name, region_id in City.objects.order_by('id').values_list('id', 'name', 'region_id'):
+            cities.setdefault(region_id, []).append((city_id, name))
+        modes = _modes(_mode_rows())
+
+        terminal_groups = _Groups(
+            Terminal.objects.order_by('city__region_id', 'city_id', 'id').values_list(*TERMINAL_COLUMNS)
+            .iterator(chunk_size=self.chunk_size),
+            TERMINAL_COLUMNS.index('city_id'),
+        )
+        route_groups = _Groups(
+            Route.objects.filter(verified=True)
+            .order_by('terminal__city__region_id', 'terminal__city_id', 'terminal_id', 'id')
+            .values_list(*ROUTE_COLUMNS, *_geometry_columns(self.context))
+            .iterator(chunk_size=self.chunk_size),
+            ROUTE_COLUMNS.index('terminal_id'),
+        )
+        stop_groups = _Groups(
+            RouteStop.objects.filter(route__verified=True)
+            .order_by('route__terminal__city__region_id', 'route__terminal__city_id', 'route__terminal_id', 'route_id', 'order', 'id')
+            .values_list(*STOP_COLUMNS)
+            .iterator(chunk_size=self.chunk_size),
+            STOP_COLUMNS.index('route_id'),
+        )
+
+        for region_id, region_name in regions:
+            self.tree.write((', ' if self.region_count else '') + _open({'id': region_id, 'name': region_name}, 'cities'))
+            self.region_count += 1
+            for c, (city_id, city_name) in enumerate(cities.get(region_id, [])):
+                self.tree.write((', ' if c else '') + _open(
+                    {'id': city_id, 'name': city_name, 'region': region_id}, 'terminals'
+                ))
+                for t, row in enumerate(terminal_groups.take(city_id)):
+                    self._terminal(row, route_groups, stop_groups, modes, first=not t)
+                self.tree.write(']}')
+            self.tree.write(']}')
+        return self
+
+    def _terminal(self, row, route_groups, stop_groups, modes, first):
+        terminal_id = row[0]
+        route_rows = list(route_groups.take(terminal_id))
+        stops = _stops_by_route(stop for route in route_rows for stop in stop_groups.take(route[0]))
+        routes = [data for _, data in _routes(route_rows, stops, modes, self.context)]
+        data = _terminals([row], {terminal_id: routes})[0]
+
+        text = json.dumps(data)
+        self.tree.write(text if first else ', ' + text)
+        if data['verified']:
+            self.terminals.write(', ' + text if self.terminal_count else text)
+            self.terminal_count += 1
+        for route in routes:
+            text = json.dumps(route)
+            self.routes.write(', ' + text if self.route_count else text)
+            self.route_count += 1
+
+    def payloads(self, export_timestamp):
+        """
+        Yield (export_type, chunks, size, record_count) for each export, where `chunks`
+        is an iterator over the export's JSON text and `size` its length. Consume each
+        `chunks` before moving on to the next export.
+        """
+        timestamp = json.dumps(export_timestamp)
+        complete_suffix = (
+            '], "last_updated": ' + timestamp
+            + f', "total_terminals": {self.terminal_count}, "total_routes": {self.route_count}'
+            + ', "export_timestamp": ' + timestamp + '}'
+        )
+        exports = (
+            ('complete', '{"regions": [', self.tree, complete_suffix, self.region_count),
+            ('regions', '{"regions": [', self.tree, '], "export_timestamp": ' + timestamp + '}', self.region_count),
+            ('terminals', '{"terminals": [', self.terminals, '], "export_timestamp": ' + timestamp + '}', self.terminal_count),
+            ('routes', '{"routes": [', self.routes, '], "export_timestamp": ' + timestamp + '}', self.route_count),
+        )
+        for export_type, prefix, spool, suffix, record_count in exports:
+            size = len(prefix) + spool.size + len(suffix)
+            yield export_type, self._chunks(prefix, spool, suffix), size, record_count
+
+    def _chunks(self, prefix, spool, suffix):
+        yield prefix
+        yield from spool.chunks(self.read_size)
+        yield suffix
+
+    def close(self):
+        for spool in (self.tree, self.terminals, self.routes):
+            spool.close()
@@ -0,0 +1,105 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import Region, City, Terminal
+from api.routing.snapping import TerminalIndex, search_terminals
+from api.routing.synthetic import generate_network, PH_BOUNDS
+from api.utils.geo import geohash_encode
+
+class Command(BaseCommand):
+    help = 'Benchmark the in-memory terminal index against the database radius search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cities', type=int, default=200)
+        parser.add_argument('--terminals-per-city', type=int, default=25)
+        parser.add_argument('--queries', type=int, default=300)
+        parser.add_argument('--radius', type=float, default=10, help='Radius for radius queries (km)')
+        parser.add_argument('--limit', type=int, default=10, help='k for k-nearest queries')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        terminals, _, _ = generate_network(
+            cities=options['cities'],
+            terminals_per_city=options['terminals_per_city'],
+            seed=options['seed'],
+        )
+
+        # Synthetic terminals live only inside this transaction
+        with transaction.atomic():
+            region = Region.objects.create(name='Benchmark')
+            city = City.objects.create(name='Benchmark', region=region)
+            rows = []
+            seen = set()
+            for _, name, lat, lng in terminals:
+                lat, lng = round(lat, 6), round(lng, 6)
+                if (lat, lng) in seen:
+                    continue
+                seen.add((lat, lng))
+                rows.append(Terminal(
+                    name=name, latitude=Decimal(str(lat)), longitude=Decimal(str(lng)),
+                    city=city, verified=True, geohash=geohash_encode(lat, lng),
+                ))
+            Terminal.objects.bulk_create(rows, batch_size=2000)
+            self.stdout.write(f"Inserted {len(rows)} synthetic terminals")
+
+            started = time.perf_counter()
+            ids, lats, lngs = [], [], []
+            for terminal_id, lat, lng in Terminal.objects.filter(verified=True).values_list('id', 'latitude', 'longitude'):
+                ids.append(terminal_id)
+                lats.append(float(lat))
+                lngs.append(float(lng))
+            index = TerminalIndex(ids, lats, lngs)
+            self.stdout.write(f"Index built over {len(index)} terminals ({time.perf_counter() - started:.2f}s)")
+
+            min_lat, max_lat, min_lng, max_lng = PH_BOUNDS
+            points = [
+                (rng.uniform(min_lat, max_lat), rng.uniform(min_lng, max_lng))
+                for _ in range(options['queries'])
+            ]
+            radius, limit = options['radius'], options['limit']
+
+            mismatches = 0
+            results = {}
+            for label, db_query, index_query in (
+                (
+                    f"radius {radius:g} km",
+                    lambda lat, lng: search_terminals(lat, lng, radius_km=radius),
+                    lambda lat, lng: index.nearest(lat, lng, k=None, radius_km=radius),
+                ),
+                (
+                    f"{limit} nearest",
+                    lambda lat, lng: search_terminals(lat, lng, limit=limit),
+                    lambda lat, lng: index.nearest(lat, lng, k=limit, radius_km=200),
+                ),
+            ):
+                started = time.perf_counter()
+                db_hits = [db_query(lat, lng) for lat, lng in points]
+                db_ms = (time.perf_counter() - started) * 1000 / len(points)
+
+                started = time.perf_counter()
+                index_hits = [index_query(lat, lng) for lat, lng in points]
+                index_ms = (time.perf_counter() - started) * 1000 / len(points)
+
+                mismatches += sum(
+                    1 for a, b in zip(db_hits, index_hits)
+                    if [terminal_id for terminal_id, _ in a] != [terminal_id for terminal_id, _ in b]
+                )
+                results[label] = (db_ms, index_ms)
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"\nQueries: {len(points)} per mode")
+        for label, (db_ms, index_ms) in results.items():
+            self.stdout.write(f"{label}:")
+            self.stdout.write(f"  Database (geohash):   {db_ms:8.3f} ms/query")
+            self.stdout.write(f"  NumPy index:          {index_ms:8.3f} ms/query")
+            self.stdout.write(f"  Speedup:              {db_ms / max(index_ms, 1e-9):8.1f}x")
+
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} queries returned different terminals"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Index results match the database search"))
@@ -0,0 +1,74 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from api.routing.graph import TransitGraph
+from api.routing.contraction import ContractionHierarchy
+from api.routing.raptor import pareto_search, MAX_ROUNDS
+from api.routing.synthetic import generate_network
+
+class Command(BaseCommand):
+    help = 'Benchmark journey planner search strategies on a synthetic nationwide network'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cities', type=int, default=200)
+        parser.add_argument('--terminals-per-city', type=int, default=25)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        started = time.perf_counter()
+        terminals, routes, stops = generate_network(
+            cities=options['cities'],
+            terminals_per_city=options['terminals_per_city'],
+            seed=options['seed'],
+        )
+        graph = TransitGraph.from_rows(terminals, routes, stops)
+        self.stdout.write(
+            f"Synthetic network: {graph.node_count} nodes, {graph.edge_count} edges, "
+            f"{len(graph.route_id)} routes ({time.perf_counter() - started:.2f}s)"
+        )
+
+        started = time.perf_counter()
+        hierarchy = ContractionHierarchy.build(graph)
+        self.stdout.write(
+            f"Contraction hierarchy: {hierarchy.meta['shortcut_count']} shortcuts "
+            f"({time.perf_counter() - started:.2f}s)"
+        )
+
+        terminal_nodes = list(graph.terminal_node.values())
+        pairs = [tuple(rng.sample(terminal_nodes, 2)) for _ in range(options['queries'])]
+
+        def path_cost(path):
+            return None if path is None else sum(graph.edge_weight[e] for e in path)
+
+        started = time.perf_counter()
+        baseline = [path_cost(graph.shortest_path(s, t)) for s, t in pairs]
+        dijkstra_ms = (time.perf_counter() - started) * 1000 / len(pairs)
+
+        started = time.perf_counter()
+        contracted = [path_cost(hierarchy.shortest_path(s, t)) for s, t in pairs]
+        ch_ms = (time.perf_counter() - started) * 1000 / len(pairs)
+
+        started = time.perf_counter()
+        pareto_sizes = [len(pareto_search(graph, s, t, max_rounds=MAX_ROUNDS)[0]) for s, t in pairs]
+        raptor_ms = (time.perf_counter() - started) * 1000 / len(pairs)
+
+        mismatches = sum(1 for a, b in zip(baseline, contracted) if a != b)
+        reachable = sum(1 for cost in baseline if cost is not None)
+
+        self.stdout.write(f"\nQueries: {len(pairs)} ({reachable} reachable)")
+        self.stdout.write(f"Dijkstra:               {dijkstra_ms:8.3f} ms/query")
+        self.stdout.write(f"Contraction hierarchy:  {ch_ms:8.3f} ms/query")
+        self.stdout.write(f"Speedup:                {dijkstra_ms / max(ch_ms, 1e-9):8.1f}x")
+        self.stdout.write(
+            f"Pareto RAPTOR:          {raptor_ms:8.3f} ms/query "
+            f"(avg {sum(pareto_sizes) / len(pairs):.1f} journeys)"
+        )
+
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} queries returned different travel times"))
+        else:
+            self.stdout.write(self.style.SUCCESS("All travel times match plain Dijkstra"))
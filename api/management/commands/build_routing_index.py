@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from api.models import CachedExport
+from api.routing.graph import build_graph
+from api.routing.contraction import ContractionHierarchy
+
+class Command(BaseCommand):
+    help = 'Build the graph snapshot and contraction hierarchy used by the journey planner'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-hierarchy',
+            action='store_true',
+            help='Only write the memory-mapped graph snapshot',
+        )
+
+    def handle(self, *args, **options):
+        version = CachedExport.current_version()
+        self.stdout.write(self.style.SUCCESS(f"Building routing index for data version {version}..."))
+
+        started = time.perf_counter()
+        graph = build_graph(version)
+        self.stdout.write(f"Graph: {graph.node_count} nodes, {graph.edge_count} edges ({time.perf_counter() - started:.2f}s)")
+
+        path = graph.save_snapshot()
+        self.stdout.write(self.style.SUCCESS(f"Graph snapshot written to {path} ({path.stat().st_size / 1024:.1f} KB)"))
+
+        if options['skip_hierarchy']:
+            return
+
+        started = time.perf_counter()
+        hierarchy = ContractionHierarchy.build(graph)
+        self.stdout.write(
+            f"Contracted: {hierarchy.meta['shortcut_count']} shortcuts ({time.perf_counter() - started:.2f}s)"
+        )
+
+        path = hierarchy.save()
+        self.stdout.write(self.style.SUCCESS(f"\nRouting index written to {path}"))
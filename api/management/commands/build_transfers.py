@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from api.routing.transfers import rebuild_transfers, walk_radius_m
+
+class Command(BaseCommand):
+    help = 'Precompute walking transfer edges between route stops and nearby terminals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--radius', type=int, default=None,
+            help='Walking radius in meters (default: TRANSFER_WALK_RADIUS_M)'
+        )
+
+    def handle(self, *args, **options):
+        radius = options['radius'] or walk_radius_m()
+        self.stdout.write(self.style.SUCCESS(f"Building walking transfers within {radius} m..."))
+
+        started = time.perf_counter()
+        total = rebuild_transfers(radius)
+        self.stdout.write(self.style.SUCCESS(
+            f"\n{total} transfer edges written ({time.perf_counter() - started:.2f}s)"
+        ))
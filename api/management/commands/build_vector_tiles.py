@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from api.routing.graph import get_graph
+from api.maps.mvt import encode_tile, prune_tile_store, save_tile, store_version, tile_store_dir
+from api.maps.tiles import TileSource
+
+class Command(BaseCommand):
+    help = 'Pre-generate Mapbox Vector Tiles of terminals and routes into the local tile store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-zoom', type=int, default=8)
+        parser.add_argument('--max-zoom', type=int, default=14)
+        parser.add_argument(
+            '--keep-old',
+            action='store_true',
+            help='Keep tiles generated for previous data versions',
+        )
+
+    def handle(self, *args, **options):
+        graph = get_graph()
+        version = store_version(graph.data_version, graph.change_id)
+        self.stdout.write(self.style.SUCCESS(
+            f"Generating vector tiles for data version {graph.data_version}, change #{graph.change_id}..."
+        ))
+
+        started = time.perf_counter()
+        source = TileSource(graph)
+        self.stdout.write(
+            f"Tile source: {len(source.terminal_id)} terminals, {len(source.route)} route lines "
+            f"({time.perf_counter() - started:.2f}s)"
+        )
+
+        total_tiles = total_bytes = 0
+        for z in range(options['min_zoom'], options['max_zoom'] + 1):
+            timings = []
+            written = size = 0
+            for x, y in source.covering_tiles(z):
+                started = time.perf_counter()
+                data = encode_tile(source, z, x, y)
+                timings.append((time.perf_counter() - started) * 1000)
+                if data:
+                    save_tile(version, z, x, y, data)
+                    written += 1
+                    size += len(data)
+
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95)] if timings else 0
+            mean = sum(timings) / len(timings) if timings else 0
+            self.stdout.write(
+                f"z{z}: {written} tiles, {size / 1024:.1f} KB, "
+                f"encode {mean:.2f} ms/tile (p95 {p95:.2f} ms)"
+            )
+            total_tiles += written
+            total_bytes += size
+
+        if not options['keep_old']:
+            prune_tile_store(version)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\n{total_tiles} tiles ({total_bytes / 1024:.1f} KB) written to {tile_store_dir(version)}"
+        ))
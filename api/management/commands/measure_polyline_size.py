@@ -0,0 +1,55 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.models import CachedExport, Route
+from api.utils.geo import coerce_polyline
+from api.utils.polyline import encode_polyline, DEFAULT_PRECISION
+
+# API responses are rendered without whitespace
+COMPACT = (',', ':')
+
+class Command(BaseCommand):
+    help = 'Measure how much smaller route polylines are as encoded polylines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--precision',
+            type=int,
+            default=getattr(settings, 'POLYLINE_PRECISION', DEFAULT_PRECISION),
+            help='Decimal places kept by the encoding',
+        )
+
+    def handle(self, *args, **options):
+        precision = options['precision']
+        routes = vertices = raw_bytes = encoded_bytes = 0
+
+        for polyline in Route.objects.filter(verified=True).exclude(polyline=None).values_list('polyline', flat=True).iterator():
+            points = coerce_polyline(polyline)
+            if not points:
+                continue
+            routes += 1
+            vertices += len(points)
+            raw_bytes += len(json.dumps(polyline, separators=COMPACT).encode())
+            # Quoted, as it appears in a JSON response
+            encoded_bytes += len(json.dumps(encode_polyline(points, precision)).encode())
+
+        if not routes:
+            self.stdout.write(self.style.WARNING("No verified routes have a polyline"))
+            return
+
+        saved = raw_bytes - encoded_bytes
+        self.stdout.write(f"Routes with polylines: {routes} ({vertices} vertices)")
+        self.stdout.write(f"Raw JSON:              {raw_bytes / 1024:10.1f} KB")
+        self.stdout.write(f"Encoded (precision {precision}): {encoded_bytes / 1024:6.1f} KB")
+        self.stdout.write(self.style.SUCCESS(
+            f"Reduction:             {saved / 1024:10.1f} KB ({saved / raw_bytes:.0%} smaller)"
+        ))
+
+        # Every verified route is embedded once in the complete export
+        complete = CachedExport.objects.filter(export_type='complete').first()
+        if complete is not None:
+            size = len(json.dumps(complete.data, separators=COMPACT).encode())
+            self.stdout.write(f"\nComplete export:       {size / 1024:10.1f} KB")
+            self.stdout.write(f"  ?polyline=encoded:   {(size - saved) / 1024:10.1f} KB (estimated)")
+            self.stdout.write(f"  ?polyline=none:      {(size - raw_bytes) / 1024:10.1f} KB (estimated)")
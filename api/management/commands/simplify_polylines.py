@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.models import Route
+from api.utils.geo import coerce_polyline
+from api.utils.polyline import DEFAULT_PRECISION
+from api.utils.simplify import polyline_variants
+
+BATCH_SIZE = 2000
+
+class Command(BaseCommand):
+    help = 'Recompute the per-zoom simplified variants of every route polyline'
+
+    def handle(self, *args, **options):
+        precision = getattr(settings, 'POLYLINE_PRECISION', DEFAULT_PRECISION)
+        started = time.perf_counter()
+        routes = changed = vertices = 0
+
+        last_id = 0
+        while True:
+            batch = list(Route.objects.filter(id__gt=last_id).order_by('id').only('id', 'polyline', 'polyline_variants')[:BATCH_SIZE])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            points = [coerce_polyline(route.polyline) for route in batch]
+            stale = []
+            for route, variants, line in zip(batch, polyline_variants(points, precision), points):
+                vertices += len(line)
+                if route.polyline_variants != variants:
+                    route.polyline_variants = variants
+                    stale.append(route)
+            Route.objects.bulk_update(stale, ['polyline_variants'])
+            routes += len(batch)
+            changed += len(stale)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Simplified {routes} routes ({vertices} vertices, {changed} updated) "
+            f"in {time.perf_counter() - started:.2f}s"
+        ))
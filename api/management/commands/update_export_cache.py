@@ -1,7 +1,58 @@
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import JSONField, TextField, Value
+from django.db.models.functions import Cast
 from django.utils import timezone
-from api.models import CachedExport, Region, Terminal, Route
-from api.serializers import RegionSerializer, TerminalSerializer, RouteSerializer
+from api.models import CachedExport, GraphChange
+from api.exports.records import CachedExportBuild, READ_SIZE
+from api.exports.compression import ExportCompressor
+from api.maps.clusters import build_cluster_index
+from api.routing.contraction import ContractionHierarchy
+from api.routing.graph import build_graph
+
+# COPY text format: backslash escapes; json.dumps never emits raw newlines or tabs,
+# but escaping them too keeps the body one row whatever the text holds
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+class ExportReader:
+    """
+    Read-only file over an export's text chunks (as COPY FROM STDIN reads it), feeding
+    every chunk to the compressors as it is consumed.
+    """
+
+    def __init__(self, chunks, compressor, escape=False):
+        self.chunks = iter(chunks)
+        self.compressor = compressor
+        self.escape = escape
+        self.buffer = ''
+        self.offset = 0
+
+    def _next_chunk(self):
+        text = next(self.chunks, None)
+        if text is None:
+            return False
+        self.compressor.write(text)
+        self.buffer = self.buffer[self.offset:] + (text.translate(COPY_ESCAPES) if self.escape else text)
+        self.offset = 0
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self.buffer[self.offset:]]
+            for text in self.chunks:
+                self.compressor.write(text)
+                parts.append(text.translate(COPY_ESCAPES) if self.escape else text)
+            self.buffer, self.offset = '', 0
+            return ''.join(parts)
+        while len(self.buffer) - self.offset < size and self._next_chunk():
+            pass
+        text = self.buffer[self.offset:self.offset + size]
+        self.offset += len(text)
+        return text
+
 
 class Command(BaseCommand):
     help = 'Update cached JSON exports in database'
@@ -9,96 +60,108 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         timestamp = timezone.now()
         version = timestamp.strftime("%Y%m%d_%H%M%S")
-        
+        timings = {}
+
         self.stdout.write(self.style.SUCCESS("Updating export cache..."))
-        
-        # 1. Complete Export
-        self.stdout.write("Generating complete export...")
-        regions = Region.objects.prefetch_related(
-            'city_set__terminals__origin_routes__stops',
-            'city_set__terminals__origin_routes__mode'
-        ).all()
-        
-        complete_data = {
-            'regions': RegionSerializer(regions, many=True).data,
-            'last_updated': timestamp.isoformat(),
-            'total_terminals': Terminal.objects.filter(verified=True).count(),
-            'total_routes': Route.objects.filter(verified=True).count(),
-            'export_timestamp': timestamp.isoformat(),
-        }
-        
-        cache_obj, created = CachedExport.objects.update_or_create(
-            export_type='complete',
-            defaults={
-                'data': complete_data,
-                'data_version': version
-            }
-        )
-        cache_obj.update_metadata()
-        self.stdout.write(self.style.SUCCESS(f"Complete: {cache_obj.file_size_kb}KB"))
-        
-        # 2. Terminals Only
-        self.stdout.write("Generating terminals export...")
-        terminals = Terminal.objects.filter(verified=True).select_related(
-            "city__region"
-        ).prefetch_related(
-            "origin_routes__mode",
-            "origin_routes__stops"
-        )
-        
-        terminals_data = {
-            'terminals': TerminalSerializer(terminals, many=True).data,
-            'export_timestamp': timestamp.isoformat()
-        }
-        
-        cache_obj, created = CachedExport.objects.update_or_create(
-            export_type='terminals',
-            defaults={
-                'data': terminals_data,
-                'data_version': version
-            }
-        )
-        cache_obj.update_metadata()
-        self.stdout.write(self.style.SUCCESS(f"Terminals: {cache_obj.file_size_kb}KB"))
-        
-        # 3. Routes Only
-        self.stdout.write("Generating routes export...")
-        routes = Route.objects.filter(verified=True).prefetch_related(
-            "stops", "mode", "terminal"
-        )
-        
-        routes_data = {
-            'routes': RouteSerializer(routes, many=True).data,
-            'export_timestamp': timestamp.isoformat()
-        }
-        
-        cache_obj, created = CachedExport.objects.update_or_create(
-            export_type='routes',
-            defaults={
-                'data': routes_data,
-                'data_version': version
-            }
+
+        # 1. Stream all four exports into spooled JSON text
+        self.stdout.write("Streaming regions, cities, terminals, routes and stops...")
+        started = time.perf_counter()
+        build = CachedExportBuild().build()
+        timings['build'] = time.perf_counter() - started
+
+        # 2. Routing graph snapshot and contraction hierarchy, written before the new
+        # version is published so workers that see the version map them instead of each
+        # building a private graph and planning with plain Dijkstra
+        self.stdout.write("Building routing graph snapshot and contraction hierarchy...")
+        started = time.perf_counter()
+        routing = self.write_routing_index(version)
+        timings['routing'] = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(routing))
+
+        # 3. Write all four together so readers never see a mix of versions
+        started = time.perf_counter()
+        sizes = {}
+        try:
+            with transaction.atomic():
+                for export_type, chunks, size, record_count in build.payloads(timestamp.isoformat()):
+                    bodies = self.write_export(export_type, chunks, {
+                        'data_version': version,
+                        'record_count': record_count,
+                        'file_size_kb': size // 1024,
+                        'last_updated': timestamp,
+                    })
+                    sizes[export_type] = f"{size // 1024}KB (" + ", ".join(
+                        f"{field.split('_')[1]} {len(body) // 1024}KB" for field, body in bodies.items() if body is not None
+                    ) + ")"
+        finally:
+            build.close()
+        timings['write'] = time.perf_counter() - started
+        # Graphs built for the new version read the tables after `timestamp`
+        GraphChange.prune(timestamp)
+        for export_type, size in sizes.items():
+            self.stdout.write(self.style.SUCCESS(f"{export_type.capitalize()}: {size}"))
+
+        # 4. Map Clusters
+        self.stdout.write("Building map cluster index...")
+        started = time.perf_counter()
+        cluster_index = build_cluster_index(version)
+        cluster_index.save()
+        timings['clusters'] = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Clusters: {len(cluster_index)} terminals, {cluster_index.meta['cluster_count']} clusters"
+        ))
+
+        self.stdout.write("Timings: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
+        self.stdout.write(self.style.SUCCESS(f"\nAll exports cached! Version: {version}"))
+
+    def write_routing_index(self, version):
+        """
+        Build the graph from the tables and store it and its contraction hierarchy as the
+        routing index for `version`; returns a summary
+        """
+        graph = build_graph(version)
+        graph.save_snapshot()
+        hierarchy = ContractionHierarchy.build(graph)
+        hierarchy.save()
+        return (
+            f"Routing graph: {graph.node_count} nodes, {graph.edge_count} edges, "
+            f"{hierarchy.meta['shortcut_count']} shortcuts"
         )
-        cache_obj.update_metadata()
-        self.stdout.write(self.style.SUCCESS(f"Routes: {cache_obj.file_size_kb}KB"))
-        
-        # 4. Regions/Cities Only
-        self.stdout.write("Generating regions export...")
-        regions_simple = Region.objects.prefetch_related("city_set")
-        
-        regions_data = {
-            'regions': RegionSerializer(regions_simple, many=True).data,
-            'export_timestamp': timestamp.isoformat()
-        }
-        
-        cache_obj, created = CachedExport.objects.update_or_create(
-            export_type='regions',
-            defaults={
-                'data': regions_data,
-                'data_version': version
-            }
+
+    def write_export(self, export_type, chunks, fields):
+        """
+        Store one export's JSON text with a single write of data, fed to the compressors
+        on the way. On PostgreSQL the text is streamed with COPY into a temporary table
+        and cast into data from there, so it is never held whole here; other databases
+        (local development) take it as one value.
+
+        Returns:
+            The compressed bodies that were stored
+        """
+        # only('id'): loading the previous version's data would hold a whole export
+        export, _ = CachedExport.objects.only('id').get_or_create(
+            export_type=export_type, defaults={'data': {}, 'data_version': fields['data_version']}
         )
-        cache_obj.update_metadata()
-        self.stdout.write(self.style.SUCCESS(f"Regions: {cache_obj.file_size_kb}KB"))
-        
-        self.stdout.write(self.style.SUCCESS(f"\nAll exports cached! Version: {version}"))
\ No newline at end of file
+        rows = CachedExport.objects.filter(pk=export.pk)
+        compressor = ExportCompressor()
+        if connection.vendor == 'postgresql':
+            # The temporary table lives until the surrounding transaction commits
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("CREATE TEMP TABLE IF NOT EXISTS export_body (body text) ON COMMIT DROP")
+                cursor.execute("TRUNCATE export_body")
+                cursor.copy_expert(
+                    "COPY export_body (body) FROM STDIN",
+                    ExportReader(chunks, compressor, escape=True),
+                    size=READ_SIZE,
+                )
+                cursor.execute(
+                    f"UPDATE {CachedExport._meta.db_table} SET data = (SELECT body FROM export_body)::jsonb WHERE id = %s",
+                    [export.pk],
+                )
+        else:
+            text = ExportReader(chunks, compressor).read()
+            rows.update(data=Cast(Value(text, output_field=TextField()), output_field=JSONField()))
+        bodies = compressor.finish()
+        rows.update(**fields, **bodies)
+        return bodies
@@ -0,0 +1 @@
+# Map-facing indexes over verified terminals and routes (clusters, tiles)
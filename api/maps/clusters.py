@@ -0,0 +1,276 @@
+"""
+Terminal Clustering
+
+Zoom-aware point clustering for the map, in the spirit of supercluster. Verified
+terminals are projected to Web Mercator and clustered greedily once per zoom level,
+from the deepest zoom up to the whole-world view: at every level, each item absorbs
+the not-yet-clustered items within RADIUS_PX screen pixels of it, and the merged
+cluster sits at the count-weighted centroid of its members. Each level therefore
+clusters the level below it, giving a hierarchy in which a cluster's expansion zoom
+is simply the zoom right after the one it was formed at.
+
+Levels are stored as flat arrays sorted by projected x, so a viewport query is a
+binary search plus a vectorized y filter. The index is built per export cache data
+version by `update_export_cache`, written next to the routing indexes and
+memory-mapped by every worker.
+"""
+
+import logging
+import threading
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+
+from api.routing.storage import RoutingIndexError, StringTable, map_arrays, routing_data_dir, write_arrays
+from .projection import project, unproject
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'clusters.bin'
+FORMAT_VERSION = 1
+
+# Cluster radius in pixels, relative to a tile EXTENT_PX wide
+RADIUS_PX = 60
+EXTENT_PX = 512
+MIN_ZOOM = 0
+# Zooms above MAX_ZOOM return unclustered terminals
+MAX_ZOOM = 16
+
+
+def _cluster_level(items, zoom):
+    """
+    Cluster one level of items for `zoom`.
+
+    Args:
+        items: List of [x, y, count, ident, formed_zoom] from the level below
+
+    Returns:
+        Items of the next level; newly formed clusters have ident None
+    """
+    radius = RADIUS_PX / (EXTENT_PX * 2 ** zoom)
+    radius_sq = radius * radius
+    grid = {}
+    for i, (x, y, *_) in enumerate(items):
+        grid.setdefault((int(x / radius), int(y / radius)), []).append(i)
+
+    visited = bytearray(len(items))
+    next_items = []
+    for i, item in enumerate(items):
+        if visited[i]:
+            continue
+        visited[i] = 1
+        x, y, count = item[0], item[1], item[2]
+        cx, cy = int(x / radius), int(y / radius)
+        members = []
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for j in grid.get((gx, gy), ()):
+                    if visited[j]:
+                        continue
+                    other = items[j]
+                    if (other[0] - x) ** 2 + (other[1] - y) ** 2 <= radius_sq:
+                        visited[j] = 1
+                        members.append(other)
+
+        if not members:
+            next_items.append(item)
+            continue
+
+        wx, wy, total = x * count, y * count, count
+        for other in members:
+            wx += other[0] * other[2]
+            wy += other[1] * other[2]
+            total += other[2]
+        next_items.append([wx / total, wy / total, total, None, zoom])
+    return next_items
+
+
+class ClusterIndex:
+    """Per-zoom clusters of verified terminals, queryable by viewport"""
+
+    ARRAY_NAMES = (
+        'level_offsets',
+        'item_x', 'item_y', 'item_lat', 'item_lng',
+        'item_count', 'item_ident', 'item_expansion',
+        'point_id', 'point_name_offsets', 'point_name_blob',
+    )
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.data_version = meta.get('data_version')
+        self.arrays = arrays
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, np.asarray(arrays[name]))
+        self.point_name = StringTable(arrays['point_name_offsets'], arrays['point_name_blob'])
+
+    def __len__(self):
+        return len(self.point_id)
+
+    @classmethod
+    def build(cls, points, data_version=None):
+        """
+        Cluster `points` at every zoom from MAX_ZOOM down to MIN_ZOOM.
+
+        Args:
+            points: Iterable of (terminal_id, name, latitude, longitude)
+        """
+        points = sorted(points)
+        # Singletons carry their point index as ident
+        items = [[*project(lat, lng), 1, i, None] for i, (_, _, lat, lng) in enumerate(points)]
+
+        levels = [items]
+        cluster_count = 0
+        for zoom in range(MAX_ZOOM, MIN_ZOOM - 1, -1):
+            items = _cluster_level(items, zoom)
+            for item in items:
+                if item[3] is None:
+                    cluster_count += 1
+                    item[3] = -cluster_count
+            levels.append(items)
+        levels.reverse()
+
+        arrays = {name: array('d') for name in ('item_x', 'item_y', 'item_lat', 'item_lng')}
+        arrays.update({name: array('q') for name in ('level_offsets', 'item_count', 'item_ident', 'item_expansion')})
+        arrays['level_offsets'].append(0)
+        for level in levels:
+            for x, y, count, ident, formed_zoom in sorted(level, key=lambda item: item[0]):
+                # Single terminals keep their exact coordinates
+                lat, lng = points[ident][2:] if ident >= 0 else unproject(x, y)
+                arrays['item_x'].append(x)
+                arrays['item_y'].append(y)
+                arrays['item_lat'].append(lat)
+                arrays['item_lng'].append(lng)
+                arrays['item_count'].append(count)
+                arrays['item_ident'].append(ident)
+                arrays['item_expansion'].append(-1 if formed_zoom is None else formed_zoom + 1)
+            arrays['level_offsets'].append(len(arrays['item_x']))
+
+        arrays['point_id'] = array('q', (terminal_id for terminal_id, *_ in points))
+        arrays['point_name_offsets'], arrays['point_name_blob'] = StringTable.pack(name for _, name, *_ in points)
+
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'data_version': data_version,
+            'point_count': len(points),
+            'cluster_count': cluster_count,
+            'radius_px': RADIUS_PX,
+            'extent_px': EXTENT_PX,
+            'min_zoom': MIN_ZOOM,
+            'max_zoom': MAX_ZOOM,
+            'built_at': datetime.now(timezone.utc).isoformat(),
+        }
+        return cls(meta, arrays)
+
+    def matches(self, data_version):
+        return (
+            self.meta.get('format_version') == FORMAT_VERSION
+            and self.meta.get('data_version') == data_version
+            and self.meta.get('radius_px') == RADIUS_PX
+            and self.meta.get('extent_px') == EXTENT_PX
+            and self.meta.get('min_zoom') == MIN_ZOOM
+            and self.meta.get('max_zoom') == MAX_ZOOM
+        )
+
+    def save(self, path=None):
+        path = path or routing_data_dir() / INDEX_FILENAME
+        write_arrays(path, self.meta, {name: self.arrays[name] for name in self.ARRAY_NAMES})
+        return path
+
+    @classmethod
+    def load(cls, path=None):
+        meta, arrays = map_arrays(path or routing_data_dir() / INDEX_FILENAME)
+        missing = [name for name in cls.ARRAY_NAMES if name not in arrays]
+        if missing:
+            raise RoutingIndexError(f"Cluster index is missing arrays: {missing}")
+        return cls(meta, arrays)
+
+    def clusters(self, min_lng, min_lat, max_lng, max_lat, zoom):
+        """
+        Clusters and single terminals inside a bounding box at `zoom`.
+
+        Returns:
+            List of item dicts, clusters with "type": "cluster" and terminals with
+            "type": "terminal"
+        """
+        zoom = max(MIN_ZOOM, min(int(zoom), MAX_ZOOM + 1))
+        min_x, max_y = project(min_lat, min_lng)
+        max_x, min_y = project(max_lat, max_lng)
+
+        start, end = int(self.level_offsets[zoom - MIN_ZOOM]), int(self.level_offsets[zoom - MIN_ZOOM + 1])
+        xs = self.item_x[start:end]
+        lo = start + int(np.searchsorted(xs, min_x, side='left'))
+        hi = start + int(np.searchsorted(xs, max_x, side='right'))
+        ys = self.item_y[lo:hi]
+        hits = lo + np.flatnonzero((ys >= min_y) & (ys <= max_y))
+
+        items = []
+        for i in hits.tolist():
+            ident = int(self.item_ident[i])
+            if ident >= 0:
+                items.append({
+                    'type': 'terminal',
+                    'id': int(self.point_id[ident]),
+                    'name': self.point_name[ident],
+                    'latitude': float(self.item_lat[i]),
+                    'longitude': float(self.item_lng[i]),
+                })
+            else:
+                items.append({
+                    'type': 'cluster',
+                    'id': -ident,
+                    'count': int(self.item_count[i]),
+                    'latitude': float(self.item_lat[i]),
+                    'longitude': float(self.item_lng[i]),
+                    'expansion_zoom': int(self.item_expansion[i]),
+                })
+        return items
+
+
+def build_cluster_index(data_version=None):
+    from api.models import Terminal
+
+    points = [
+        (terminal_id, name, float(lat), float(lng))
+        for terminal_id, name, lat, lng in Terminal.objects.filter(verified=True).values_list(
+            'id', 'name', 'latitude', 'longitude'
+        ).iterator()
+    ]
+    index = ClusterIndex.build(points, data_version)
+    logger.info(f"Built cluster index v{data_version}: {len(index)} terminals, {index.meta['cluster_count']} clusters")
+    return index
+
+
+def load_cluster_index(data_version):
+    """Map the stored cluster index if it was built for `data_version`, otherwise None"""
+    try:
+        index = ClusterIndex.load()
+    except RoutingIndexError as e:
+        logger.info(f"No cluster index available: {e}")
+        return None
+    if not index.matches(data_version):
+        logger.info("Stored cluster index is stale, building from the database")
+        return None
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_cluster_index():
+    """Process-wide cluster index for the current export cache data version"""
+    global _index
+    from api.models import CachedExport
+
+    version = CachedExport.current_version()
+    index = _index
+    if index is not None and index.data_version == version:
+        return index
+
+    with _index_lock:
+        if _index is None or _index.data_version != version:
+            index = load_cluster_index(version)
+            # An index without terminals is falsy (len 0) but still current
+            _index = index if index is not None else build_cluster_index(version)
+        return _index
@@ -0,0 +1,246 @@
+"""
+Mapbox Vector Tiles
+
+Encoder for the Mapbox Vector Tile 2.1 format, written directly against the spec's
+protobuf schema so no protobuf library or tile server is needed. A tile has two layers:
+
+    terminals: points with id, name, modes and verified
+    routes:    line strings with id, terminal_id, destination_name, mode and verified
+
+Features come from `TileSource.select`, the same selection the JSON tiles use.
+Coordinates are quantized to the tile extent and delta/zigzag encoded with NumPy; only
+the final varint packing runs per integer.
+
+Pre-generated tiles live in `<ROUTING_DATA_DIR>/tiles/<data_version>-<change_id>/<z>/<x>/<y>.mvt`
+(see `python manage.py build_vector_tiles`), keyed by the graph state they were drawn
+from: its data version and the last GraphChange it includes.
+"""
+
+import shutil
+import struct
+
+import numpy as np
+
+from api.routing.storage import routing_data_dir
+from .projection import tile_bounds
+
+EXTENT = 4096
+CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+STORE_DIRNAME = 'tiles'
+
+# Protobuf wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+# Geometry types and commands
+POINT = 1
+LINESTRING = 2
+MOVE_TO = 1
+LINE_TO = 2
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_key(out, field, wire_type):
+    _write_varint(out, (field << 3) | wire_type)
+
+
+def _write_bytes(out, field, data):
+    _write_key(out, field, LENGTH_DELIMITED)
+    _write_varint(out, len(data))
+    out += data
+
+
+def _write_packed(out, field, values):
+    packed = bytearray()
+    for value in values:
+        _write_varint(packed, value)
+    _write_bytes(out, field, packed)
+
+
+def _zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return (values << 1) ^ (values >> 63)
+
+
+def _command(command, count):
+    return (command & 0x7) | (count << 3)
+
+
+def _encode_value(value):
+    out = bytearray()
+    if isinstance(value, bool):
+        _write_key(out, 7, VARINT)
+        _write_varint(out, int(value))
+    elif isinstance(value, int):
+        if value >= 0:
+            _write_key(out, 5, VARINT)
+            _write_varint(out, value)
+        else:
+            _write_key(out, 6, VARINT)
+            _write_varint(out, (value << 1) ^ (value >> 63))
+    elif isinstance(value, float):
+        _write_key(out, 3, FIXED64)
+        out += struct.pack('<d', value)
+    else:
+        _write_bytes(out, 1, str(value).encode())
+    return bytes(out)
+
+
+class Layer:
+    """One named layer being encoded; keys and values are deduplicated across features"""
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def _tags(self, properties):
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            encoded = _encode_value(value)
+            tags.append(self.keys.setdefault(key, len(self.keys)))
+            tags.append(self.values.setdefault(encoded, len(self.values)))
+        return tags
+
+    def add(self, geom_type, geometry, properties, feature_id=None):
+        feature = bytearray()
+        if feature_id is not None:
+            _write_key(feature, 1, VARINT)
+            _write_varint(feature, feature_id)
+        _write_packed(feature, 2, self._tags(properties))
+        _write_key(feature, 3, VARINT)
+        _write_varint(feature, geom_type)
+        _write_packed(feature, 4, geometry)
+        self.features.append(feature)
+
+    def encode(self):
+        out = bytearray()
+        _write_key(out, 15, VARINT)
+        _write_varint(out, 2)
+        _write_bytes(out, 1, self.name.encode())
+        for feature in self.features:
+            _write_bytes(out, 2, feature)
+        for key in self.keys:
+            _write_bytes(out, 3, key.encode())
+        for value in self.values:
+            _write_bytes(out, 4, value)
+        _write_key(out, 5, VARINT)
+        _write_varint(out, EXTENT)
+        return bytes(out)
+
+
+def _line_geometry(parts):
+    """
+    Geometry commands for a (multi) line string.
+
+    Args:
+        parts: List of (xs, ys) integer tile coordinate arrays
+    """
+    geometry = []
+    cursor_x = cursor_y = 0
+    for xs, ys in parts:
+        # Quantization can collapse neighbouring vertices onto one coordinate
+        keep = np.ones(len(xs), dtype=bool)
+        keep[1:] = (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])
+        xs, ys = xs[keep], ys[keep]
+        if len(xs) < 2:
+            continue
+        dx = _zigzag(np.diff(xs, prepend=cursor_x))
+        dy = _zigzag(np.diff(ys, prepend=cursor_y))
+        geometry += [_command(MOVE_TO, 1), int(dx[0]), int(dy[0]), _command(LINE_TO, len(xs) - 1)]
+        deltas = np.empty(2 * (len(xs) - 1), dtype=np.int64)
+        deltas[0::2] = dx[1:]
+        deltas[1::2] = dy[1:]
+        geometry += deltas.tolist()
+        cursor_x, cursor_y = int(xs[-1]), int(ys[-1])
+    return geometry
+
+
+def encode_tile(source, z, x, y):
+    """Vector tile z/x/y of a `TileSource` as MVT bytes (empty tiles encode to b'')"""
+    min_x, min_y, _, _ = tile_bounds(z, x, y)
+    scale = EXTENT * 2 ** z
+
+    def to_tile(xs, ys):
+        return (
+            np.round((xs - min_x) * scale).astype(np.int64),
+            np.round((ys - min_y) * scale).astype(np.int64),
+        )
+
+    hits, routes = source.select(z, x, y)
+    layers = []
+
+    if len(hits):
+        layer = Layer('terminals')
+        txs, tys = to_tile(source.terminal_x[hits], source.terminal_y[hits])
+        for i, tx, ty in zip(hits.tolist(), _zigzag(txs).tolist(), _zigzag(tys).tolist()):
+            terminal_id = int(source.terminal_id[i])
+            layer.add(POINT, [_command(MOVE_TO, 1), tx, ty], {
+                'id': terminal_id,
+                'name': source.graph.node_name[int(source.terminal_node[i])],
+                'modes': ','.join(source.terminal_modes(i)),
+                'verified': True,
+            }, feature_id=terminal_id)
+        layers.append(layer)
+
+    if routes:
+        layer = Layer('routes')
+        for i, runs in routes:
+            geometry = _line_geometry([to_tile(source.line_x[run], source.line_y[run]) for run in runs])
+            if not geometry:
+                continue
+            properties = source.route_properties(i)
+            properties['verified'] = True
+            layer.add(LINESTRING, geometry, properties, feature_id=properties['id'])
+        if layer.features:
+            layers.append(layer)
+
+    out = bytearray()
+    for layer in layers:
+        _write_bytes(out, 3, layer.encode())
+    return bytes(out)
+
+
+def store_version(data_version, change_id):
+    """Tile store key of a graph: its data version and the id of the last GraphChange it includes"""
+    return f"{data_version}-{change_id}"
+
+
+def tile_store_dir(version):
+    """Directory holding the pre-generated vector tiles of store key `version`"""
+    return routing_data_dir() / STORE_DIRNAME / str(version)
+
+
+def stored_tile(version, z, x, y):
+    """Pre-generated tile bytes, or None if the tile was not generated for this store key"""
+    try:
+        return (tile_store_dir(version) / str(z) / str(x) / f'{y}.mvt').read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def save_tile(version, z, x, y, data):
+    path = tile_store_dir(version) / str(z) / str(x) / f'{y}.mvt'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def prune_tile_store(keep_version):
+    """Remove pre-generated tiles of every store key except `keep_version`"""
+    root = routing_data_dir() / STORE_DIRNAME
+    if not root.exists():
+        return
+    for path in root.iterdir():
+        if path.is_dir() and path.name != str(keep_version):
+            shutil.rmtree(path, ignore_errors=True)
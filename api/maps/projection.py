@@ -0,0 +1,41 @@
+"""
+Web Mercator Projection
+
+Map coordinates used by the clustering and tile code. Projected points live in the
+unit square: x grows east from the antimeridian, y grows south from the top of the
+world, so tile (z, x, y) covers [x, x + 1] / 2**z by [y, y + 1] / 2**z.
+"""
+
+import math
+
+import numpy as np
+
+MAX_LATITUDE = 85.05112878
+
+
+def project(lat, lng):
+    """Web Mercator projection of a coordinate to the unit square"""
+    sin = math.sin(math.radians(max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)))
+    x = lng / 360 + 0.5
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return x, min(max(y, 0.0), 1.0)
+
+
+def project_arrays(lats, lngs):
+    """Vectorized `project` over NumPy arrays, returns (xs, ys)"""
+    sin = np.sin(np.radians(np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE)))
+    xs = np.asarray(lngs, dtype=np.float64) / 360 + 0.5
+    ys = 0.5 - 0.25 * np.log((1 + sin) / (1 - sin)) / math.pi
+    return xs, np.clip(ys, 0.0, 1.0)
+
+
+def unproject(x, y):
+    """Inverse of `project`, returns (lat, lng)"""
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return lat, (x - 0.5) * 360
+
+
+def tile_bounds(z, x, y):
+    """Projected (min_x, min_y, max_x, max_y) of tile z/x/y"""
+    size = 1 / 2 ** z
+    return x * size, y * size, (x + 1) * size, (y + 1) * size
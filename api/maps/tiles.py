@@ -0,0 +1,278 @@
+"""
+Map Tiles
+
+Slippy-map tiles (z/x/y) of verified terminals and route geometry, so a client
+viewing one city downloads only what is on screen instead of the complete export.
+
+`TileSource` flattens the routing graph into projected NumPy arrays once per graph
+version: terminal positions, and one line per live route (its stored polyline, or its
+stop sequence when it has none) with a bounding box per route. A tile is rendered by
+masking terminals and route boxes against the buffered tile, keeping only the route
+segments that touch it and dropping consecutive vertices that land on the same pixel
+at the tile's zoom. The same selection feeds the JSON tiles and the vector tiles
+(see `api.maps.mvt`).
+Tiles are rendered lazily and kept as JSON bytes in an LRU tied to the graph version.
+"""
+
+import json
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from api.routing.cache import PlanCache
+from api.routing.graph import get_graph
+from .mvt import encode_tile, store_version, stored_tile
+from .projection import project_arrays, tile_bounds
+
+TILE_SIZE_PX = 256
+# Extra margin around each tile (fraction of the tile width) so edge features are not cut
+TILE_BUFFER = 1 / 16
+MAX_TILE_ZOOM = 20
+# Browser/CDN lifetime of a tile; requests pinned to the current data version (?v=) never expire
+TILE_MAX_AGE = 3600
+TILE_IMMUTABLE_MAX_AGE = 31536000
+
+
+class TileSource:
+    """Projected terminals and route lines of one graph version"""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.data_version = graph.data_version
+
+        node_terminal = np.asarray(graph.node_terminal)
+        self.terminal_node = np.flatnonzero(node_terminal >= 0)
+        self.terminal_id = node_terminal[self.terminal_node]
+        self.terminal_lat = np.asarray(graph.node_lat)[self.terminal_node]
+        self.terminal_lng = np.asarray(graph.node_lng)[self.terminal_node]
+        self.terminal_x, self.terminal_y = project_arrays(self.terminal_lat, self.terminal_lng)
+
+        routes, offsets, lats, lngs = [], [0], [], []
+        for r in range(len(graph.route_id)):
+            if not graph.route_live[r]:
+                continue
+            lo, hi = graph.route_poly_offsets[r], graph.route_poly_offsets[r + 1]
+            if hi - lo >= 2:
+                line_lat, line_lng = graph.poly_lat[lo:hi], graph.poly_lng[lo:hi]
+            else:
+                nodes = graph.seq_node[graph.route_seq_offsets[r]:graph.route_seq_offsets[r + 1]]
+                line_lat = [graph.node_lat[node] for node in nodes]
+                line_lng = [graph.node_lng[node] for node in nodes]
+            if len(line_lat) < 2:
+                continue
+            routes.append(r)
+            lats.extend(line_lat)
+            lngs.extend(line_lng)
+            offsets.append(len(lats))
+
+        self.route = np.asarray(routes, dtype=np.int64)
+        self.line_offsets = np.asarray(offsets, dtype=np.int64)
+        self.line_lat = np.asarray(lats, dtype=np.float64)
+        self.line_lng = np.asarray(lngs, dtype=np.float64)
+        self.line_x, self.line_y = project_arrays(self.line_lat, self.line_lng)
+
+        starts = self.line_offsets[:-1]
+        if len(starts):
+            self.route_min_x = np.minimum.reduceat(self.line_x, starts)
+            self.route_max_x = np.maximum.reduceat(self.line_x, starts)
+            self.route_min_y = np.minimum.reduceat(self.line_y, starts)
+            self.route_max_y = np.maximum.reduceat(self.line_y, starts)
+        else:
+            self.route_min_x = self.route_max_x = self.route_min_y = self.route_max_y = np.empty(0)
+
+    def terminal_modes(self, i):
+        """Sorted modes of the live routes serving terminal `i`"""
+        graph = self.graph
+        node = int(self.terminal_node[i])
+        modes = {
+            graph.route_mode[graph.seq_route[graph.node_route_seq[k]]]
+            for k in range(graph.node_route_offsets[node], graph.node_route_offsets[node + 1])
+        }
+        return sorted(modes)
+
+    def _route_runs(self, i, min_x, min_y, max_x, max_y, pixels):
+        """
+        Vertex runs of route line `i` crossing the box, simplified to one vertex per pixel.
+
+        Returns:
+            List of arrays of indices into the line_* arrays
+        """
+        lo, hi = self.line_offsets[i], self.line_offsets[i + 1]
+        xs, ys = self.line_x[lo:hi], self.line_y[lo:hi]
+        # A segment is kept when its bounding box touches the tile, so long segments
+        # crossing the tile without a vertex inside it are not lost
+        crossing = (
+            (np.maximum(xs[:-1], xs[1:]) >= min_x) & (np.minimum(xs[:-1], xs[1:]) <= max_x)
+            & (np.maximum(ys[:-1], ys[1:]) >= min_y) & (np.minimum(ys[:-1], ys[1:]) <= max_y)
+        )
+        near = np.zeros(hi - lo, dtype=bool)
+        near[:-1] |= crossing
+        near[1:] |= crossing
+
+        # Consecutive runs of kept vertices become separate paths
+        positions = np.flatnonzero(near)
+        runs = np.split(positions, np.flatnonzero(np.diff(positions) > 1) + 1)
+
+        kept = []
+        for run in runs:
+            if len(run) < 2:
+                continue
+            px = np.floor(xs[run] * pixels)
+            py = np.floor(ys[run] * pixels)
+            keep = np.ones(len(run), dtype=bool)
+            keep[1:-1] = (px[1:-1] != px[:-2]) | (py[1:-1] != py[:-2])
+            kept.append(lo + run[keep])
+        return kept
+
+    def select(self, z, x, y):
+        """
+        Features of tile z/x/y, including a TILE_BUFFER margin.
+
+        Returns:
+            (terminal indices, [(route line index, vertex runs), ...])
+        """
+        min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+        pad = (max_x - min_x) * TILE_BUFFER
+        min_x, min_y, max_x, max_y = min_x - pad, min_y - pad, max_x + pad, max_y + pad
+
+        terminals = np.flatnonzero(
+            (self.terminal_x >= min_x) & (self.terminal_x <= max_x)
+            & (self.terminal_y >= min_y) & (self.terminal_y <= max_y)
+        )
+
+        pixels = TILE_SIZE_PX * 2 ** z
+        routes = []
+        candidates = np.flatnonzero(
+            (self.route_max_x >= min_x) & (self.route_min_x <= max_x)
+            & (self.route_max_y >= min_y) & (self.route_min_y <= max_y)
+        )
+        for i in candidates.tolist():
+            runs = self._route_runs(i, min_x, min_y, max_x, max_y, pixels)
+            if runs:
+                routes.append((i, runs))
+        return terminals, routes
+
+    def covering_tiles(self, z):
+        """Tiles at zoom `z` that contain a terminal or part of a route line"""
+        n = 2 ** z
+        xs, ys = [self.terminal_x], [self.terminal_y]
+
+        # Sample every segment at half-tile steps so long segments mark each tile they cross
+        starts = np.ones(len(self.line_x), dtype=bool)
+        starts[self.line_offsets[1:-1]] = False
+        starts[0] = False
+        ends = np.flatnonzero(starts)
+        if len(ends):
+            x0, y0 = self.line_x[ends - 1], self.line_y[ends - 1]
+            dx, dy = self.line_x[ends] - x0, self.line_y[ends] - y0
+            samples = np.ceil(np.hypot(dx, dy) * n * 2).astype(np.int64) + 1
+            segment = np.repeat(np.arange(len(ends)), samples)
+            step = np.arange(len(segment)) - np.repeat(np.cumsum(samples) - samples, samples)
+            t = step / np.repeat(samples - 1, samples).clip(min=1)
+            xs.append(x0[segment] + dx[segment] * t)
+            ys.append(y0[segment] + dy[segment] * t)
+
+        tx = np.clip((np.concatenate(xs) * n).astype(np.int64), 0, n - 1)
+        ty = np.clip((np.concatenate(ys) * n).astype(np.int64), 0, n - 1)
+        return sorted(set(zip(tx.tolist(), ty.tolist())))
+
+    def route_properties(self, i):
+        """Identifying attributes of route line `i`"""
+        graph = self.graph
+        r = int(self.route[i])
+        origin = graph.seq_node[graph.route_seq_offsets[r]]
+        return {
+            'id': graph.route_id[r],
+            'terminal_id': graph.node_terminal[origin],
+            'destination_name': graph.route_destination[r],
+            'mode': graph.route_mode[r],
+        }
+
+    def render(self, z, x, y):
+        """Terminals and route paths of tile z/x/y as a JSON-serializable dict"""
+        hits, routes = self.select(z, x, y)
+        terminals = [
+            {
+                'id': int(self.terminal_id[i]),
+                'name': self.graph.node_name[int(self.terminal_node[i])],
+                'latitude': round(float(self.terminal_lat[i]), 6),
+                'longitude': round(float(self.terminal_lng[i]), 6),
+            }
+            for i in hits.tolist()
+        ]
+        return {
+            'z': z,
+            'x': x,
+            'y': y,
+            'data_version': self.data_version,
+            'terminals': terminals,
+            'routes': [
+                {
+                    **self.route_properties(i),
+                    'paths': [
+                        [
+                            [round(float(lat), 6), round(float(lng), 6)]
+                            for lat, lng in zip(self.line_lat[run], self.line_lng[run])
+                        ]
+                        for run in runs
+                    ],
+                }
+                for i, runs in routes
+            ],
+        }
+
+
+tile_cache = PlanCache(int(getattr(settings, 'TILE_CACHE_MAX_ENTRIES', 1024)))
+
+_source = None
+_source_lock = threading.Lock()
+
+
+def tile_source(graph):
+    """Process-wide TileSource for `graph`, rebuilt whenever the graph changes"""
+    global _source
+    source = _source
+    if source is not None and source.graph is graph:
+        return source
+
+    with _source_lock:
+        if _source is None or _source.graph is not graph:
+            _source = TileSource(graph)
+        return _source
+
+
+def get_tile(z, x, y):
+    """
+    Rendered tile z/x/y for the current graph.
+
+    Returns:
+        (JSON body as bytes, data_version)
+    """
+    graph = get_graph()
+    body = tile_cache.get_or_compute(
+        (graph.data_version, graph.revision),
+        (z, x, y),
+        lambda: json.dumps(tile_source(graph).render(z, x, y)).encode(),
+    )
+    return body, graph.data_version
+
+
+def get_vector_tile(z, x, y):
+    """
+    Mapbox Vector Tile z/x/y for the current graph, from the pre-generated tile store
+    when the tile was generated from the same graph state (data version and last
+    GraphChange), rendered lazily otherwise.
+
+    Returns:
+        (MVT bytes, data_version)
+    """
+    graph = get_graph()
+    data = stored_tile(store_version(graph.data_version, graph.change_id), z, x, y)
+    if data is None:
+        data = tile_cache.get_or_compute(
+            (graph.data_version, graph.revision),
+            ('mvt', z, x, y),
+            lambda: encode_tile(tile_source(graph), z, x, y),
+        )
+    return data, graph.data_version
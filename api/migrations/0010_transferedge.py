@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_userprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance_m', models.IntegerField()),
+                ('walk_time_ms', models.IntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers', to='api.routestop')),
+                ('terminal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers', to='api.terminal')),
+            ],
+            options={
+                'unique_together': {('stop', 'terminal')},
+            },
+        ),
+    ]
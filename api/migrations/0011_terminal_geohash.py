@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:17
+
+from django.db import migrations, models
+
+from api.utils.geo import geohash_encode
+
+
+def backfill_geohash(apps, schema_editor):
+    Terminal = apps.get_model('api', 'Terminal')
+    batch = []
+    for terminal in Terminal.objects.only('id', 'latitude', 'longitude').iterator():
+        terminal.geohash = geohash_encode(float(terminal.latitude), float(terminal.longitude))
+        batch.append(terminal)
+        if len(batch) >= 1000:
+            Terminal.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Terminal.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_transferedge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='terminal',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=9),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
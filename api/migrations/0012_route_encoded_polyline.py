@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+from api.utils.geo import coerce_polyline
+from api.utils.polyline import encode_polyline, DEFAULT_PRECISION
+
+
+def backfill_encoded_polyline(apps, schema_editor):
+    Route = apps.get_model('api', 'Route')
+    precision = getattr(settings, 'POLYLINE_PRECISION', DEFAULT_PRECISION)
+    batch = []
+    for route in Route.objects.only('id', 'polyline').iterator():
+        route.encoded_polyline = encode_polyline(coerce_polyline(route.polyline), precision)
+        route.polyline_precision = precision
+        batch.append(route)
+        if len(batch) >= 1000:
+            Route.objects.bulk_update(batch, ['encoded_polyline', 'polyline_precision'])
+            batch = []
+    Route.objects.bulk_update(batch, ['encoded_polyline', 'polyline_precision'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_terminal_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='encoded_polyline',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='polyline_precision',
+            field=models.PositiveSmallIntegerField(default=5, editable=False),
+        ),
+        migrations.RunPython(backfill_encoded_polyline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 10:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+from api.utils.geo import coerce_polyline
+from api.utils.polyline import DEFAULT_PRECISION
+from api.utils.simplify import polyline_variants
+
+
+def backfill_polyline_variants(apps, schema_editor):
+    Route = apps.get_model('api', 'Route')
+    precision = getattr(settings, 'POLYLINE_PRECISION', DEFAULT_PRECISION)
+    batch = []
+
+    def flush():
+        for route, variants in zip(batch, polyline_variants([coerce_polyline(route.polyline) for route in batch], precision)):
+            route.polyline_variants = variants
+        Route.objects.bulk_update(batch, ['polyline_variants'])
+
+    for route in Route.objects.only('id', 'polyline').iterator():
+        batch.append(route)
+        if len(batch) >= 1000:
+            flush()
+            batch = []
+    flush()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_route_encoded_polyline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='polyline_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(backfill_polyline_variants, migrations.RunPython.noop),
+    ]
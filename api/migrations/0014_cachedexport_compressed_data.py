@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_route_polyline_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedexport',
+            name='data_br',
+            field=models.BinaryField(help_text='data as brotli-compressed JSON (only when the brotli package is installed)', null=True),
+        ),
+        migrations.AddField(
+            model_name='cachedexport',
+            name='data_gzip',
+            field=models.BinaryField(help_text='data as gzip-compressed JSON, served to clients that accept gzip', null=True),
+        ),
+    ]
@@ -1,7 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
@@ -9,6 +10,11 @@ from django.core.management import call_command
 from threading import Thread
 import logging
 
+from django.conf import settings
+from api.utils.geo import geohash_encode, coerce_polyline, GEOHASH_PRECISION
+from api.utils.polyline import encode_polyline, DEFAULT_PRECISION
+from api.utils.simplify import polyline_variants
+
 logger = logging.getLogger(__name__)
 
 # Create your models here.
@@ -48,6 +54,8 @@ class Terminal(models.Model):
     verified = models.BooleanField(default=False)
     added_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="added_terminals")
     rating = models.IntegerField(default=0)
+    # Derived from latitude/longitude on save; prefix queries power radius search
+    geohash = models.CharField(max_length=GEOHASH_PRECISION, blank=True, default='', db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -63,6 +71,14 @@ class Terminal(models.Model):
 
     def __str__(self):
         return self.name or f"Terminal {self.id}" # type: ignore
+
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geohash_encode(float(self.latitude), float(self.longitude))
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'latitude', 'longitude'} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
     
 # Mode Of Transport Table
 class ModeOfTransport(models.Model):
@@ -100,11 +116,26 @@ class Route(models.Model):
     added_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='added_routes')
     description = models.TextField(blank=True, null=True)
     polyline = models.JSONField(blank=True, null=True)
+    # Derived from polyline on save; served by ?polyline=encoded
+    encoded_polyline = models.TextField(blank=True, default='', editable=False)
+    polyline_precision = models.PositiveSmallIntegerField(default=DEFAULT_PRECISION, editable=False)
+    # Douglas-Peucker variants per map zoom, {"8": <encoded>, ...}; served by ?zoom= / ?tolerance=
+    polyline_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         origin_name = self.terminal.name or f'Terminal {self.terminal.id}'
         return f"{origin_name} → {self.destination_name} ({self.mode})"
 
+    def save(self, *args, **kwargs):
+        self.polyline_precision = getattr(settings, 'POLYLINE_PRECISION', DEFAULT_PRECISION)
+        points = coerce_polyline(self.polyline)
+        self.encoded_polyline = encode_polyline(points, self.polyline_precision)
+        self.polyline_variants = polyline_variants([points], self.polyline_precision)[0]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'polyline' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'encoded_polyline', 'polyline_precision', 'polyline_variants'}
+        super().save(*args, **kwargs)
+
 # Route Stop Tables
 class RouteStop(models.Model):
     route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='stops')
@@ -153,7 +184,53 @@ class RouteStop(models.Model):
 
     def __str__(self):
         return f"Stop {self.order}: {self.stop_name} - {self.route}"
+
+# Walking Transfers Table
+class TransferEdge(models.Model):
+    """Walkable link between a route stop and a nearby terminal, used by the journey planner"""
+    stop = models.ForeignKey(RouteStop, on_delete=models.CASCADE, related_name='transfers')
+    terminal = models.ForeignKey(Terminal, on_delete=models.CASCADE, related_name='transfers')
+    distance_m = models.IntegerField()
+    walk_time_ms = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('stop', 'terminal')
+
+    def __str__(self):
+        return f"{self.stop.stop_name} ↔ {self.terminal} ({self.distance_m} m)"
     
+# Routing Graph Change Log
+class GraphChange(models.Model):
+    """
+    A saved or deleted terminal or route that changes routing. The id is the graph
+    revision shared by every worker: get_graph() replays rows newer than its graph.
+    """
+
+    KIND_CHOICES = [
+        ('terminal', 'Terminal'),
+        ('route', 'Route'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} {self.object_id}"
+
+    @classmethod
+    def latest_id(cls):
+        return cls.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    @classmethod
+    def prune(cls, before):
+        """
+        Delete changes logged before `before`, which every graph built since includes.
+        The newest row is kept so ids keep increasing on databases that reuse them.
+        """
+        return cls.objects.filter(created_at__lt=before, id__lt=cls.latest_id()).delete()[0]
+
 class CachedExport(models.Model):
     """Store pre-computed JSON exports for fast frontend access"""
     
@@ -177,6 +254,16 @@ class CachedExport(models.Model):
     data_version = models.CharField(max_length=50)
     record_count = models.IntegerField(default=0)
     file_size_kb = models.IntegerField(default=0)
+    data_gzip = models.BinaryField(
+        null=True,
+        editable=False,
+        help_text="data as gzip-compressed JSON, served to clients that accept gzip"
+    )
+    data_br = models.BinaryField(
+        null=True,
+        editable=False,
+        help_text="data as brotli-compressed JSON (only when the brotli package is installed)"
+    )
     
     class Meta:
         indexes = [
@@ -189,26 +276,10 @@ class CachedExport(models.Model):
     def __str__(self):
         return f"{self.get_export_type_display()} - {self.data_version}" # type: ignore
     
-    def update_metadata(self):
-        """Calculate and update metadata after data change"""
-        import json
-        import sys
-        
-        # Calculate file size
-        json_str = json.dumps(self.data)
-        self.file_size_kb = sys.getsizeof(json_str) // 1024
-        
-        # Count records based on export type
-        if self.export_type == 'complete':
-            self.record_count = len(self.data.get('regions', []))
-        elif self.export_type == 'terminals':
-            self.record_count = len(self.data.get('terminals', []))
-        elif self.export_type == 'routes':
-            self.record_count = len(self.data.get('routes', []))
-        elif self.export_type == 'regions':
-            self.record_count = len(self.data.get('regions', []))
-        
-        self.save()
+    @classmethod
+    def current_version(cls):
+        """Data version of the complete export, or None if the cache was never built"""
+        return cls.objects.filter(export_type='complete').values_list('data_version', flat=True).first()
 
 @receiver(post_save, sender=Terminal)
 @receiver(post_save, sender=Route)
@@ -233,6 +304,94 @@ def auto_update_cache_on_verify(sender, instance, created, **kwargs):
         
         Thread(target=update_cache, daemon=True).start()
 
+@receiver(pre_save, sender=Terminal)
+@receiver(pre_save, sender=Route)
+@receiver(pre_save, sender=RouteStop)
+def remember_routing_fields(sender, instance, update_fields=None, **kwargs):
+    """Keep the stored routing fields so post_save handlers can skip no-op saves"""
+    from api.routing.updates import remember_stored
+    try:
+        remember_stored(instance, update_fields)
+    except Exception as e:
+        # Treated as a new row, so nothing is skipped
+        instance._stored = None
+        logger.error(f"Reading stored routing fields failed: {str(e)}")
+
+@receiver(post_save, sender=Terminal)
+def refresh_transfers_on_terminal_save(sender, instance, **kwargs):
+    """Recompute walking transfers around a verified terminal that moved or was just verified"""
+    from api.routing.transfers import refresh_terminal_transfers
+    from api.routing.updates import changed_fields
+
+    if not instance.verified:
+        # Its pairs are recomputed once it is verified
+        return
+    if not changed_fields(instance) & {'verified', 'latitude', 'longitude'}:
+        return
+    try:
+        refresh_terminal_transfers(instance)
+    except Exception as e:
+        logger.error(f"Transfer refresh failed for terminal {instance.id}: {str(e)}")
+
+@receiver(post_save, sender=RouteStop)
+def refresh_transfers_on_stop_save(sender, instance, **kwargs):
+    """Recompute walking transfers around a route stop that moved or changed terminal"""
+    from api.routing.transfers import refresh_stop_transfers
+    from api.routing.updates import changed_fields
+
+    if not changed_fields(instance) & {'terminal_id', 'latitude', 'longitude'}:
+        return
+    try:
+        refresh_stop_transfers(instance)
+    except Exception as e:
+        logger.error(f"Transfer refresh failed for route stop {instance.id}: {str(e)}")
+
+@receiver(post_save, sender=Terminal)
+@receiver(post_save, sender=Route)
+@receiver(post_save, sender=RouteStop)
+@receiver(post_delete, sender=Terminal)
+@receiver(post_delete, sender=Route)
+@receiver(post_delete, sender=RouteStop)
+def patch_routing_graph(sender, instance, signal, **kwargs):
+    """Log changes that affect routing; every worker's graph picks them up on its next request"""
+    from api.routing.updates import record_change
+    from api.routing.graph import sync_loaded_graph
+
+    def sync():
+        try:
+            if sync_loaded_graph() is not None:
+                logger.info(f"Routing graph patched for {sender.__name__} #{instance.id}")
+        except Exception as e:
+            logger.error(f"Routing graph patch failed: {str(e)}")
+
+    try:
+        if record_change(instance, deleted=signal is post_delete) is not None:
+            # Other workers can only see the change once it is committed
+            transaction.on_commit(sync)
+    except Exception as e:
+        logger.error(f"Routing graph change log failed: {str(e)}")
+
+@receiver(post_save, sender=Terminal)
+@receiver(post_delete, sender=Terminal)
+def invalidate_terminal_index(sender, instance, signal, **kwargs):
+    """Reload the snapping index after a terminal is added, moved, verified or removed"""
+    from api.routing.snapping import invalidate
+    invalidate(instance, deleted=signal is post_delete)
+
+@receiver(post_save, sender=Route)
+@receiver(post_save, sender=RouteStop)
+@receiver(post_delete, sender=Route)
+@receiver(post_delete, sender=RouteStop)
+def invalidate_terminal_modes(sender, instance, signal, **kwargs):
+    """Reload the snapping index when the modes serving a terminal may have changed"""
+    from api.routing.snapping import invalidate, MODE_MASK_FIELDS
+    from api.routing.updates import changed_fields
+
+    if signal is post_save and not changed_fields(instance) & MODE_MASK_FIELDS:
+        # e.g. a fare or polyline edit
+        return
+    invalidate()
+
 # Lakbay Points (LP) System
 class UserProfile(models.Model):
     """Extended user profile for Lakbay Points"""
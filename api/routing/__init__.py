@@ -0,0 +1 @@
+# Journey planning over the verified transit network
@@ -0,0 +1,117 @@
+"""
+Batch Journey Planning
+
+Answers many origin/destination pairs against one graph. Pairs are grouped by origin
+so every origin costs a single one-to-many search (or one hierarchy query per
+destination when there are only a few), and results are produced lazily so the view
+can stream them as NDJSON while the search is still running.
+
+Endpoints are terminal ids or {"lat": .., "lng": ..} points, which are snapped to the
+closest routable terminal.
+"""
+
+import json
+
+from django.conf import settings
+
+from api.utils.geo import coerce_point
+from .snapping import snap_to_graph
+
+
+class BatchRequestError(Exception):
+    """Raised when a batch request body cannot be planned"""
+    pass
+
+
+def max_pairs() -> int:
+    return int(getattr(settings, 'PLAN_BATCH_MAX_PAIRS', 500))
+
+
+def parse_pairs(payload):
+    """
+    Validate a batch request body.
+
+    Args:
+        payload: {"pairs": [{"from": <endpoint>, "to": <endpoint>}, ...]}
+
+    Returns:
+        List of (from, to) endpoints, each an int terminal id or a (lat, lng) tuple
+    """
+    pairs = payload.get('pairs') if isinstance(payload, dict) else None
+    if not isinstance(pairs, list) or not pairs:
+        raise BatchRequestError('pairs must be a non-empty list')
+    if len(pairs) > max_pairs():
+        raise BatchRequestError(f'At most {max_pairs()} pairs are allowed per request')
+
+    parsed = []
+    for index, pair in enumerate(pairs):
+        if not isinstance(pair, dict) or 'from' not in pair or 'to' not in pair:
+            raise BatchRequestError(f'pairs[{index}] must have from and to')
+        parsed.append((_endpoint(pair['from'], index), _endpoint(pair['to'], index)))
+    return parsed
+
+
+def _endpoint(value, index):
+    if isinstance(value, dict):
+        point = coerce_point(value)
+        if point is None:
+            raise BatchRequestError(f'pairs[{index}] has an invalid coordinate')
+        return point
+    if isinstance(value, bool):
+        raise BatchRequestError(f'pairs[{index}] endpoints must be terminal ids or coordinates')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BatchRequestError(f'pairs[{index}] endpoints must be terminal ids or coordinates')
+
+
+def _resolve(graph, endpoint, snapped):
+    """Terminal id for an endpoint, or None; coordinate lookups are memoized in `snapped`"""
+    if isinstance(endpoint, int):
+        return endpoint if endpoint in graph.terminal_node else None
+    if endpoint not in snapped:
+        nearest = snap_to_graph(graph, *endpoint)
+        snapped[endpoint] = nearest[0] if nearest else None
+    return snapped[endpoint]
+
+
+def plan_batch(graph, pairs, include_legs=False):
+    """
+    Plan every pair, grouped by origin.
+
+    Yields:
+        One result dict per pair (in origin order, tagged with the pair's index)
+    """
+    snapped = {}
+    by_origin = {}
+    for index, (origin, destination) in enumerate(pairs):
+        origin_id = _resolve(graph, origin, snapped)
+        destination_id = _resolve(graph, destination, snapped)
+        if origin_id is None or destination_id is None:
+            yield {'index': index, 'error': 'Terminal not found or not verified'}
+            continue
+        by_origin.setdefault(origin_id, []).append((index, destination_id))
+
+    for origin_id, targets in by_origin.items():
+        journeys = graph.plan_many(origin_id, list({tid for _, tid in targets}))
+        for index, destination_id in targets:
+            journey = journeys[destination_id]
+            if journey is None:
+                yield {'index': index, 'from': origin_id, 'to': destination_id, 'error': 'No route found between these terminals'}
+                continue
+            result = {
+                'index': index,
+                'from': origin_id,
+                'to': destination_id,
+                'total_time_ms': journey['total_time_ms'],
+                'total_fare': journey['total_fare'],
+                'transfers': journey['transfers'],
+            }
+            if include_legs:
+                result['legs'] = journey['legs']
+            yield result
+
+
+def ndjson_lines(results):
+    for result in results:
+        yield json.dumps(result) + '\n'
@@ -0,0 +1,81 @@
+"""
+Plan Result Cache
+
+Popular terminal pairs (schools, malls, transport hubs) are planned over and over.
+Results are kept in a bounded, process-wide LRU keyed on the snapped origin and
+destination terminals plus the query options. Every entry belongs to one graph version,
+the export cache `data_version` together with the graph's patch revision, so a newly
+verified route invalidates the cached plans as soon as the graph picks it up.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class PlanCache:
+    """Thread-safe LRU with hit/miss counters, cleared whenever the graph version moves"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _sync(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get_or_compute(self, version, key, compute, cacheable=None):
+        """
+        Cached result for `key` under `version`, calling `compute()` on a miss.
+        `None` results (e.g. no route found) are cached as well, unless
+        `cacheable(result)` returns False.
+        """
+        with self.lock:
+            self._sync(version)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        # Plan outside the lock so concurrent misses don't serialize
+        value = compute()
+
+        with self.lock:
+            if version != self.version or (cacheable is not None and not cacheable(value)):
+                # Stale (the graph moved on while planning) or not worth keeping
+                return value
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': list(self.version) if self.version else None,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+plan_cache = PlanCache(int(getattr(settings, 'PLAN_CACHE_MAX_ENTRIES', 2048)))
+
+
+def cached_plan(graph, key, compute, cacheable=None):
+    """Look up `key` (origin, destination, criteria, ...) for the current graph version"""
+    return plan_cache.get_or_compute((graph.data_version, graph.revision), key, compute, cacheable)
@@ -0,0 +1,320 @@
+"""
+Contraction Hierarchies
+
+Offline shortcut overlay for the TransitGraph. Nodes are contracted one by one in
+order of importance (edge difference heuristic); whenever removing a node would
+break a shortest path, a shortcut edge is added between its neighbours. Queries then
+run a bidirectional Dijkstra that only ever climbs the hierarchy, which settles a
+few hundred nodes instead of the whole network.
+
+Every hierarchy edge is either an original graph edge or a shortcut made of two
+hierarchy edges, so paths unpack back into original edges for leg descriptions.
+"""
+
+import heapq
+import logging
+from array import array
+from datetime import datetime, timezone
+
+from .graph import UNREACHABLE
+from .storage import RoutingIndexError, map_arrays, routing_data_dir, write_arrays
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'contraction.bin'
+FORMAT_VERSION = 1
+
+# Witness searches are bounded; a missed witness only costs an extra shortcut
+WITNESS_SETTLE_LIMIT = 60
+
+
+class _Contractor:
+    """Mutable working state used while building the hierarchy"""
+
+    def __init__(self, graph):
+        n = graph.node_count
+        self.n = n
+        self.out_adj = [dict() for _ in range(n)]
+        self.in_adj = [dict() for _ in range(n)]
+        self.ch_source = array('q')
+        self.ch_target = array('q')
+        self.ch_orig = array('q')
+        self.ch_child1 = array('q')
+        self.ch_child2 = array('q')
+        self.contracted_neighbours = [0] * n
+
+        for e in range(graph.edge_count):
+            u, v, w = graph.edge_source[e], graph.edge_target[e], graph.edge_weight[e]
+            if u == v:
+                continue
+            current = self.out_adj[u].get(v)
+            if current is None or w < current[0]:
+                self._set_edge(u, v, w, self._new_edge(u, v, e, -1, -1))
+
+    def _new_edge(self, u, v, orig, child1, child2):
+        self.ch_source.append(u)
+        self.ch_target.append(v)
+        self.ch_orig.append(orig)
+        self.ch_child1.append(child1)
+        self.ch_child2.append(child2)
+        return len(self.ch_orig) - 1
+
+    def _set_edge(self, u, v, w, edge_id):
+        self.out_adj[u][v] = (w, edge_id)
+        self.in_adj[v][u] = (w, edge_id)
+
+    def _witness_distances(self, source, skip, limit, targets):
+        dist = {source: 0}
+        heap = [(0, source)]
+        remaining = set(targets)
+        settled = 0
+        while heap and remaining and settled < WITNESS_SETTLE_LIMIT:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if d > limit:
+                break
+            remaining.discard(u)
+            settled += 1
+            for v, (w, _) in self.out_adj[u].items():
+                if v == skip:
+                    continue
+                nd = d + w
+                if nd < dist.get(v, UNREACHABLE):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def shortcuts_for(self, x):
+        """Shortcuts needed if `x` were contracted now: (u, v, weight, in_edge, out_edge)"""
+        shortcuts = []
+        outgoing = self.out_adj[x]
+        if not outgoing:
+            return shortcuts
+        max_out = max(w for w, _ in outgoing.values())
+
+        for u, (w_in, in_edge) in self.in_adj[x].items():
+            targets = [v for v in outgoing if v != u]
+            if not targets:
+                continue
+            dist = self._witness_distances(u, x, w_in + max_out, targets)
+            for v in targets:
+                w_out, out_edge = outgoing[v]
+                via = w_in + w_out
+                if dist.get(v, UNREACHABLE) > via:
+                    shortcuts.append((u, v, via, in_edge, out_edge))
+        return shortcuts
+
+    def priority(self, x):
+        removed = len(self.in_adj[x]) + len(self.out_adj[x])
+        return len(self.shortcuts_for(x)) - removed + self.contracted_neighbours[x]
+
+    def contract(self):
+        n = self.n
+        rank = array('q', bytes(8 * n))
+        up = [None] * n
+        down = [None] * n
+
+        heap = [(self.priority(x), x) for x in range(n)]
+        heapq.heapify(heap)
+        done = [False] * n
+        level = 0
+
+        while heap:
+            _, x = heapq.heappop(heap)
+            if done[x]:
+                continue
+            # Lazy update: re-evaluate and defer if no longer the cheapest
+            current = self.priority(x)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, x))
+                continue
+
+            for u, v, w, in_edge, out_edge in self.shortcuts_for(x):
+                existing = self.out_adj[u].get(v)
+                if existing is None or w < existing[0]:
+                    self._set_edge(u, v, w, self._new_edge(u, v, -1, in_edge, out_edge))
+
+            up[x] = [(v, w, e) for v, (w, e) in self.out_adj[x].items()]
+            down[x] = [(u, w, e) for u, (w, e) in self.in_adj[x].items()]
+            for v in self.out_adj[x]:
+                del self.in_adj[v][x]
+                self.contracted_neighbours[v] += 1
+            for u in self.in_adj[x]:
+                del self.out_adj[u][x]
+                self.contracted_neighbours[u] += 1
+            self.out_adj[x] = {}
+            self.in_adj[x] = {}
+
+            done[x] = True
+            rank[x] = level
+            level += 1
+
+        return rank, up, down
+
+
+def _to_csr(lists):
+    offsets = array('q', [0])
+    nodes, weights, edges = array('q'), array('q'), array('q')
+    for entries in lists:
+        for node, w, e in entries or ():
+            nodes.append(node)
+            weights.append(w)
+            edges.append(e)
+        offsets.append(len(nodes))
+    return offsets, nodes, weights, edges
+
+
+class ContractionHierarchy:
+    """Read-only hierarchy answering shortest-path queries with bidirectional search"""
+
+    ARRAY_NAMES = (
+        'rank',
+        'up_offsets', 'up_target', 'up_weight', 'up_edge',
+        'down_offsets', 'down_source', 'down_weight', 'down_edge',
+        'ch_source', 'ch_target', 'ch_orig', 'ch_child1', 'ch_child2',
+    )
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def build(cls, graph):
+        """Contract every node of `graph` and return the resulting hierarchy"""
+        contractor = _Contractor(graph)
+        rank, up, down = contractor.contract()
+        up_offsets, up_target, up_weight, up_edge = _to_csr(up)
+        down_offsets, down_source, down_weight, down_edge = _to_csr(down)
+
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'data_version': graph.data_version,
+            'node_count': graph.node_count,
+            'edge_count': graph.edge_count,
+            'shortcut_count': len(contractor.ch_orig) - sum(1 for e in contractor.ch_orig if e >= 0),
+            'built_at': datetime.now(timezone.utc).isoformat(),
+        }
+        return cls(meta, {
+            'rank': rank,
+            'up_offsets': up_offsets, 'up_target': up_target,
+            'up_weight': up_weight, 'up_edge': up_edge,
+            'down_offsets': down_offsets, 'down_source': down_source,
+            'down_weight': down_weight, 'down_edge': down_edge,
+            'ch_source': contractor.ch_source, 'ch_target': contractor.ch_target,
+            'ch_orig': contractor.ch_orig,
+            'ch_child1': contractor.ch_child1, 'ch_child2': contractor.ch_child2,
+        })
+
+    def matches(self, graph):
+        """True if this hierarchy was built from the same network as `graph`"""
+        return (
+            self.meta.get('format_version') == FORMAT_VERSION
+            and self.meta.get('data_version') == graph.data_version
+            and self.meta.get('node_count') == graph.node_count
+            and self.meta.get('edge_count') == graph.edge_count
+        )
+
+    def save(self, path=None):
+        path = path or routing_data_dir() / INDEX_FILENAME
+        write_arrays(path, self.meta, {name: getattr(self, name) for name in self.ARRAY_NAMES})
+        return path
+
+    @classmethod
+    def load(cls, path=None):
+        meta, arrays = map_arrays(path or routing_data_dir() / INDEX_FILENAME)
+        missing = [name for name in cls.ARRAY_NAMES if name not in arrays]
+        if missing:
+            raise RoutingIndexError(f"Routing index is missing arrays: {missing}")
+        return cls(meta, arrays)
+
+    def shortest_path(self, source, target):
+        """
+        Bidirectional upward Dijkstra.
+
+        Returns:
+            List of original graph edge indices from source to target, or None
+        """
+        if source == target:
+            return []
+
+        dist = ({source: 0}, {target: 0})
+        pred = ({}, {})
+        heaps = ([(0, source)], [(0, target)])
+        adjacency = (
+            (self.up_offsets, self.up_target, self.up_weight, self.up_edge),
+            (self.down_offsets, self.down_source, self.down_weight, self.down_edge),
+        )
+        best, meet = UNREACHABLE, -1
+
+        while heaps[0] or heaps[1]:
+            for side in (0, 1):
+                heap = heaps[side]
+                if not heap:
+                    continue
+                if heap[0][0] >= best:
+                    heap.clear()
+                    continue
+                d, u = heapq.heappop(heap)
+                if d > dist[side][u]:
+                    continue
+                other = dist[1 - side].get(u)
+                if other is not None and d + other < best:
+                    best, meet = d + other, u
+
+                offsets, nodes, weights, edges = adjacency[side]
+                side_dist, side_pred = dist[side], pred[side]
+                for i in range(offsets[u], offsets[u + 1]):
+                    v = nodes[i]
+                    nd = d + weights[i]
+                    if nd < side_dist.get(v, UNREACHABLE):
+                        side_dist[v] = nd
+                        side_pred[v] = edges[i]
+                        heapq.heappush(heap, (nd, v))
+
+        if meet < 0:
+            return None
+
+        forward = []
+        node = meet
+        while node != source:
+            e = pred[0][node]
+            forward.append(e)
+            node = self.ch_source[e]
+        forward.reverse()
+
+        node = meet
+        while node != target:
+            e = pred[1][node]
+            forward.append(e)
+            node = self.ch_target[e]
+
+        path = []
+        for e in forward:
+            self._unpack(e, path)
+        return path
+
+    def _unpack(self, edge, out):
+        stack = [edge]
+        while stack:
+            e = stack.pop()
+            orig = self.ch_orig[e]
+            if orig >= 0:
+                out.append(orig)
+            else:
+                stack.append(self.ch_child2[e])
+                stack.append(self.ch_child1[e])
+
+
+def load_hierarchy(graph):
+    """Load the stored hierarchy if it matches `graph`, otherwise return None"""
+    try:
+        hierarchy = ContractionHierarchy.load()
+    except RoutingIndexError as e:
+        logger.warning(f"No contraction hierarchy available, planning with plain Dijkstra: {e}")
+        return None
+    if not hierarchy.matches(graph):
+        logger.warning("Stored contraction hierarchy is stale, planning with plain Dijkstra")
+        return None
+    return hierarchy
@@ -0,0 +1,289 @@
+"""
+Route Corridors
+
+Finds the routes passing near a point, not only the routes starting there: a rider
+standing on a road a jeepney uses is often far from the route's origin terminal.
+
+`CorridorIndex` flattens every live route of the routing graph into line segments (its
+stored polyline, or its stop sequence when it has none). Stops of polyline routes are
+added as zero-length segments, so a stop drawn slightly off the polyline still matches.
+Segments longer than a grid cell are cut into cell-sized pieces and every piece is
+bucketed in a uniform lat/lng grid, kept in CSR form (sorted cell keys and offsets into
+a segment array). A query reads the cells covering the search circle and measures
+point-to-segment distances in local meters with NumPy, so its cost tracks the number of
+segments nearby rather than the size of the network.
+One index is built per graph and rebuilt whenever the graph changes.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+from api.utils.geo import KM_PER_DEGREE
+from .graph import get_graph
+
+METERS_PER_DEGREE = KM_PER_DEGREE * 1000
+CELL_DEGREES = 0.01
+# Cell keys are row * GRID_COLUMNS + column over the whole globe
+GRID_COLUMNS = int(360 / CELL_DEGREES) + 1
+
+DEFAULT_CORRIDOR_RADIUS_M = 200
+MAX_CORRIDOR_RADIUS_M = 2000
+
+
+def _cell(lat, lng):
+    return np.floor((lat + 90) / CELL_DEGREES).astype(np.int64), np.floor((lng + 180) / CELL_DEGREES).astype(np.int64)
+
+
+def _lengths_m(lats, lngs):
+    """Equirectangular length of each consecutive vertex pair, in meters"""
+    scale = np.cos(np.radians((lats[1:] + lats[:-1]) / 2))
+    return np.hypot(np.diff(lngs) * scale, np.diff(lats)) * METERS_PER_DEGREE
+
+
+class CorridorIndex:
+    """Grid-bucketed route segments of one graph version"""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.data_version = graph.data_version
+        node_lat = np.asarray(graph.node_lat, dtype=np.float64)
+        node_lng = np.asarray(graph.node_lng, dtype=np.float64)
+        self.node_lat, self.node_lng = node_lat, node_lng
+
+        routes, lengths = [], []
+        a_lat, a_lng, b_lat, b_lng, along, line = [], [], [], [], [], []
+        for r in range(len(graph.route_id)):
+            if not graph.route_live[r]:
+                continue
+            stops = np.asarray(graph.seq_node[graph.route_seq_offsets[r]:graph.route_seq_offsets[r + 1]], dtype=np.int64)
+            lo, hi = graph.route_poly_offsets[r], graph.route_poly_offsets[r + 1]
+            if hi - lo >= 2:
+                lats = np.asarray(graph.poly_lat[lo:hi], dtype=np.float64)
+                lngs = np.asarray(graph.poly_lng[lo:hi], dtype=np.float64)
+            else:
+                lats, lngs = node_lat[stops], node_lng[stops]
+            if not len(lats):
+                continue
+
+            i = len(routes)
+            cumulative = np.concatenate([[0.0], np.cumsum(_lengths_m(lats, lngs))])
+            routes.append(r)
+            lengths.append(cumulative[-1])
+            a_lat.append(lats[:-1])
+            a_lng.append(lngs[:-1])
+            b_lat.append(lats[1:])
+            b_lng.append(lngs[1:])
+            along.append(cumulative[:-1])
+            line.append(np.full(len(lats) - 1, i))
+
+            if hi - lo >= 2 and len(stops):
+                # A stop sits at the along-route distance of its closest polyline vertex
+                stop_lat, stop_lng = node_lat[stops], node_lng[stops]
+                scale = math.cos(math.radians(float(lats.mean())))
+                nearest = np.argmin(
+                    ((stop_lat[:, None] - lats) ** 2 + ((stop_lng[:, None] - lngs) * scale) ** 2), axis=1
+                )
+                a_lat.append(stop_lat)
+                a_lng.append(stop_lng)
+                b_lat.append(stop_lat)
+                b_lng.append(stop_lng)
+                along.append(cumulative[nearest])
+                line.append(np.full(len(stops), i))
+
+        def joined(parts, dtype=np.float64):
+            return np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype=dtype)
+
+        self.route = np.asarray(routes, dtype=np.int64)
+        self.line_length = np.asarray(lengths, dtype=np.float64)
+        self.a_lat, self.a_lng = joined(a_lat), joined(a_lng)
+        self.b_lat, self.b_lng = joined(b_lat), joined(b_lng)
+        self.along = joined(along)
+        self.line = joined(line, np.int64)
+        self._bucket()
+
+    def __len__(self):
+        return len(self.line)
+
+    def _bucket(self):
+        """Grid cells of every segment piece, as CSR arrays keyed by cell"""
+        d_lat, d_lng = self.b_lat - self.a_lat, self.b_lng - self.a_lng
+        pieces = np.maximum(np.ceil(np.maximum(np.abs(d_lat), np.abs(d_lng)) / CELL_DEGREES), 1).astype(np.int64)
+        segment = np.repeat(np.arange(len(pieces)), pieces)
+        step = np.arange(len(segment)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t0 = step / pieces[segment]
+        t1 = (step + 1) / pieces[segment]
+
+        lat0 = self.a_lat[segment] + d_lat[segment] * t0
+        lat1 = self.a_lat[segment] + d_lat[segment] * t1
+        lng0 = self.a_lng[segment] + d_lng[segment] * t0
+        lng1 = self.a_lng[segment] + d_lng[segment] * t1
+        row_lo, col_lo = _cell(np.minimum(lat0, lat1), np.minimum(lng0, lng1))
+        row_hi, col_hi = _cell(np.maximum(lat0, lat1), np.maximum(lng0, lng1))
+
+        # No piece is longer than a cell, so its box spans at most 2x2 cells
+        keys, members = [], []
+        for d_row in (0, 1):
+            for d_col in (0, 1):
+                inside = (row_lo + d_row <= row_hi) & (col_lo + d_col <= col_hi)
+                keys.append((row_lo[inside] + d_row) * GRID_COLUMNS + col_lo[inside] + d_col)
+                members.append(segment[inside])
+        keys, members = np.concatenate(keys), np.concatenate(members)
+
+        order = np.lexsort((members, keys))
+        keys, members = keys[order], members[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = (keys[1:] != keys[:-1]) | (members[1:] != members[:-1])
+        keys, members = keys[first], members[first]
+
+        self.cell_key, starts = np.unique(keys, return_index=True)
+        self.cell_offsets = np.append(starts, len(keys)).astype(np.int64)
+        self.cell_segment = members
+
+    def _candidates(self, lat, lng, radius_m):
+        """Segments bucketed in the cells covering the search circle"""
+        lat_delta = radius_m / METERS_PER_DEGREE
+        lng_delta = lat_delta / max(math.cos(math.radians(lat)), 0.01)
+        row_lo, col_lo = _cell(np.float64(lat - lat_delta), np.float64(lng - lng_delta))
+        row_hi, col_hi = _cell(np.float64(lat + lat_delta), np.float64(lng + lng_delta))
+        rows, cols = np.meshgrid(np.arange(row_lo, row_hi + 1), np.arange(col_lo, col_hi + 1), indexing='ij')
+        keys = (rows * GRID_COLUMNS + cols).ravel()
+
+        positions = np.searchsorted(self.cell_key, keys)
+        found = positions < len(self.cell_key)
+        found[found] = self.cell_key[positions[found]] == keys[found]
+        positions = positions[found]
+        if not len(positions):
+            return np.empty(0, dtype=np.int64)
+        slices = [self.cell_segment[self.cell_offsets[p]:self.cell_offsets[p + 1]] for p in positions.tolist()]
+        return np.unique(np.concatenate(slices))
+
+    def nearby(self, lat, lng, radius_m=DEFAULT_CORRIDOR_RADIUS_M, mode=None, limit=None):
+        """
+        Routes passing within `radius_m` of a point, nearest first.
+
+        Args:
+            mode: Only routes of this mode (e.g. 'jeepney')
+            limit: Maximum number of routes
+
+        Returns:
+            List of (route line index, distance_m, projected lat, projected lng, along_m)
+        """
+        segments = self._candidates(lat, lng, radius_m)
+        if mode is not None and len(segments):
+            modes = self.graph.route_mode
+            segments = segments[[modes[r] == mode for r in self.route[self.line[segments]].tolist()]]
+        if not len(segments):
+            return []
+
+        # Local meters around the query point
+        scale = math.cos(math.radians(lat)) * METERS_PER_DEGREE
+        ax = (self.a_lng[segments] - lng) * scale
+        ay = (self.a_lat[segments] - lat) * METERS_PER_DEGREE
+        dx = (self.b_lng[segments] - self.a_lng[segments]) * scale
+        dy = (self.b_lat[segments] - self.a_lat[segments]) * METERS_PER_DEGREE
+        length_sq = dx * dx + dy * dy
+        t = np.where(length_sq > 0, -(ax * dx + ay * dy) / np.where(length_sq > 0, length_sq, 1), 0).clip(0, 1)
+        distance = np.hypot(ax + t * dx, ay + t * dy)
+
+        within = distance <= radius_m
+        segments, t, distance = segments[within], t[within], distance[within]
+        segment_length = np.sqrt(length_sq[within])
+
+        # Closest segment of each route line
+        order = np.argsort(distance, kind='stable')
+        _, first = np.unique(self.line[segments[order]], return_index=True)
+        best = order[first]
+        best = best[np.argsort(distance[best], kind='stable')]
+        if limit is not None:
+            best = best[:limit]
+
+        hits = []
+        for k in best.tolist():
+            s = segments[k]
+            along = self.along[s] + t[k] * segment_length[k]
+            hits.append((
+                int(self.line[s]),
+                float(distance[k]),
+                float(self.a_lat[s] + t[k] * (self.b_lat[s] - self.a_lat[s])),
+                float(self.a_lng[s] + t[k] * (self.b_lng[s] - self.a_lng[s])),
+                float(along),
+            ))
+        return hits
+
+    def nearest_stop(self, i, lat, lng):
+        """
+        Stop of route line `i` closest to a point (the origin terminal counts as a stop).
+
+        Returns:
+            (sequence position, node, distance_m)
+        """
+        graph = self.graph
+        r = int(self.route[i])
+        base = graph.route_seq_offsets[r]
+        nodes = np.asarray(graph.seq_node[base:graph.route_seq_offsets[r + 1]], dtype=np.int64)
+        scale = math.cos(math.radians(lat))
+        distances = np.hypot(
+            (self.node_lng[nodes] - lng) * scale, self.node_lat[nodes] - lat
+        ) * METERS_PER_DEGREE
+        k = int(np.argmin(distances))
+        return k, int(nodes[k]), float(distances[k])
+
+    def describe(self, hit, lat, lng):
+        """JSON-ready description of a `nearby` hit for a rider at (lat, lng)"""
+        i, distance, projected_lat, projected_lng, along = hit
+        graph = self.graph
+        r = int(self.route[i])
+        origin = graph.seq_node[graph.route_seq_offsets[r]]
+        sequence, node, stop_distance = self.nearest_stop(i, lat, lng)
+        length = float(self.line_length[i])
+        return {
+            'route_id': graph.route_id[r],
+            'terminal_id': graph.node_terminal[origin],
+            'destination_name': graph.route_destination[r],
+            'mode': graph.route_mode[r],
+            'fare_type': graph.route_fare_type[r],
+            'distance_m': round(distance, 1),
+            'position': {
+                'latitude': round(projected_lat, 6),
+                'longitude': round(projected_lng, 6),
+                'along_m': round(along, 1),
+                'fraction': round(along / length, 4) if length > 0 else 0.0,
+            },
+            'nearest_stop': {
+                **graph.describe_node(node),
+                'sequence': sequence,
+                'distance_m': round(stop_distance, 1),
+            },
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def corridor_index(graph):
+    """Process-wide CorridorIndex for `graph`, rebuilt whenever the graph changes"""
+    global _index
+    index = _index
+    if index is not None and index.graph is graph:
+        return index
+
+    with _index_lock:
+        if _index is None or _index.graph is not graph:
+            _index = CorridorIndex(graph)
+        return _index
+
+
+def routes_near(lat, lng, radius_m=DEFAULT_CORRIDOR_RADIUS_M, mode=None, limit=None):
+    """
+    Routes of the current graph passing within `radius_m` of a point, nearest first.
+
+    Returns:
+        (list of route descriptions, data_version)
+    """
+    graph = get_graph()
+    index = corridor_index(graph)
+    hits = index.nearby(lat, lng, radius_m=radius_m, mode=mode, limit=limit)
+    return [index.describe(hit, lat, lng) for hit in hits], graph.data_version
@@ -0,0 +1,859 @@
+"""
+Transit Graph
+
+In-memory routing graph built from verified routes, following the design in
+descriptions.txt: terminals are nodes and verified Route/RouteStop chains are edges.
+
+Route stops that are not linked to a terminal become their own nodes so a rider can
+still alight mid-route. Edges are kept in CSR (compressed sparse row) form using flat
+`array` buffers, which keeps a nationwide network to a few MB per process.
+
+RouteStop.fare and RouteStop.time are cumulative from the route's origin terminal
+(time in minutes). Every weight inside the graph is in milliseconds and every fare
+is in centavos.
+
+A graph can be saved as a versioned binary snapshot (see `save_snapshot`). Workers
+memory-map the snapshot read-only, so every gunicorn worker on a host shares the same
+pages and starts without touching the database.
+"""
+
+import copy
+import heapq
+import logging
+import threading
+from array import array
+
+from api.utils.geo import haversine_km, coerce_polyline
+from .storage import RoutingIndexError, StringTable, map_arrays, routing_data_dir, write_arrays
+
+logger = logging.getLogger(__name__)
+
+# Fallback speeds for stops that have no recorded travel time
+MODE_SPEED_KMH = {
+    'tricycle': 15,
+    'tuktuk': 15,
+    'motorcycle': 25,
+    'jeepney': 18,
+    'bus': 25,
+    'train': 40,
+}
+DEFAULT_SPEED_KMH = 18
+
+MS_PER_MINUTE = 60_000
+UNREACHABLE = 2 ** 62
+
+# Below this many destinations, one hierarchy query per pair beats a one-to-many Dijkstra tree
+ONE_TO_MANY_MIN_TARGETS = 32
+
+SNAPSHOT_FILENAME = 'graph.bin'
+SNAPSHOT_FORMAT_VERSION = 1
+
+# edge_route value for walking transfer edges
+WALK = -1
+
+
+def estimate_ride_ms(distance_km: float, mode_name: str) -> int:
+    """Estimate ride time for a segment with no recorded time"""
+    speed = MODE_SPEED_KMH.get(mode_name, DEFAULT_SPEED_KMH)
+    return int(distance_km / speed * 3_600_000)
+
+
+class TransitGraph:
+    """
+    Directed multimodal graph over verified terminals and route stops.
+
+    Routes are indexed densely (`r`); each route owns a slice of the stop sequence
+    arrays where position 0 is its origin terminal. Edge `e` rides route
+    `edge_route[e]` from sequence position `edge_seq[e]` to the next position, or is a
+    walking transfer when `edge_route[e] == WALK`.
+    """
+
+    def __init__(self, data_version=None):
+        self.data_version = data_version
+        # Bumped by every incremental patch within the same data version
+        self.revision = 0
+        # Id of the last GraphChange this graph includes (see api/routing/updates.py)
+        self.change_id = 0
+        # Optional ContractionHierarchy attached by get_graph()
+        self.hierarchy = None
+
+        # Nodes
+        self.node_lat = array('d')
+        self.node_lng = array('d')
+        self.node_terminal = array('q')  # terminal id, -1 for plain stops
+        self.node_stop = array('q')  # route stop id, -1 for terminals
+        self.node_name = []
+        self.terminal_node = {}
+        self.stop_node = {}
+
+        # Routes
+        self.route_id = array('q')
+        self.route_mode = []
+        self.route_fare_type = []
+        self.route_destination = []
+        self.route_live = array('b')
+        self.route_index = {}
+
+        # Stop sequence per route (slice route_seq_offsets[r]:route_seq_offsets[r + 1])
+        self.route_seq_offsets = array('q', [0])
+        self.seq_node = array('q')
+        self.seq_stop_id = array('q')  # -1 for the origin terminal
+        self.seq_time_ms = array('q')
+        self.seq_fare = array('q')
+        self.seq_route = array('q')
+
+        # Routes serving each node (slice node_route_offsets[n]:node_route_offsets[n + 1])
+        self.node_route_offsets = array('q', [0])
+        self.node_route_seq = array('q')
+
+        # Flattened route polylines
+        self.route_poly_offsets = array('q', [0])
+        self.poly_lat = array('d')
+        self.poly_lng = array('d')
+
+        # CSR adjacency
+        self.offsets = array('q', [0])
+        self.edge_source = array('q')
+        self.edge_target = array('q')
+        self.edge_weight = array('q')
+        self.edge_route = array('q')
+        self.edge_seq = array('q')
+
+    @property
+    def node_count(self):
+        return len(self.node_lat)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_target)
+
+    # Construction
+
+    def add_node(self, lat, lng, name, terminal_id=-1, stop_id=-1):
+        self.node_lat.append(lat)
+        self.node_lng.append(lng)
+        self.node_terminal.append(terminal_id)
+        self.node_stop.append(stop_id)
+        self.node_name.append(name or '')
+        return len(self.node_lat) - 1
+
+    @classmethod
+    def from_rows(cls, terminals, routes, stops, data_version=None, transfers=()):
+        """
+        Build a graph from plain row tuples.
+
+        Args:
+            terminals: (id, name, latitude, longitude)
+            routes: (id, terminal_id, destination_name, mode_name, fare_type, polyline)
+            stops: (id, route_id, terminal_id, stop_name, fare, time, latitude, longitude),
+                ordered by route then stop order
+            transfers: (stop_id, terminal_id, walk_time_ms), added in both directions
+
+        Returns:
+            TransitGraph
+        """
+        graph = cls(data_version)
+
+        for terminal_id, name, lat, lng in terminals:
+            graph.terminal_node[terminal_id] = graph.add_node(
+                float(lat), float(lng), name or f"Terminal {terminal_id}", terminal_id=terminal_id
+            )
+
+        stops_by_route = {}
+        for row in stops:
+            stops_by_route.setdefault(row[1], []).append(row)
+
+        edges = []
+        for route_id, origin_id, destination, mode_name, fare_type, polyline in routes:
+            origin = graph.terminal_node.get(origin_id)
+            route_stops = stops_by_route.get(route_id)
+            if origin is None or not route_stops:
+                continue
+            graph._add_route(route_id, origin, destination, mode_name, fare_type, polyline, route_stops, edges)
+
+        edges.extend(graph._walk_edges(transfers))
+        graph._build_csr(edges)
+        graph._build_node_routes()
+        return graph
+
+    def _add_route(self, route_id, origin, destination, mode_name, fare_type, polyline, route_stops, edges):
+        r = len(self.route_id)
+        self.route_id.append(route_id)
+        self.route_mode.append(mode_name)
+        self.route_fare_type.append(fare_type)
+        self.route_destination.append(destination)
+        self.route_live.append(1)
+        self.route_index[route_id] = r
+
+        seq_start = len(self.seq_node)
+        self.seq_node.append(origin)
+        self.seq_stop_id.append(-1)
+        self.seq_time_ms.append(0)
+        self.seq_fare.append(0)
+        self.seq_route.append(r)
+
+        prev = origin
+        for stop_id, _, terminal_id, stop_name, fare, time, lat, lng in route_stops:
+            node = self.terminal_node.get(terminal_id) if terminal_id else None
+            if node is None:
+                if lat is None or lng is None:
+                    continue
+                node = self.add_node(float(lat), float(lng), stop_name, stop_id=stop_id)
+            self.stop_node[stop_id] = node
+
+            prev_time = self.seq_time_ms[-1]
+            if time is not None:
+                time_ms = max(int(time) * MS_PER_MINUTE, prev_time)
+            else:
+                hop_km = haversine_km(self.node_lat[prev], self.node_lng[prev], self.node_lat[node], self.node_lng[node])
+                time_ms = prev_time + estimate_ride_ms(hop_km, mode_name)
+
+            seq = len(self.seq_node) - seq_start
+            edges.append((prev, node, time_ms - prev_time, r, seq - 1))
+            self.seq_node.append(node)
+            self.seq_stop_id.append(stop_id)
+            self.seq_time_ms.append(time_ms)
+            self.seq_fare.append(int(round(float(fare or 0) * 100)))
+            self.seq_route.append(r)
+            prev = node
+
+        self.route_seq_offsets.append(len(self.seq_node))
+
+        for lat, lng in coerce_polyline(polyline):
+            self.poly_lat.append(lat)
+            self.poly_lng.append(lng)
+        self.route_poly_offsets.append(len(self.poly_lat))
+
+    def _walk_edges(self, transfers):
+        """Two-way walk edge tuples for (stop_id, terminal_id, walk_time_ms) rows"""
+        walks = {}
+        for stop_id, terminal_id, walk_ms in transfers:
+            u = self.stop_node.get(stop_id)
+            v = self.terminal_node.get(terminal_id)
+            if u is None or v is None or u == v:
+                continue
+            for pair in ((u, v), (v, u)):
+                walks[pair] = min(walk_ms, walks.get(pair, walk_ms))
+        return [(u, v, w, WALK, -1) for (u, v), w in walks.items()]
+
+    def _build_csr(self, edges):
+        """Counting-sort edge tuples by source node into the CSR arrays"""
+        n = self.node_count
+        counts = [0] * (n + 1)
+        for u, *_ in edges:
+            counts[u + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        self.offsets = array('q', counts)
+
+        size = len(edges)
+        self.edge_source = array('q', bytes(8 * size))
+        self.edge_target = array('q', bytes(8 * size))
+        self.edge_weight = array('q', bytes(8 * size))
+        self.edge_route = array('q', bytes(8 * size))
+        self.edge_seq = array('q', bytes(8 * size))
+        cursor = counts[:-1]
+        for u, v, w, r, seq in edges:
+            e = cursor[u]
+            cursor[u] += 1
+            self.edge_source[e] = u
+            self.edge_target[e] = v
+            self.edge_weight[e] = w
+            self.edge_route[e] = r
+            self.edge_seq[e] = seq
+
+    def _build_node_routes(self):
+        """Index every stop sequence position by the node it visits"""
+        n = self.node_count
+        counts = [0] * (n + 1)
+        for seq, node in enumerate(self.seq_node):
+            if self.route_live[self.seq_route[seq]]:
+                counts[node + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        self.node_route_offsets = array('q', counts)
+
+        self.node_route_seq = array('q', bytes(8 * counts[-1]))
+        cursor = counts[:-1]
+        for seq, node in enumerate(self.seq_node):
+            if self.route_live[self.seq_route[seq]]:
+                self.node_route_seq[cursor[node]] = seq
+                cursor[node] += 1
+
+    # Incremental updates
+
+    def clone(self):
+        """Copy that can be patched while readers keep using this graph"""
+        other = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, (array, list, dict)):
+                setattr(other, name, copy.copy(value))
+            elif isinstance(value, memoryview):
+                # Snapshot arrays are read-only mappings
+                setattr(other, name, array(value.format, value))
+            elif isinstance(value, StringTable):
+                setattr(other, name, list(value))
+        # Shortcuts no longer match once edges change
+        other.hierarchy = None
+        other.revision = self.revision + 1
+        return other
+
+    def upsert_terminal(self, terminal_id, name, lat, lng):
+        """Add a terminal node, or move/rename an existing one"""
+        node = self.terminal_node.get(terminal_id)
+        if node is None:
+            self.terminal_node[terminal_id] = self.add_node(
+                lat, lng, name or f"Terminal {terminal_id}", terminal_id=terminal_id
+            )
+        else:
+            self.node_lat[node] = lat
+            self.node_lng[node] = lng
+            self.node_name[node] = name or f"Terminal {terminal_id}"
+
+    def drop_terminal(self, terminal_id):
+        """
+        Stop routing to or from a terminal; its node stays as an unreachable slot.
+        Pass the returned node to `patch_routes(detached=...)` to drop its walk edges.
+        """
+        return self.terminal_node.pop(terminal_id, None)
+
+    def _retire_route(self, route_id):
+        """Tombstone a route; returns the plain stop nodes that now belong to nothing"""
+        r = self.route_index.pop(route_id, None)
+        if r is None:
+            return set()
+        self.route_live[r] = 0
+        dead = set()
+        for seq in range(self.route_seq_offsets[r] + 1, self.route_seq_offsets[r + 1]):
+            node = self.seq_node[seq]
+            if self.node_terminal[node] < 0:
+                dead.add(node)
+                self.stop_node.pop(self.node_stop[node], None)
+        return dead
+
+    def patch_routes(self, removed=(), added=(), transfers=(), detached=()):
+        """
+        Replace a handful of routes in place. Only call this on a `clone()`.
+
+        Only the CSR slices of nodes the change touches are rebuilt: the stops of removed
+        and added routes, detached nodes and their walking neighbours, and the sources of
+        new walking transfers. Everything in between is copied across unchanged.
+
+        Args:
+            removed: Route ids to drop (routes being re-added must be listed too)
+            added: (route_row, stop_rows) pairs in the `from_rows` row format
+            transfers: Walking transfer rows for the added routes' stops
+            detached: Nodes of dropped or moved terminals, whose walking transfers go too
+                (a moved terminal's come back through `transfers`)
+
+        Returns:
+            self
+        """
+        detached = set(detached)
+        touched = set()
+        for route_id in removed:
+            r = self.route_index.get(route_id)
+            if r is not None:
+                touched.update(self.seq_node[self.route_seq_offsets[r]:self.route_seq_offsets[r + 1]])
+            detached |= self._retire_route(route_id)
+        for node in detached:
+            touched.add(node)
+            # Walk edges come in pairs, so the ones into `node` start at its walk targets
+            for e in range(self.offsets[node], self.offsets[node + 1]):
+                if self.edge_route[e] == WALK:
+                    touched.add(self.edge_target[e])
+
+        first_seq = len(self.seq_node)
+        edges = []
+        for route_row, stop_rows in added:
+            route_id, origin_id, destination, mode_name, fare_type, polyline = route_row
+            origin = self.terminal_node.get(origin_id)
+            if origin is None or not stop_rows:
+                continue
+            self._add_route(route_id, origin, destination, mode_name, fare_type, polyline, stop_rows, edges)
+        touched.update(self.seq_node[first_seq:])
+        walks = self._walk_edges(transfers)
+        touched.update(u for u, *_ in walks)
+
+        edge_rows = {node: self._surviving_edges(node, detached) for node in touched}
+        for edge in edges:
+            edge_rows[edge[0]].append(edge)
+        for edge in walks:
+            rows = edge_rows[edge[0]]
+            # Transfers were just read from the database, so they replace a surviving walk
+            rows[:] = [row for row in rows if not (row[3] == WALK and row[1] == edge[1])]
+            rows.append(edge)
+        self._splice_csr('offsets', ('edge_source', 'edge_target', 'edge_weight', 'edge_route', 'edge_seq'), edge_rows)
+
+        seq_rows = {
+            node: [
+                (seq,) for seq in self.node_route_seq[self.node_route_offsets[node]:self.node_route_offsets[node + 1]]
+                if self.route_live[self.seq_route[seq]]
+            ] if node < len(self.node_route_offsets) - 1 else []
+            for node in touched
+        }
+        for seq in range(first_seq, len(self.seq_node)):
+            seq_rows[self.seq_node[seq]].append((seq,))
+        self._splice_csr('node_route_offsets', ('node_route_seq',), seq_rows)
+
+        self.hierarchy = None
+        return self
+
+    def _surviving_edges(self, node, detached):
+        """Edges out of `node` that stay after routes are retired and nodes detached"""
+        if node >= len(self.offsets) - 1:
+            return []
+        rows = []
+        for e in range(self.offsets[node], self.offsets[node + 1]):
+            v, r = self.edge_target[e], self.edge_route[e]
+            if r == WALK:
+                if node in detached or v in detached:
+                    continue
+            elif not self.route_live[r]:
+                continue
+            rows.append((node, v, self.edge_weight[e], r, self.edge_seq[e]))
+        return rows
+
+    def _splice_csr(self, offsets_name, column_names, rows_by_node):
+        """
+        Replace the rows of the nodes in `rows_by_node` in a CSR index, copying every
+        other node's rows across in bulk. Nodes added since the index was built get
+        empty slices unless they have rows.
+        """
+        old_offsets = getattr(self, offsets_name)
+        old_columns = [getattr(self, name) for name in column_names]
+        old_n = len(old_offsets) - 1
+
+        offsets = array('q', [0])
+        columns = [array('q') for _ in column_names]
+        node = 0
+        for t in sorted(rows_by_node) + [self.node_count]:
+            if t > node:
+                lo, hi = old_offsets[min(node, old_n)], old_offsets[min(t, old_n)]
+                shift = len(columns[0]) - lo
+                for column, old in zip(columns, old_columns):
+                    column.extend(old[lo:hi])
+                # Ends of the copied nodes, moved by the rows spliced in before them;
+                # nodes added since the build have none and end where the span does
+                ends = old_offsets[node + 1:min(t, old_n) + 1]
+                offsets.extend(map(shift.__add__, ends) if shift else ends)
+                offsets.extend([hi + shift] * (t - node - len(ends)))
+            if t == self.node_count:
+                break
+            for row in rows_by_node[t]:
+                for column, value in zip(columns, row):
+                    column.append(value)
+            offsets.append(len(columns[0]))
+            node = t + 1
+
+        setattr(self, offsets_name, offsets)
+        for name, column in zip(column_names, columns):
+            setattr(self, name, column)
+
+    # Snapshots
+
+    ARRAY_NAMES = (
+        'node_lat', 'node_lng', 'node_terminal', 'node_stop',
+        'route_id', 'route_live',
+        'route_seq_offsets', 'seq_node', 'seq_stop_id', 'seq_time_ms', 'seq_fare', 'seq_route',
+        'node_route_offsets', 'node_route_seq',
+        'route_poly_offsets', 'poly_lat', 'poly_lng',
+        'offsets', 'edge_source', 'edge_target', 'edge_weight', 'edge_route', 'edge_seq',
+    )
+    STRING_NAMES = ('node_name', 'route_mode', 'route_fare_type', 'route_destination')
+
+    def save_snapshot(self, path=None):
+        """Write every graph array to a binary snapshot; returns the path"""
+        path = path or routing_data_dir() / SNAPSHOT_FILENAME
+        arrays = {name: getattr(self, name) for name in self.ARRAY_NAMES}
+        for name in self.STRING_NAMES:
+            arrays[f'{name}_offsets'], arrays[f'{name}_blob'] = StringTable.pack(getattr(self, name))
+        meta = {
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'data_version': self.data_version,
+            'change_id': self.change_id,
+            'node_count': self.node_count,
+            'edge_count': self.edge_count,
+        }
+        write_arrays(path, meta, arrays)
+        return path
+
+    @classmethod
+    def load_snapshot(cls, path=None):
+        """
+        Memory-map a snapshot written by `save_snapshot`.
+
+        Arrays stay backed by the file; only the id -> index dicts are built in memory.
+        The result must be `clone()`d before patching.
+        """
+        meta, arrays = map_arrays(path or routing_data_dir() / SNAPSHOT_FILENAME)
+        if meta.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+            raise RoutingIndexError(f"Unsupported graph snapshot format: {meta.get('format_version')}")
+        expected = list(cls.ARRAY_NAMES)
+        for name in cls.STRING_NAMES:
+            expected += [f'{name}_offsets', f'{name}_blob']
+        missing = [name for name in expected if name not in arrays]
+        if missing:
+            raise RoutingIndexError(f"Graph snapshot is missing arrays: {missing}")
+
+        graph = cls(meta.get('data_version'))
+        graph.change_id = meta.get('change_id', 0)
+        for name in cls.ARRAY_NAMES:
+            setattr(graph, name, arrays[name])
+        for name in cls.STRING_NAMES:
+            setattr(graph, name, StringTable(arrays[f'{name}_offsets'], arrays[f'{name}_blob']))
+
+        graph.terminal_node = {t: node for node, t in enumerate(graph.node_terminal) if t >= 0}
+        # Stops linked to a terminal share its node, so only the sequences know them all
+        graph.stop_node = {
+            stop_id: graph.seq_node[seq] for seq, stop_id in enumerate(graph.seq_stop_id)
+            if stop_id >= 0 and graph.route_live[graph.seq_route[seq]]
+        }
+        graph.route_index = {
+            route_id: r for r, route_id in enumerate(graph.route_id) if graph.route_live[r]
+        }
+        return graph
+
+    # Queries
+
+    def shortest_path(self, source, target):
+        """
+        Plain Dijkstra on ride time.
+
+        Returns:
+            List of edge indices from source to target, or None if unreachable
+        """
+        if source == target:
+            return []
+        dist, pred = self._dijkstra(source, {target})
+        if dist[target] == UNREACHABLE:
+            return None
+        return self._unwind(pred, source, target)
+
+    def shortest_paths(self, source, targets):
+        """
+        One-to-many Dijkstra: a single search tree serves every target.
+
+        Returns:
+            Dict of target node -> list of edge indices, or None if unreachable
+        """
+        dist, pred = self._dijkstra(source, set(targets) - {source})
+        return {
+            target: [] if target == source
+            else None if dist[target] == UNREACHABLE
+            else self._unwind(pred, source, target)
+            for target in targets
+        }
+
+    def _dijkstra(self, source, targets):
+        """Search from `source` until every node in `targets` is settled; returns (dist, pred)"""
+        offsets = self.offsets
+        edge_target = self.edge_target
+        weights = self.edge_weight
+        dist = [UNREACHABLE] * self.node_count
+        pred = [-1] * self.node_count
+        dist[source] = 0
+        heap = [(0, source)]
+        remaining = len(targets)
+
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u in targets:
+                remaining -= 1
+            for e in range(offsets[u], offsets[u + 1]):
+                v = edge_target[e]
+                nd = d + weights[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap, (nd, v))
+        return dist, pred
+
+    def _unwind(self, pred, source, target):
+        path = []
+        node = target
+        while node != source:
+            e = pred[node]
+            path.append(e)
+            node = self.edge_source[e]
+        path.reverse()
+        return path
+
+    def plan(self, origin_terminal_id, destination_terminal_id):
+        """
+        Fastest terminal-to-terminal journey.
+
+        Returns:
+            Journey dict (see `describe_journey`), or None if no path exists
+        """
+        source = self.terminal_node[origin_terminal_id]
+        target = self.terminal_node[destination_terminal_id]
+        search = self.hierarchy.shortest_path if self.hierarchy is not None else self.shortest_path
+        path = search(source, target)
+        if path is None:
+            return None
+        return self.describe_journey(source, target, path)
+
+    def plan_many(self, origin_terminal_id, destination_terminal_ids):
+        """
+        Fastest journeys from one terminal to many.
+
+        Returns:
+            Dict of destination terminal id -> journey dict, or None if unreachable
+        """
+        source = self.terminal_node[origin_terminal_id]
+        targets = {self.terminal_node[tid] for tid in destination_terminal_ids}
+        if self.hierarchy is not None and len(targets) < ONE_TO_MANY_MIN_TARGETS:
+            paths = {target: self.hierarchy.shortest_path(source, target) for target in targets}
+        else:
+            paths = self.shortest_paths(source, targets)
+
+        journeys = {}
+        for tid in destination_terminal_ids:
+            target = self.terminal_node[tid]
+            path = paths[target]
+            journeys[tid] = None if path is None else self.describe_journey(source, target, path)
+        return journeys
+
+    # Presentation
+
+    def describe_node(self, node):
+        terminal_id = self.node_terminal[node]
+        stop_id = self.node_stop[node]
+        return {
+            'terminal_id': terminal_id if terminal_id >= 0 else None,
+            'stop_id': stop_id if stop_id >= 0 else None,
+            'name': self.node_name[node],
+            'latitude': round(self.node_lat[node], 6),
+            'longitude': round(self.node_lng[node], 6),
+        }
+
+    def split_legs(self, path):
+        """
+        Group consecutive edges riding the same route into (route, board, alight) legs.
+        Walking transfers become (WALK, edge, edge).
+        """
+        legs = []
+        for e in path:
+            r = self.edge_route[e]
+            seq = self.edge_seq[e]
+            if r == WALK:
+                legs.append([WALK, e, e])
+            elif legs and legs[-1][0] == r and legs[-1][2] == seq:
+                legs[-1][2] = seq + 1
+            else:
+                legs.append([r, seq, seq + 1])
+        return [tuple(leg) for leg in legs]
+
+    def leg_fare(self, r, board, alight):
+        """Fare in centavos for riding route `r` between two sequence positions"""
+        base = self.route_seq_offsets[r]
+        if self.route_fare_type[r] == 'distance_based':
+            return max(self.seq_fare[base + alight] - self.seq_fare[base + board], 0)
+        return self.seq_fare[base + alight]
+
+    def leg_time_ms(self, r, board, alight):
+        base = self.route_seq_offsets[r]
+        return self.seq_time_ms[base + alight] - self.seq_time_ms[base + board]
+
+    def leg_polyline(self, r, board, alight):
+        """Slice of the route polyline between the boarding and alighting nodes"""
+        base = self.route_seq_offsets[r]
+        start_node = self.seq_node[base + board]
+        end_node = self.seq_node[base + alight]
+        lo, hi = self.route_poly_offsets[r], self.route_poly_offsets[r + 1]
+
+        if hi - lo >= 2:
+            i = self._nearest_vertex(lo, hi, start_node)
+            j = self._nearest_vertex(lo, hi, end_node)
+            if i < j:
+                return [[round(self.poly_lat[k], 6), round(self.poly_lng[k], 6)] for k in range(i, j + 1)]
+
+        return [
+            [round(self.node_lat[node], 6), round(self.node_lng[node], 6)]
+            for node in (self.seq_node[base + k] for k in range(board, alight + 1))
+        ]
+
+    def _nearest_vertex(self, lo, hi, node):
+        lat, lng = self.node_lat[node], self.node_lng[node]
+        best, best_d = lo, float('inf')
+        for k in range(lo, hi):
+            d = (self.poly_lat[k] - lat) ** 2 + (self.poly_lng[k] - lng) ** 2
+            if d < best_d:
+                best, best_d = k, d
+        return best
+
+    def describe_walk(self, e):
+        source, target = self.edge_source[e], self.edge_target[e]
+        return {
+            'route_id': None,
+            'mode': 'walk',
+            'fare_type': None,
+            'destination_name': self.node_name[target],
+            'from': self.describe_node(source),
+            'to': self.describe_node(target),
+            'stops': 0,
+            'fare': 0.0,
+            'time_ms': self.edge_weight[e],
+            'polyline': [
+                [round(self.node_lat[source], 6), round(self.node_lng[source], 6)],
+                [round(self.node_lat[target], 6), round(self.node_lng[target], 6)],
+            ],
+        }
+
+    def describe_leg(self, r, board, alight):
+        if r == WALK:
+            return self.describe_walk(board)
+        base = self.route_seq_offsets[r]
+        return {
+            'route_id': self.route_id[r],
+            'mode': self.route_mode[r],
+            'fare_type': self.route_fare_type[r],
+            'destination_name': self.route_destination[r],
+            'from': self.describe_node(self.seq_node[base + board]),
+            'to': self.describe_node(self.seq_node[base + alight]),
+            'stops': alight - board,
+            'fare': self.leg_fare(r, board, alight) / 100,
+            'time_ms': self.leg_time_ms(r, board, alight),
+            'polyline': self.leg_polyline(r, board, alight),
+        }
+
+    def describe_journey(self, source, target, path):
+        legs = [self.describe_leg(*leg) for leg in self.split_legs(path)]
+        return {
+            'origin': self.describe_node(source),
+            'destination': self.describe_node(target),
+            'total_time_ms': sum(leg['time_ms'] for leg in legs),
+            'total_fare': round(sum(leg['fare'] for leg in legs), 2),
+            'transfers': count_transfers(legs),
+            'legs': legs,
+            'data_version': self.data_version,
+        }
+
+
+def count_transfers(legs):
+    """Number of vehicle changes in a list of described legs (walks are not rides)"""
+    rides = sum(1 for leg in legs if leg['mode'] != 'walk')
+    return max(rides - 1, 0)
+
+
+def route_rows(**filters):
+    """Verified routes in `TransitGraph.from_rows` format"""
+    from api.models import Route
+
+    return Route.objects.filter(verified=True, terminal__verified=True, **filters).order_by('id').values_list(
+        'id', 'terminal_id', 'destination_name', 'mode__mode_name', 'mode__fare_type', 'polyline'
+    )
+
+
+def stop_rows(**filters):
+    """Stops of verified routes in `TransitGraph.from_rows` format"""
+    from api.models import RouteStop
+
+    return RouteStop.objects.filter(
+        route__verified=True, route__terminal__verified=True, **filters
+    ).order_by('route_id', 'order').values_list(
+        'id', 'route_id', 'terminal_id', 'stop_name', 'fare', 'time', 'latitude', 'longitude'
+    )
+
+
+def transfer_rows(**filters):
+    """Walking transfers between verified terminals and stops of verified routes"""
+    from api.models import TransferEdge
+
+    return TransferEdge.objects.filter(
+        terminal__verified=True, stop__route__verified=True, **filters
+    ).values_list('stop_id', 'terminal_id', 'walk_time_ms')
+
+
+def build_graph(data_version=None):
+    """Load every verified terminal, route, stop and walking transfer and build a TransitGraph"""
+    from api.models import GraphChange, Terminal
+
+    # Read first: changes logged while the tables are read are replayed afterwards
+    change_id = GraphChange.latest_id()
+
+    terminals = Terminal.objects.filter(verified=True).order_by('id').values_list(
+        'id', 'name', 'latitude', 'longitude'
+    )
+    graph = TransitGraph.from_rows(
+        terminals.iterator(),
+        route_rows().iterator(),
+        stop_rows().iterator(),
+        data_version,
+        transfer_rows().iterator(),
+    )
+    graph.change_id = change_id
+    logger.info(
+        f"Built transit graph v{data_version}: {graph.node_count} nodes, "
+        f"{graph.edge_count} edges, {len(graph.route_id)} routes"
+    )
+    return graph
+
+
+def load_snapshot(data_version):
+    """Map the stored graph snapshot if it was built for `data_version`, otherwise None"""
+    try:
+        graph = TransitGraph.load_snapshot()
+    except RoutingIndexError as e:
+        logger.info(f"No graph snapshot available: {e}")
+        return None
+    if graph.data_version != data_version:
+        logger.info("Stored graph snapshot is stale, building from the database")
+        return None
+    logger.info(f"Mapped transit graph snapshot v{data_version}: {graph.node_count} nodes, {graph.edge_count} edges")
+    return graph
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def sync_loaded_graph():
+    """
+    Replay GraphChange rows the loaded graph does not include yet, e.g. right after this
+    process logged one. Does nothing if no graph is loaded yet.
+
+    The patched graph is a clone swapped in under the rebuild lock, so readers holding
+    the previous graph are never blocked or mutated.
+    """
+    global _graph
+    from .updates import catch_up
+
+    with _graph_lock:
+        if _graph is None:
+            return None
+        _graph = catch_up(_graph)
+        return _graph
+
+
+def get_graph():
+    """
+    Process-wide graph, rebuilt when the export cache data version moves and patched
+    when another process has logged a GraphChange since it was built.
+
+    Readers keep using the old graph until the replacement is fully built. A stored
+    graph snapshot and contraction hierarchy are used when they were built for the
+    same data version.
+    """
+    global _graph
+    from api.models import CachedExport, GraphChange
+    from .contraction import load_hierarchy
+    from .updates import catch_up
+
+    version = CachedExport.current_version()
+    change_id = GraphChange.latest_id()
+    graph = _graph
+    if graph is not None and graph.data_version == version and graph.change_id >= change_id:
+        return graph
+
+    with _graph_lock:
+        if _graph is None or _graph.data_version != version:
+            graph = load_snapshot(version) or build_graph(version)
+            graph.hierarchy = load_hierarchy(graph)
+            _graph = graph
+        if _graph.change_id < change_id:
+            _graph = catch_up(_graph)
+        return _graph
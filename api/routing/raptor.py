@@ -0,0 +1,321 @@
+"""
+Pareto Journey Search (RAPTOR)
+
+Round-based search over the TransitGraph route arrays. Round k relaxes every route
+that serves a node improved in round k - 1, so after k rounds each node holds every
+journey using at most k rides. Each node keeps a bag of labels that are Pareto
+optimal on (arrival time, fare); because later rounds only add labels that beat all
+earlier ones on time or fare, the destination bag is the Pareto set over time, fare
+and transfers in a single pass.
+
+Routes are frequency based (no timetables), so a ride's duration is the difference
+of the cumulative `seq_time_ms` values between boarding and alighting positions.
+After each round, newly improved labels may take one walking transfer edge.
+
+Without a target the same search computes every node's bag, which `reachable()` uses
+to answer isochrone queries; time and fare budgets prune labels as they are created.
+"""
+
+import time
+from collections import namedtuple
+
+from api.utils.geo import convex_hull
+from .graph import MS_PER_MINUTE, UNREACHABLE, WALK, count_transfers
+
+DEFAULT_MAX_ROUNDS = 4
+MAX_ROUNDS = 8
+DEFAULT_TIME_BUDGET_MS = 250
+ISOCHRONE_TIME_BUDGET_MS = 1000
+MAX_BAG_SIZE = 16
+
+# A journey ending at `node`. `route` is a route index, WALK (board = alight = the
+# walking edge) or None for the origin label
+Label = namedtuple('Label', 'time fare round parent route board alight node')
+
+
+def _dominated(bag, time_ms, fare):
+    for label in bag:
+        if label.time <= time_ms and label.fare <= fare:
+            return True
+    return False
+
+
+def _insert(bag, label):
+    """Insert `label` into a Pareto bag; returns False if it is dominated"""
+    if _dominated(bag, label.time, label.fare):
+        return False
+    bag[:] = [
+        l for l in bag
+        if not (label.time <= l.time and label.fare <= l.fare and label.round <= l.round)
+    ]
+    bag.append(label)
+    if len(bag) > MAX_BAG_SIZE:
+        bag.sort(key=lambda l: (l.time, l.fare))
+        # The fastest label of each round goes first, so cutting never drops the only
+        # journey with the fewest rides (rounds never outnumber MAX_BAG_SIZE)
+        fastest = {}
+        for l in bag:
+            fastest.setdefault(l.round, l)
+        kept = set(map(id, fastest.values()))
+        bag[:] = sorted(
+            list(fastest.values()) + [l for l in bag if id(l) not in kept][:MAX_BAG_SIZE - len(kept)],
+            key=lambda l: (l.time, l.fare),
+        )
+        return any(l is label for l in bag)
+    return True
+
+
+def _relax_footpaths(graph, improved, bags, target_bag, k, limits):
+    """Extend labels improved by riding with a single walking transfer"""
+    offsets = graph.offsets
+    targets = graph.edge_target
+    weights = graph.edge_weight
+    edge_route = graph.edge_route
+
+    walked = {}
+    for node, labels in improved.items():
+        for e in range(offsets[node], offsets[node + 1]):
+            if edge_route[e] != WALK:
+                continue
+            v = targets[e]
+            for parent in labels:
+                if parent.route == WALK:
+                    continue
+                label = Label(parent.time + weights[e], parent.fare, k, parent, WALK, e, e, v)
+                if label.time > limits[0] or _dominated(target_bag, label.time, label.fare):
+                    continue
+                if _insert(bags.setdefault(v, []), label):
+                    walked.setdefault(v, []).append(label)
+
+    for node, labels in walked.items():
+        improved.setdefault(node, []).extend(labels)
+
+
+def _search(graph, source, target=None, max_rounds=DEFAULT_MAX_ROUNDS, time_budget_ms=DEFAULT_TIME_BUDGET_MS,
+            max_time_ms=UNREACHABLE, max_fare=UNREACHABLE):
+    """
+    Run the rounds and return (bags, rounds completed, truncated flag).
+    Labels slower than `max_time_ms` or dearer than `max_fare` are never created.
+    """
+    max_rounds = max(1, min(max_rounds, MAX_ROUNDS))
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    limits = (max_time_ms, max_fare)
+
+    seq_offsets = graph.route_seq_offsets
+    seq_node = graph.seq_node
+    seq_time = graph.seq_time_ms
+    seq_fare = graph.seq_fare
+    seq_route = graph.seq_route
+    node_route_offsets = graph.node_route_offsets
+    node_route_seq = graph.node_route_seq
+    fare_type = graph.route_fare_type
+
+    bags = {source: [Label(0, 0, 0, None, None, -1, -1, source)]}
+    new_labels = {source: bags[source][:]}
+    if target is None:
+        # Nothing to prune against
+        target_bag = []
+    else:
+        target_bag = bags.setdefault(target, []) if target != source else bags[source]
+    _relax_footpaths(graph, new_labels, bags, target_bag, 0, limits)
+    rounds = 0
+    truncated = False
+
+    for k in range(1, max_rounds + 1):
+        if not new_labels:
+            break
+
+        # Collect routes serving improved nodes, with the earliest improved position
+        queue = {}
+        for node in new_labels:
+            for i in range(node_route_offsets[node], node_route_offsets[node + 1]):
+                seq = node_route_seq[i]
+                r = seq_route[seq]
+                pos = seq - seq_offsets[r]
+                if seq + 1 < seq_offsets[r + 1] and pos < queue.get(r, pos + 1):
+                    queue[r] = pos
+
+        improved = {}
+        for r, start in queue.items():
+            if time.perf_counter() > deadline:
+                truncated = True
+                break
+
+            base = seq_offsets[r]
+            distance_based = fare_type[r] == 'distance_based'
+            # Riding labels: (time at boarding, fare before boarding, boarding position, parent)
+            riding = []
+
+            for pos in range(start, seq_offsets[r + 1] - base):
+                node = seq_node[base + pos]
+                t_here = seq_time[base + pos]
+                f_here = seq_fare[base + pos]
+
+                for t0, f0, board, parent in riding:
+                    ride_fare = max(f_here - seq_fare[base + board], 0) if distance_based else f_here
+                    label = Label(
+                        t0 + t_here - seq_time[base + board], f0 + ride_fare,
+                        k, parent, r, board, pos, node
+                    )
+                    if label.time > max_time_ms or label.fare > max_fare:
+                        continue
+                    if _dominated(target_bag, label.time, label.fare):
+                        continue
+                    if _insert(bags.setdefault(node, []), label):
+                        improved.setdefault(node, []).append(label)
+
+                for parent in new_labels.get(node, ()):
+                    if parent.route == r:
+                        continue
+                    key_t = parent.time - t_here
+                    key_f = parent.fare - (f_here if distance_based else 0)
+                    if any(
+                        t0 - seq_time[base + b] <= key_t
+                        and f0 - (seq_fare[base + b] if distance_based else 0) <= key_f
+                        for t0, f0, b, _ in riding
+                    ):
+                        continue
+                    riding.append((parent.time, parent.fare, pos, parent))
+
+        rounds = k
+        _relax_footpaths(graph, improved, bags, target_bag, k, limits)
+        new_labels = {}
+        for node, labels in improved.items():
+            alive = {id(l) for l in bags[node]}
+            labels = [l for l in labels if id(l) in alive]
+            if labels:
+                new_labels[node] = labels
+        if truncated:
+            break
+
+    return bags, rounds, truncated
+
+
+def pareto_search(graph, source, target, max_rounds=DEFAULT_MAX_ROUNDS, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    """
+    Multi-criteria RAPTOR from `source` to `target` node.
+
+    Args:
+        max_rounds: Maximum rides per journey (capped at MAX_ROUNDS)
+        time_budget_ms: Wall-clock budget; the search stops after the current route
+            once it is exceeded and returns what it has found
+
+    Returns:
+        (labels at target sorted by time, rounds completed, truncated flag)
+    """
+    bags, rounds, truncated = _search(graph, source, target, max_rounds, time_budget_ms)
+    results = sorted((l for l in bags.get(target, []) if l.parent is not None), key=lambda l: (l.time, l.fare))
+    return results, rounds, truncated
+
+
+def reachable(graph, source, max_time_ms=UNREACHABLE, max_fare=UNREACHABLE, max_rounds=DEFAULT_MAX_ROUNDS,
+              time_budget_ms=ISOCHRONE_TIME_BUDGET_MS):
+    """
+    Every node reachable from `source` within a travel time and/or fare budget.
+
+    Returns:
+        ({node: Pareto bag of labels within budget}, rounds completed, truncated flag)
+    """
+    bags, rounds, truncated = _search(
+        graph, source, None, max_rounds, time_budget_ms, max_time_ms=max_time_ms, max_fare=max_fare
+    )
+    return {node: bag for node, bag in bags.items() if bag}, rounds, truncated
+
+
+def label_legs(label):
+    """Unwind a label into (route, board, alight) legs in travel order"""
+    legs = []
+    while label is not None and label.parent is not None:
+        legs.append((label.route, label.board, label.alight))
+        label = label.parent
+    legs.reverse()
+    return legs
+
+
+def pareto_journeys(graph, origin_terminal_id, destination_terminal_id, max_transfers=DEFAULT_MAX_ROUNDS - 1):
+    """
+    Pareto-optimal journeys between two terminals over time, fare and transfers.
+
+    Returns:
+        Dict with the origin, destination and a list of journeys sorted by time
+    """
+    source = graph.terminal_node[origin_terminal_id]
+    target = graph.terminal_node[destination_terminal_id]
+    labels, rounds, truncated = pareto_search(graph, source, target, max_rounds=max_transfers + 1)
+
+    journeys = []
+    for label in labels:
+        legs = [graph.describe_leg(*leg) for leg in label_legs(label)]
+        journeys.append({
+            'total_time_ms': label.time,
+            'total_fare': label.fare / 100,
+            'transfers': count_transfers(legs),
+            'tags': [],
+            'legs': legs,
+        })
+
+    if journeys:
+        min(journeys, key=lambda j: (j['total_time_ms'], j['total_fare']))['tags'].append('fastest')
+        min(journeys, key=lambda j: (j['total_fare'], j['total_time_ms']))['tags'].append('cheapest')
+        min(journeys, key=lambda j: (j['transfers'], j['total_time_ms']))['tags'].append('fewest_transfers')
+
+    return {
+        'origin': graph.describe_node(source),
+        'destination': graph.describe_node(target),
+        'journeys': journeys,
+        'rounds': rounds,
+        'truncated': truncated,
+        'data_version': graph.data_version,
+    }
+
+
+def isochrone(graph, origin_terminal_id, max_minutes=None, max_fare=None, max_transfers=DEFAULT_MAX_ROUNDS - 1, hull=False):
+    """
+    Terminals reachable from a terminal within `max_minutes` and/or `max_fare` pesos.
+
+    Each terminal reports its best journey on the budgeted criterion (time when a time
+    budget is given, otherwise fare), with the other criterion as tie-breaker.
+
+    Returns:
+        Dict with the origin, reachable terminals sorted by cost and an optional hull
+    """
+    source = graph.terminal_node[origin_terminal_id]
+    max_time_ms = UNREACHABLE if max_minutes is None else int(max_minutes * MS_PER_MINUTE)
+    max_fare_c = UNREACHABLE if max_fare is None else int(round(max_fare * 100))
+    bags, rounds, truncated = reachable(
+        graph, source, max_time_ms=max_time_ms, max_fare=max_fare_c, max_rounds=max_transfers + 1
+    )
+
+    by_time = max_minutes is not None
+    key = (lambda l: (l.time, l.fare)) if by_time else (lambda l: (l.fare, l.time))
+    terminals = []
+    for node, bag in bags.items():
+        terminal_id = graph.node_terminal[node]
+        if terminal_id < 0 or graph.terminal_node.get(terminal_id) != node:
+            continue
+        best = min(bag, key=key)
+        terminals.append({
+            'terminal_id': terminal_id,
+            'name': graph.node_name[node],
+            'latitude': graph.node_lat[node],
+            'longitude': graph.node_lng[node],
+            'time_ms': best.time,
+            'fare': best.fare / 100,
+            'transfers': max(sum(1 for leg in label_legs(best) if leg[0] != WALK) - 1, 0),
+        })
+    terminals.sort(key=lambda t: (t['time_ms'], t['fare']) if by_time else (t['fare'], t['time_ms']))
+
+    result = {
+        'origin': graph.describe_node(source),
+        'max_minutes': max_minutes,
+        'max_fare': max_fare,
+        'terminals': terminals,
+        'rounds': rounds,
+        'truncated': truncated,
+        'data_version': graph.data_version,
+    }
+    if hull:
+        result['hull'] = [list(point) for point in convex_hull(
+            (t['latitude'], t['longitude']) for t in terminals
+        )]
+    return result
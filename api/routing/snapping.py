@@ -0,0 +1,289 @@
+"""
+Terminal Snapping
+
+Maps an arbitrary coordinate (a rider's GPS fix, a destination pin) to the nearest
+verified terminals, the first step of every trip in descriptions.txt.
+
+`TerminalIndex` keeps every verified terminal as NumPy arrays (ids, coordinates and a
+bitmask of the transport modes serving it) sorted by latitude, and answers radius and
+k-nearest queries with vectorized haversine math. One process-wide index is built per
+export cache data version and dropped as soon as a terminal is added, moved, verified or
+removed, or a route change may alter the modes serving a terminal.
+
+`search_terminals` answers the same questions straight from the database through the
+indexed `Terminal.geohash` column: it reads only the geohash cells covering the search
+circle, so its cost tracks the number of nearby terminals rather than the table size.
+`find_terminals` serves from the index when it is current and from the database while a
+fresh index is being built in the background.
+"""
+
+import logging
+import math
+import threading
+
+import numpy as np
+from django.db import connection
+from django.db.models import Q
+
+from api.utils.geo import EARTH_RADIUS_KM, KM_PER_DEGREE, geohash_radius_cover, haversine_km
+
+logger = logging.getLogger(__name__)
+
+# Terminals checked when snapping to the routing graph, which may briefly lag the index
+SNAP_CANDIDATES = 8
+# k-nearest database search starts at this radius and grows 4x per attempt up to the max
+KNN_START_RADIUS_KM = 2
+MAX_SEARCH_RADIUS_KM = 200
+# Route and RouteStop fields the per-terminal mode masks are built from
+MODE_MASK_FIELDS = {'verified', 'terminal_id', 'mode_id', 'route_id'}
+
+
+class TerminalIndex:
+    """Vectorized k-nearest and radius lookups over verified terminals"""
+
+    def __init__(self, ids, lats, lngs, mode_masks=None, mode_bits=None, data_version=None):
+        """
+        Args:
+            ids, lats, lngs: Parallel sequences, one entry per terminal
+            mode_masks: Per-terminal bitmask of serving modes (see `mode_bits`)
+            mode_bits: Mode name -> bit
+        """
+        self.data_version = data_version
+        lats = np.asarray(lats, dtype=np.float64)
+        order = np.argsort(lats, kind='stable')
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.lat = lats[order]
+        self.lng = np.asarray(lngs, dtype=np.float64)[order]
+        self.lat_rad = np.radians(self.lat)
+        self.lng_rad = np.radians(self.lng)
+        self.cos_lat = np.cos(self.lat_rad)
+        if mode_masks is None:
+            self.mode_mask = np.zeros(len(self.ids), dtype=np.uint16)
+        else:
+            self.mode_mask = np.asarray(mode_masks, dtype=np.uint16)[order]
+        self.mode_bits = mode_bits or {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _distances(self, lat, lng, lo, hi):
+        phi = math.radians(lat)
+        dphi = self.lat_rad[lo:hi] - phi
+        dlmb = self.lng_rad[lo:hi] - math.radians(lng)
+        a = np.sin(dphi / 2) ** 2 + math.cos(phi) * self.cos_lat[lo:hi] * np.sin(dlmb / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def nearest(self, lat, lng, k=1, radius_km=None, mode=None):
+        """
+        Up to `k` closest terminals, optionally limited to `radius_km` and to terminals
+        served by `mode`. With k=None every match within `radius_km` is returned.
+
+        Returns:
+            List of (terminal_id, distance_km) sorted by distance
+        """
+        if k is None and radius_km is None:
+            raise ValueError("k or radius_km is required")
+
+        lo, hi = 0, len(self.ids)
+        if radius_km is not None:
+            # Latitude is sorted, so the radius band is one contiguous slice
+            lat_delta = radius_km / KM_PER_DEGREE
+            lo = int(np.searchsorted(self.lat, lat - lat_delta, side='left'))
+            hi = int(np.searchsorted(self.lat, lat + lat_delta, side='right'))
+
+        distances = self._distances(lat, lng, lo, hi)
+        keep = np.ones(hi - lo, dtype=bool) if radius_km is None else distances <= radius_km
+        if mode is not None:
+            bit = self.mode_bits.get(mode, 0)
+            keep &= (self.mode_mask[lo:hi] & bit) != 0
+        matches = np.flatnonzero(keep)
+
+        if k is not None and len(matches) > k:
+            matches = matches[np.argpartition(distances[matches], k - 1)[:k]]
+        matches = matches[np.argsort(distances[matches], kind='stable')]
+        return [(int(self.ids[lo + i]), float(distances[i])) for i in matches]
+
+    def is_current(self, terminal):
+        """True if `terminal` is already indexed exactly as saved"""
+        positions = np.flatnonzero(self.ids == terminal.id)
+        if not terminal.verified:
+            return len(positions) == 0
+        if len(positions) == 0:
+            return False
+        i = positions[0]
+        return (float(self.lat[i]), float(self.lng[i])) == (float(terminal.latitude), float(terminal.longitude))
+
+
+def build_index(data_version=None):
+    from api.models import Terminal, Route, RouteStop, ModeOfTransport
+
+    mode_bits = {mode: 1 << bit for bit, (mode, _) in enumerate(ModeOfTransport.MODE_CHOICES)}
+    masks = {}
+    served = Route.objects.filter(verified=True).values_list('terminal_id', 'mode__mode_name').distinct()
+    stopped = RouteStop.objects.filter(route__verified=True, terminal__isnull=False).values_list(
+        'terminal_id', 'route__mode__mode_name'
+    ).distinct()
+    for rows in (served, stopped):
+        for terminal_id, mode in rows:
+            masks[terminal_id] = masks.get(terminal_id, 0) | mode_bits.get(mode, 0)
+
+    ids, lats, lngs = [], [], []
+    for terminal_id, lat, lng in Terminal.objects.filter(verified=True).values_list('id', 'latitude', 'longitude').iterator():
+        ids.append(terminal_id)
+        lats.append(float(lat))
+        lngs.append(float(lng))
+
+    index = TerminalIndex(ids, lats, lngs, [masks.get(i, 0) for i in ids], mode_bits, data_version)
+    logger.info(f"Built terminal snapping index v{data_version}: {len(index)} terminals")
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+
+
+def get_index():
+    """Process-wide terminal index for the current export cache data version (built if needed)"""
+    global _index
+    from api.models import CachedExport
+
+    version = CachedExport.current_version()
+    index = _index
+    if index is not None and index.data_version == version:
+        return index
+
+    with _index_lock:
+        if _index is None or _index.data_version != version:
+            _index = build_index(version)
+        return _index
+
+
+def fresh_index():
+    """
+    The loaded index if it matches the current data version. Otherwise returns None and
+    starts a background rebuild, so the caller can fall back to the database.
+    """
+    global _rebuilding
+    from api.models import CachedExport
+
+    version = CachedExport.current_version()
+    index = _index
+    if index is not None and index.data_version == version:
+        return index
+
+    with _index_lock:
+        if _rebuilding:
+            return None
+        _rebuilding = True
+
+    def rebuild():
+        global _index, _rebuilding
+        try:
+            index = build_index(version)
+            with _index_lock:
+                _index = index
+        except Exception as e:
+            logger.error(f"Terminal index rebuild failed: {str(e)}")
+        finally:
+            _rebuilding = False
+            connection.close()
+
+    threading.Thread(target=rebuild, daemon=True).start()
+    return None
+
+
+def invalidate(terminal=None, deleted=False):
+    """Drop the loaded index unless `terminal` is a change it already reflects"""
+    global _index
+    index = _index
+    if index is None:
+        return
+    if terminal is not None and not deleted and index.is_current(terminal):
+        return
+    with _index_lock:
+        _index = None
+
+
+def nearest_terminals(lat, lng, k=1, radius_km=None):
+    """Shortcut for `get_index().nearest(...)`"""
+    return get_index().nearest(lat, lng, k=k, radius_km=radius_km)
+
+
+def snap_to_graph(graph, lat, lng):
+    """
+    Nearest verified terminal that is also a node of `graph`.
+
+    Returns:
+        (terminal_id, distance_km), or None if no candidate is routable
+    """
+    for terminal_id, distance in nearest_terminals(lat, lng, k=SNAP_CANDIDATES):
+        if terminal_id in graph.terminal_node:
+            return terminal_id, distance
+    return None
+
+
+def _terminals_within(lat, lng, radius_km, mode=None):
+    from api.models import Terminal
+
+    cells = Q()
+    for cell in geohash_radius_cover(lat, lng, radius_km):
+        cells |= Q(geohash__startswith=cell)
+    terminals = Terminal.objects.filter(cells, verified=True)
+    if mode:
+        terminals = terminals.filter(
+            Q(origin_routes__mode__mode_name=mode, origin_routes__verified=True)
+            | Q(route_stops__route__mode__mode_name=mode, route_stops__route__verified=True)
+        ).distinct()
+
+    hits = []
+    for terminal_id, terminal_lat, terminal_lng in terminals.values_list('id', 'latitude', 'longitude'):
+        distance = haversine_km(lat, lng, float(terminal_lat), float(terminal_lng))
+        if distance <= radius_km:
+            hits.append((terminal_id, distance))
+    hits.sort(key=lambda hit: hit[1])
+    return hits
+
+
+def search_terminals(lat, lng, radius_km=None, limit=None, mode=None):
+    """
+    Verified terminals near a point, nearest first, straight from the database.
+
+    Args:
+        radius_km: Search radius; without it, the `limit` nearest terminals within
+            MAX_SEARCH_RADIUS_KM are returned
+        limit: Maximum number of results
+        mode: Only terminals served by a verified route of this mode (e.g. 'jeepney')
+
+    Returns:
+        List of (terminal_id, distance_km)
+    """
+    if radius_km is not None:
+        hits = _terminals_within(lat, lng, radius_km, mode)
+        return hits[:limit] if limit else hits
+    if not limit:
+        raise ValueError("radius_km or limit is required")
+
+    radius = KNN_START_RADIUS_KM
+    while True:
+        hits = _terminals_within(lat, lng, radius, mode)
+        if len(hits) >= limit or radius >= MAX_SEARCH_RADIUS_KM:
+            return hits[:limit]
+        radius = min(radius * 4, MAX_SEARCH_RADIUS_KM)
+
+
+def find_terminals(lat, lng, radius_km=None, limit=None, mode=None):
+    """
+    `search_terminals` semantics, answered from the in-memory index when it is current
+    and from the database otherwise.
+    """
+    index = fresh_index()
+    if index is None:
+        return search_terminals(lat, lng, radius_km=radius_km, limit=limit, mode=mode)
+    if radius_km is None and not limit:
+        raise ValueError("radius_km or limit is required")
+    return index.nearest(
+        lat, lng, k=limit,
+        radius_km=radius_km if radius_km is not None else MAX_SEARCH_RADIUS_KM,
+        mode=mode,
+    )
@@ -0,0 +1,177 @@
+"""
+Routing Index Storage
+
+Minimal binary container for the flat arrays produced by the routing engine.
+
+Layout:
+    magic (4 bytes) | header length (uint32, little endian) | JSON header | padding | array blobs
+
+The JSON header carries free-form metadata plus, for every array, its typecode,
+byte offset (8-byte aligned) and item count, so a reader can slice the blobs
+without parsing anything else. Because blobs are aligned, a file can be memory-mapped
+read-only and every array used in place, letting all gunicorn workers share one copy
+of the pages.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from pathlib import Path
+
+from django.conf import settings
+
+MAGIC = b'LKBY'
+ALIGN = 8
+
+
+class RoutingIndexError(Exception):
+    """Raised when a stored routing index is missing, corrupt or incompatible"""
+    pass
+
+
+def routing_data_dir() -> Path:
+    """Directory that holds built routing indexes (created on demand)"""
+    path = Path(getattr(settings, 'ROUTING_DATA_DIR', Path(settings.BASE_DIR) / 'routing_data'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_arrays(path, meta: dict, arrays: dict):
+    """
+    Atomically write metadata and named arrays to `path`.
+
+    Args:
+        path: Destination file
+        meta: JSON-serializable metadata
+        arrays: Mapping of name -> array.array
+    """
+    entries = []
+    offset = 0
+    for name, values in arrays.items():
+        offset = -(-offset // ALIGN) * ALIGN
+        entries.append({
+            'name': name,
+            'typecode': values.typecode,
+            'offset': offset,
+            'length': len(values),
+        })
+        offset += len(values) * values.itemsize
+
+    header = json.dumps({'meta': meta, 'arrays': entries}).encode()
+    prefix = MAGIC + struct.pack('<I', len(header)) + header
+    data_start = -(-len(prefix) // ALIGN) * ALIGN
+
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(prefix)
+            fh.write(b'\0' * (data_start - len(prefix)))
+            written = 0
+            for entry, values in zip(entries, arrays.values()):
+                fh.write(b'\0' * (entry['offset'] - written))
+                fh.write(values.tobytes())
+                written = entry['offset'] + len(values) * values.itemsize
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def parse_header(buffer):
+    """
+    Parse the header of a routing index held in a bytes-like buffer.
+
+    Returns:
+        (meta, entries, data_start)
+    """
+    if bytes(buffer[:4]) != MAGIC:
+        raise RoutingIndexError("Not a routing index file")
+    (header_len,) = struct.unpack('<I', bytes(buffer[4:8]))
+    header = json.loads(bytes(buffer[8:8 + header_len]))
+    data_start = -(-(8 + header_len) // ALIGN) * ALIGN
+    return header['meta'], header['arrays'], data_start
+
+
+def read_arrays(path):
+    """
+    Read a routing index written by `write_arrays` into memory.
+
+    Returns:
+        (meta, {name: array.array})
+    """
+    try:
+        raw = Path(path).read_bytes()
+    except FileNotFoundError:
+        raise RoutingIndexError(f"Routing index not found: {path}")
+
+    meta, entries, data_start = parse_header(raw)
+    arrays = {}
+    for entry in entries:
+        values = array(entry['typecode'])
+        start = data_start + entry['offset']
+        values.frombytes(raw[start:start + entry['length'] * values.itemsize])
+        arrays[entry['name']] = values
+    return meta, arrays
+
+
+def map_arrays(path):
+    """
+    Memory-map a routing index read-only without copying any array data.
+
+    Returns:
+        (meta, {name: memoryview}) where each view is cast to the array's typecode
+    """
+    try:
+        with open(path, 'rb') as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        raise RoutingIndexError(f"Routing index not found: {path}")
+    except ValueError:
+        raise RoutingIndexError(f"Routing index is empty: {path}")
+
+    view = memoryview(mapped)
+    meta, entries, data_start = parse_header(view)
+    arrays = {}
+    for entry in entries:
+        itemsize = array(entry['typecode']).itemsize
+        start = data_start + entry['offset']
+        end = start + entry['length'] * itemsize
+        if end > len(view):
+            raise RoutingIndexError(f"Routing index is truncated: {path}")
+        arrays[entry['name']] = view[start:end].cast(entry['typecode'])
+    return meta, arrays
+
+
+class StringTable:
+    """Read-only sequence of strings stored as one UTF-8 blob plus offsets"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    @staticmethod
+    def pack(strings):
+        """Returns (offsets, blob) arrays for `strings`"""
+        offsets = array('q', [0])
+        blob = array('B')
+        for value in strings:
+            blob.frombytes((value or '').encode())
+            offsets.append(len(blob))
+        return offsets, blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode()
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
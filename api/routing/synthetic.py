@@ -0,0 +1,99 @@
+"""
+Synthetic Network Generator
+
+Builds a deterministic, nationwide-looking transit network as plain row tuples in the
+shape `TransitGraph.from_rows` expects, so routing benchmarks can run without a
+database. Cities sit on a jittered lattice over the Philippine bounding box; each city
+gets local jeepney/tricycle loops and its hub terminal gets intercity bus routes to the
+nearest neighbouring hubs.
+"""
+
+import random
+
+from api.utils.geo import haversine_km
+
+PH_BOUNDS = (5.0, 19.0, 117.0, 127.0)  # min lat, max lat, min lng, max lng
+
+
+def generate_network(cities=200, terminals_per_city=25, local_routes=12, intercity_links=3, seed=42):
+    """
+    Generate terminals, routes and stops rows.
+
+    Returns:
+        (terminals, routes, stops) lists of tuples
+    """
+    rng = random.Random(seed)
+    min_lat, max_lat, min_lng, max_lng = PH_BOUNDS
+
+    cols = max(int(cities ** 0.5), 1)
+    rows = -(-cities // cols)
+    lat_step = (max_lat - min_lat) / rows
+    lng_step = (max_lng - min_lng) / cols
+
+    terminals = []
+    city_terminals = []
+    for c in range(cities):
+        center_lat = min_lat + (c // cols + 0.5) * lat_step + rng.uniform(-0.2, 0.2) * lat_step
+        center_lng = min_lng + (c % cols + 0.5) * lng_step + rng.uniform(-0.2, 0.2) * lng_step
+        members = []
+        for _ in range(terminals_per_city):
+            terminal_id = len(terminals) + 1
+            terminals.append((
+                terminal_id,
+                f"City {c} Terminal {len(members)}",
+                round(center_lat + rng.uniform(-0.05, 0.05), 6),
+                round(center_lng + rng.uniform(-0.05, 0.05), 6),
+            ))
+            members.append(terminal_id)
+        city_terminals.append(members)
+
+    coords = {t[0]: (t[2], t[3]) for t in terminals}
+    routes = []
+    stops = []
+
+    def add_route(origin, path, mode_name, fare_type, base_fare, per_km, speed_kmh):
+        route_id = len(routes) + 1
+        polyline = [list(coords[origin])]
+        prev = coords[origin]
+        km = 0.0
+        for order, (terminal_id, point) in enumerate(path, start=1):
+            km += haversine_km(prev[0], prev[1], point[0], point[1])
+            minutes = max(int(km / speed_kmh * 60 * rng.uniform(0.9, 1.3)), order)
+            fare = round(base_fare + per_km * km, 2)
+            stops.append((
+                len(stops) + 1, route_id, terminal_id,
+                f"Stop {order}", fare, minutes, point[0], point[1],
+            ))
+            polyline.append([point[0], point[1]])
+            prev = point
+        routes.append((route_id, origin, f"Route {route_id}", mode_name, fare_type, polyline))
+
+    for members in city_terminals:
+        for _ in range(local_routes):
+            origin, *chain = rng.sample(members, min(len(members), rng.randint(3, 7)))
+            path = []
+            for terminal_id in chain:
+                if rng.random() < 0.3:
+                    lat, lng = coords[terminal_id]
+                    path.append((None, (round(lat + rng.uniform(-0.01, 0.01), 6), round(lng + rng.uniform(-0.01, 0.01), 6))))
+                path.append((terminal_id, coords[terminal_id]))
+            mode = rng.choice((('jeepney', 'distance_based', 13, 1.8, 18), ('tricycle', 'fixed', 15, 0, 15)))
+            add_route(origin, path, *mode)
+
+    hubs = [members[0] for members in city_terminals]
+    for hub in hubs:
+        lat, lng = coords[hub]
+        nearest = sorted(
+            (h for h in hubs if h != hub),
+            key=lambda h: haversine_km(lat, lng, coords[h][0], coords[h][1])
+        )[:intercity_links]
+        for other in nearest:
+            end = coords[other]
+            path = []
+            for k in range(1, rng.randint(1, 3) + 1):
+                f = k / 4
+                path.append((None, (round(lat + (end[0] - lat) * f, 6), round(lng + (end[1] - lng) * f, 6))))
+            path.append((other, end))
+            add_route(hub, path, 'bus', 'fixed', 0, 2.2, 45)
+
+    return terminals, routes, stops
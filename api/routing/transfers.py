@@ -0,0 +1,156 @@
+"""
+Walking Transfers
+
+Precomputes TransferEdge rows linking every route stop to the terminals within a
+walking radius, so the planner can chain e.g. tricycle -> bus -> LRT when one route's
+stop is a short walk from another route's terminal.
+
+Pairs are stored for every stop and terminal with coordinates; verification is
+applied when the planner loads them. A full rebuild uses an in-memory grid index;
+saving a single Terminal or RouteStop only recomputes the pairs that involve it, and
+only when its location changes (or, for a terminal, when it is verified).
+"""
+
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from api.utils.geo import GridIndex, bounding_box, haversine_km
+
+logger = logging.getLogger(__name__)
+
+WALK_SPEED_MPS = 1.33
+# Streets are rarely straight; inflate the great-circle distance
+DETOUR_FACTOR = 1.3
+BATCH_SIZE = 2000
+
+
+def walk_radius_m() -> int:
+    return int(getattr(settings, 'TRANSFER_WALK_RADIUS_M', 400))
+
+
+def walk_time_ms(distance_m: float) -> int:
+    return int(distance_m * DETOUR_FACTOR / WALK_SPEED_MPS * 1000)
+
+
+def _edge(stop_id, terminal_id, distance_km):
+    from api.models import TransferEdge
+
+    distance_m = int(round(distance_km * 1000))
+    return TransferEdge(
+        stop_id=stop_id,
+        terminal_id=terminal_id,
+        distance_m=distance_m,
+        walk_time_ms=walk_time_ms(distance_m),
+    )
+
+
+def find_pairs(stops, terminals, radius_m):
+    """
+    Match stops to nearby terminals with a grid index.
+
+    Args:
+        stops: (stop_id, linked_terminal_id, latitude, longitude)
+        terminals: (terminal_id, latitude, longitude)
+
+    Yields:
+        (stop_id, terminal_id, distance_km)
+    """
+    radius_km = radius_m / 1000
+    index = GridIndex(radius_km)
+    for terminal_id, lat, lng in terminals:
+        index.add(terminal_id, float(lat), float(lng))
+
+    for stop_id, linked_terminal_id, lat, lng in stops:
+        if lat is None or lng is None:
+            continue
+        for terminal_id, distance in index.within(float(lat), float(lng), radius_km):
+            if terminal_id != linked_terminal_id:
+                yield stop_id, terminal_id, distance
+
+
+def rebuild_transfers(radius_m=None):
+    """
+    Replace every TransferEdge with a fresh batch computation.
+
+    Returns:
+        Number of transfer edges written
+    """
+    from api.models import Terminal, RouteStop, TransferEdge
+
+    radius_m = radius_m or walk_radius_m()
+    terminals = Terminal.objects.values_list('id', 'latitude', 'longitude')
+    stops = RouteStop.objects.filter(latitude__isnull=False, longitude__isnull=False).values_list(
+        'id', 'terminal_id', 'latitude', 'longitude'
+    )
+
+    batch = []
+    total = 0
+    with transaction.atomic():
+        TransferEdge.objects.all().delete()
+        for stop_id, terminal_id, distance in find_pairs(stops.iterator(), terminals, radius_m):
+            batch.append(_edge(stop_id, terminal_id, distance))
+            if len(batch) >= BATCH_SIZE:
+                TransferEdge.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        TransferEdge.objects.bulk_create(batch)
+        total += len(batch)
+
+    logger.info(f"Rebuilt {total} walking transfers within {radius_m} m")
+    return total
+
+
+def refresh_terminal_transfers(terminal, radius_m=None):
+    """Recompute the transfer edges of a single terminal"""
+    from api.models import RouteStop, TransferEdge
+
+    radius_m = radius_m or walk_radius_m()
+    lat, lng = float(terminal.latitude), float(terminal.longitude)
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_m / 1000)
+    candidates = RouteStop.objects.filter(
+        latitude__range=(min_lat, max_lat),
+        longitude__range=(min_lng, max_lng),
+    ).exclude(terminal_id=terminal.id).values_list('id', 'latitude', 'longitude')
+
+    edges = []
+    for stop_id, stop_lat, stop_lng in candidates:
+        distance = haversine_km(lat, lng, float(stop_lat), float(stop_lng))
+        if distance * 1000 <= radius_m:
+            edges.append(_edge(stop_id, terminal.id, distance))
+
+    with transaction.atomic():
+        TransferEdge.objects.filter(terminal_id=terminal.id).delete()
+        TransferEdge.objects.bulk_create(edges)
+    return len(edges)
+
+
+def refresh_stop_transfers(stop, radius_m=None):
+    """Recompute the transfer edges of a single route stop"""
+    from api.models import Terminal, TransferEdge
+
+    if stop.latitude is None or stop.longitude is None:
+        TransferEdge.objects.filter(stop_id=stop.id).delete()
+        return 0
+
+    radius_m = radius_m or walk_radius_m()
+    lat, lng = float(stop.latitude), float(stop.longitude)
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_m / 1000)
+    candidates = Terminal.objects.filter(
+        latitude__range=(min_lat, max_lat),
+        longitude__range=(min_lng, max_lng),
+    ).values_list('id', 'latitude', 'longitude')
+
+    edges = []
+    for terminal_id, terminal_lat, terminal_lng in candidates:
+        if terminal_id == stop.terminal_id:
+            continue
+        distance = haversine_km(lat, lng, float(terminal_lat), float(terminal_lng))
+        if distance * 1000 <= radius_m:
+            edges.append(_edge(stop.id, terminal_id, distance))
+
+    with transaction.atomic():
+        TransferEdge.objects.filter(stop_id=stop.id).delete()
+        TransferEdge.objects.bulk_create(edges)
+    return len(edges)
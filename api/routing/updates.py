@@ -0,0 +1,199 @@
+"""
+Incremental Graph Updates
+
+Keeps every worker's TransitGraph in step with admin verification without a full
+rebuild. Saves and deletes that change routing are logged as GraphChange rows, whose
+ids act as a graph revision shared by all gunicorn workers: get_graph() compares the
+newest id with the one its graph includes and replays the rows in between, so a change
+made through one worker is routable on every worker by their next request.
+
+Replaying re-reads only the affected terminals and routes, patches a clone of the graph
+(touching just their CSR slices) and swaps it in, so planner requests keep reading the
+previous graph until the patched one is ready.
+
+A patched graph has no contraction hierarchy, so the planner uses plain Dijkstra
+(logged as a warning) until the next export cache rebuild moves the data version and
+writes a new snapshot and hierarchy, which get_graph() then maps in place of the
+patched graph.
+"""
+
+import logging
+
+from .graph import route_rows, stop_rows, transfer_rows
+
+logger = logging.getLogger(__name__)
+
+# Fields whose stored values decide whether a save can change routing
+TRACKED_FIELDS = {
+    'Terminal': ('verified', 'name', 'latitude', 'longitude'),
+    'Route': ('verified', 'terminal_id', 'mode_id', 'destination_name', 'polyline'),
+    'RouteStop': ('route_id', 'terminal_id', 'stop_name', 'fare', 'time', 'order', 'latitude', 'longitude'),
+}
+
+
+def remember_stored(instance, update_fields=None):
+    """
+    Keep the stored values of an instance about to be saved as `instance._stored`, so
+    post_save handlers can skip saves that leave routing untouched. None for new rows.
+    """
+    fields = TRACKED_FIELDS[type(instance).__name__]
+    if update_fields is not None and not {name.removesuffix('_id') for name in fields} & {
+        name.removesuffix('_id') for name in update_fields
+    }:
+        # e.g. save(update_fields=['rating']): nothing routing reads is written
+        instance._stored = {name: getattr(instance, name) for name in fields}
+        return
+    instance._stored = type(instance).objects.filter(pk=instance.pk).values(*fields).first() if instance.pk else None
+
+
+def changed_fields(instance):
+    """Tracked fields whose value differs from the stored row (all of them for new rows)"""
+    fields = TRACKED_FIELDS[type(instance).__name__]
+    stored = getattr(instance, '_stored', None)
+    if stored is None:
+        return set(fields)
+    return {name for name in fields if stored[name] != getattr(instance, name)}
+
+
+def _log(kind, object_id):
+    from api.models import GraphChange
+
+    # Repeats (e.g. one per stop of a deleted route) cost nothing: a replay re-reads
+    # each terminal and route once
+    return GraphChange.objects.create(kind=kind, object_id=object_id)
+
+
+def record_change(instance, deleted=False):
+    """
+    Log a saved or deleted Terminal, Route or RouteStop if it can change routing.
+
+    Returns:
+        The GraphChange, or None when routing is unaffected
+    """
+    from api.models import Terminal, Route, RouteStop
+
+    stored = getattr(instance, '_stored', None)
+    if isinstance(instance, (Terminal, Route)):
+        kind = 'terminal' if isinstance(instance, Terminal) else 'route'
+        # A deleted instance was loaded from its row, so its own values are the stored ones
+        was_active = instance.verified if deleted else bool(stored and stored['verified'])
+        active = instance.verified and not deleted
+        if not was_active and not active:
+            return None
+        if was_active and active and not changed_fields(instance):
+            # e.g. a rating change
+            return None
+        return _log(kind, instance.id)
+
+    if isinstance(instance, RouteStop):
+        if not deleted and not changed_fields(instance):
+            return None
+        route_ids = {instance.route_id, stored['route_id'] if stored else instance.route_id}
+        change = None
+        for route_id in Route.objects.filter(id__in=route_ids, verified=True).values_list('id', flat=True):
+            change = _log('route', route_id) or change
+        return change
+    return None
+
+
+def _load_routes(route_ids):
+    """(route_row, stop_rows) pairs plus transfer rows for verified routes among `route_ids`"""
+    stops_by_route = {}
+    for row in stop_rows(route_id__in=route_ids):
+        stops_by_route.setdefault(row[1], []).append(row)
+    added = [(row, stops_by_route.get(row[0], [])) for row in route_rows(id__in=route_ids)]
+    transfers = list(transfer_rows(stop__route_id__in=route_ids))
+    return added, transfers
+
+
+def _terminal_changes(graph, terminal_ids):
+    """(terminal_id, row or None to drop) for terminals whose node must change"""
+    from api.models import Terminal
+
+    rows = {
+        row[0]: row for row in Terminal.objects.filter(id__in=terminal_ids, verified=True)
+        .values_list('id', 'name', 'latitude', 'longitude')
+    }
+    changes = []
+    for terminal_id in terminal_ids:
+        node = graph.terminal_node.get(terminal_id)
+        row = rows.get(terminal_id)
+        if node is None and row is None:
+            continue
+        if node is not None and row is not None and (
+            graph.node_lat[node] == float(row[2])
+            and graph.node_lng[node] == float(row[3])
+            and graph.node_name[node] == (row[1] or f"Terminal {terminal_id}")
+        ):
+            continue
+        changes.append((terminal_id, row))
+    return changes
+
+
+def apply_changes(graph, changes):
+    """
+    Patch `graph` for GraphChange (id, kind, object_id) rows.
+
+    Returns:
+        A patched clone, or `graph` itself when none of the changes affect it; either
+        way its change_id is the last row's id
+    """
+    from django.db.models import Q
+    from api.models import Route
+
+    last_id = changes[-1][0]
+    terminals = _terminal_changes(graph, sorted({oid for _, kind, oid in changes if kind == 'terminal'}))
+    route_ids = {oid for _, kind, oid in changes if kind == 'route'}
+    route_ids = {route_id for route_id in route_ids if route_id in graph.route_index} | set(
+        Route.objects.filter(id__in=route_ids, verified=True).values_list('id', flat=True)
+    )
+    if terminals:
+        terminal_ids = [terminal_id for terminal_id, _ in terminals]
+        route_ids |= set(Route.objects.filter(
+            Q(terminal_id__in=terminal_ids) | Q(stops__terminal_id__in=terminal_ids)
+        ).values_list('id', flat=True))
+
+    if not terminals and not route_ids:
+        graph.change_id = last_id
+        return graph
+
+    route_ids = sorted(route_ids)
+    added, transfers = _load_routes(route_ids)
+    active = [terminal_id for terminal_id, row in terminals if row is not None]
+    if active:
+        transfers += list(transfer_rows(terminal_id__in=active))
+
+    patched = graph.clone()
+    detached = []
+    for terminal_id, row in terminals:
+        if row is None:
+            detached.append(patched.drop_terminal(terminal_id))
+            continue
+        node = patched.terminal_node.get(terminal_id)
+        if node is not None and (patched.node_lat[node], patched.node_lng[node]) != (float(row[2]), float(row[3])):
+            # A moved terminal's walks are all re-read from transfer_rows, at the new distances
+            detached.append(node)
+        patched.upsert_terminal(terminal_id, row[1], float(row[2]), float(row[3]))
+    patched.patch_routes(removed=route_ids, added=added, transfers=transfers, detached=detached)
+    patched.change_id = last_id
+    if graph.hierarchy is not None:
+        logger.warning(
+            f"Routing graph patched to change #{last_id}: contraction hierarchy dropped, "
+            "planning with plain Dijkstra until the next export cache rebuild"
+        )
+    logger.info(
+        f"Routing graph patched to change #{last_id}: {len(terminals)} terminals, {len(route_ids)} routes"
+    )
+    return patched
+
+
+def catch_up(graph):
+    """`graph` with every GraphChange newer than its change_id applied"""
+    from api.models import GraphChange
+
+    changes = list(
+        GraphChange.objects.filter(id__gt=graph.change_id).order_by('id').values_list('id', 'kind', 'object_id')
+    )
+    if not changes:
+        return graph
+    return apply_changes(graph, changes)
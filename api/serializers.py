@@ -1,7 +1,9 @@
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import Region, City, Terminal, ModeOfTransport, Route, RouteStop
+from .utils.polyline import decode_polyline
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -73,6 +75,9 @@ class UserProfileSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Email already in use")
         return value
 
+# Route geometry as stored ([lat, lng] pairs), as a Google encoded polyline, or omitted
+POLYLINE_FORMATS = ('raw', 'encoded', 'none')
+
 class RouteStopSerializer(serializers.ModelSerializer):
     class Meta:
         model = RouteStop
@@ -89,6 +94,11 @@ class ModeOfTransportSerializer(serializers.ModelSerializer):
         fields = ['id', 'mode_name', 'mode_display', 'fare_type']
 
 class RouteSerializer(serializers.ModelSerializer):
+    """
+    Route with its stops. The `polyline` context entry ('raw', 'encoded' or 'none')
+    picks how the route geometry is emitted (see POLYLINE_FORMATS), and `simplify`
+    optionally names a precomputed simplified variant (see api.utils.simplify).
+    """
     mode = ModeOfTransportSerializer(read_only=True)
     stops = RouteStopSerializer(many=True, read_only=True)
     
@@ -99,6 +109,34 @@ class RouteSerializer(serializers.ModelSerializer):
             'polyline', 'stops', 'added_by'
         ]
 
+    @staticmethod
+    def setup_eager_loading(routes):
+        """Load everything the serializer reads with two queries (routes with modes, stops)"""
+        return routes.select_related('mode').prefetch_related('stops')
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        return represent_polyline(
+            data, instance.encoded_polyline, instance.polyline_precision, instance.polyline_variants, self.context
+        )
+
+def represent_polyline(data, encoded_polyline, polyline_precision, polyline_variants, context):
+    """Apply the `polyline` and `simplify` context entries to a serialized route dict"""
+    polyline_format = context.get('polyline', 'raw')
+    if polyline_format == 'none':
+        data.pop('polyline', None)
+        return data
+
+    variant = context.get('simplify')
+    # Lines too short to simplify have no variant and are served in full
+    simplified = polyline_variants.get(variant) if variant else None
+    if polyline_format == 'encoded':
+        data['polyline'] = simplified or encoded_polyline or None
+        data['polyline_precision'] = polyline_precision
+    elif simplified:
+        data['polyline'] = decode_polyline(simplified, polyline_precision)
+    return data
+
 class BasicCitySerializer(serializers.ModelSerializer):
     class Meta:
         model = City
@@ -114,11 +152,53 @@ class TerminalSerializer(serializers.ModelSerializer):
             'id', 'name', 'description', 'latitude', 'longitude',
             'city', 'verified', 'rating', 'routes', 'added_by'
         ]
+
+    @staticmethod
+    def setup_eager_loading(terminals):
+        """
+        Load everything the serializer reads with three queries (terminals with cities,
+        verified origin routes with modes, stops), however many terminals there are.
+        """
+        return terminals.select_related('city').prefetch_related(
+            Prefetch(
+                'origin_routes',
+                queryset=RouteSerializer.setup_eager_loading(Route.objects.filter(verified=True)),
+                to_attr='verified_routes',
+            )
+        )
     
     def get_routes(self, obj):
-        routes = obj.origin_routes.filter(verified=True)
-        return RouteSerializer(routes, many=True).data
+        # Prefetched by setup_eager_loading; querying here would cost one query per terminal
+        routes = getattr(obj, 'verified_routes', None)
+        if routes is None:
+            routes = RouteSerializer.setup_eager_loading(obj.origin_routes.filter(verified=True))
+        return RouteSerializer(routes, many=True, context=self.context).data
     
+class TerminalPinSerializer(serializers.ModelSerializer):
+    """Compact map pin: coordinates plus the modes of the terminal's verified routes"""
+    modes = serializers.SerializerMethodField()
+
+    # Columns a pin needs; load terminals with `.only(*PIN_FIELDS)`
+    PIN_FIELDS = ('id', 'name', 'latitude', 'longitude')
+
+    class Meta:
+        model = Terminal
+        fields = ['id', 'name', 'latitude', 'longitude', 'modes']
+
+    @staticmethod
+    def modes_for(terminal_ids):
+        """Terminal id -> sorted mode names, from a single query over verified routes"""
+        modes = {}
+        rows = Route.objects.filter(terminal_id__in=terminal_ids, verified=True).values_list(
+            'terminal_id', 'mode__mode_name'
+        ).distinct()
+        for terminal_id, mode_name in rows:
+            modes.setdefault(terminal_id, []).append(mode_name)
+        return {terminal_id: sorted(names) for terminal_id, names in modes.items()}
+
+    def get_modes(self, obj):
+        return self.context.get('modes', {}).get(obj.id, [])
+
 class CitySerializer(serializers.ModelSerializer):
     terminals = TerminalSerializer(many=True, read_only=True)
     
@@ -126,19 +206,32 @@ class CitySerializer(serializers.ModelSerializer):
         model = City
         fields = ['id', 'name', 'region', 'terminals']
 
+    @staticmethod
+    def setup_eager_loading(cities):
+        return cities.prefetch_related(
+            Prefetch('terminals', queryset=TerminalSerializer.setup_eager_loading(Terminal.objects.all()))
+        )
+
 class RegionSerializer(serializers.ModelSerializer):
     cities = serializers.SerializerMethodField()
     
     class Meta:
         model = Region
         fields = ['id', 'name', 'cities']
+
+    @staticmethod
+    def setup_eager_loading(regions):
+        """
+        Load the whole region -> city -> terminal -> route -> stop tree with a fixed
+        number of queries (one per level), however large the tree is.
+        """
+        return regions.prefetch_related(
+            Prefetch('city_set', queryset=CitySerializer.setup_eager_loading(City.objects.all()))
+        )
     
     def get_cities(self, obj):
-        cities = obj.city_set.prefetch_related(
-            'terminals__origin_routes__mode',
-            'terminals__origin_routes__stops'
-        )
-        return CitySerializer(cities, many=True).data
+        # Uses the city_set prefetched by setup_eager_loading when present
+        return CitySerializer(obj.city_set.all(), many=True, context=self.context).data
     
 # User Contribution
 class TerminalContributionSerializer(serializers.ModelSerializer):
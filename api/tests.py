@@ -1,3 +1,1886 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import math
+import os
+import random
+import struct
+import tempfile
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import brotli
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.db import connection
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import Region, City, Terminal, ModeOfTransport, Route, RouteStop, CachedExport, TransferEdge, GraphChange
+from .serializers import RegionSerializer, TerminalSerializer, RouteSerializer
+from .exports.records import CachedExportBuild, region_records, terminal_records, route_records
+from . import views
+from .exports import compression, geojson
+from .management.commands import update_export_cache
+from .management.commands.update_export_cache import ExportReader
+from .maps import clusters, mvt, tiles
+from .maps.projection import project, tile_bounds
+from .routing import cache, corridors, graph as graph_module, raptor, snapping, transfers
+from .routing.contraction import ContractionHierarchy
+from .routing.storage import RoutingIndexError
+from .routing.graph import MS_PER_MINUTE, TransitGraph
+from .routing.synthetic import generate_network
+from .utils.geo import geohash_encode, geohash_radius_cover, haversine_km
+from .utils import simplify
+from .utils.polyline import decode_polyline, encode_polyline
+
+
+def build_network(regions=1, cities=1, terminals=1, routes=1, stops=1):
+    """Verified network of `regions` x `cities` x `terminals` x `routes` x `stops`, plus one unverified route"""
+    jeepney = ModeOfTransport.objects.create(mode_name='jeepney', fare_type='distance_based')
+    bus = ModeOfTransport.objects.create(mode_name='bus', fare_type='fixed')
+    terminal = None
+    for r in range(regions):
+        region = Region.objects.create(name=f'Region {r}')
+        for c in range(cities):
+            city = City.objects.create(name=f'City {r}-{c}', region=region)
+            for t in range(terminals):
+                lat, lng = Decimal(14 + r + c / 10), Decimal(121 + t / 100)
+                terminal = Terminal.objects.create(
+                    name=f'Terminal {r}-{c}-{t}', latitude=lat, longitude=lng, city=city, verified=True
+                )
+                for k in range(routes):
+                    route = Route.objects.create(
+                        terminal=terminal, destination_name=f'Destination {k}', mode=(jeepney, bus)[k % 2],
+                        verified=True, polyline=[[float(lat), float(lng)], [float(lat) + 0.01, float(lng) + 0.01]],
+                    )
+                    RouteStop.objects.bulk_create([
+                        RouteStop(
+                            route=route, stop_name=f'Stop {s}', fare=Decimal(13 + s), time=5 * (s + 1), order=s + 1,
+                            latitude=lat + Decimal('0.001') * (s + 1), longitude=lng,
+                        )
+                        for s in range(stops)
+                    ])
+    Route.objects.create(terminal=terminal, destination_name='Pending', mode=jeepney, verified=False)
+
+
+class ExportQueryCountTests(TestCase):
+    """Export and terminal endpoints run a fixed number of queries, whatever the data size"""
+
+    def assert_constant_queries(self, expected, url=None, serialize=None):
+        for size in (1, 3):
+            with self.subTest(size=size):
+                Region.objects.all().delete()
+                ModeOfTransport.objects.all().delete()
+                build_network(regions=size, cities=size, terminals=size, routes=size, stops=size)
+                if serialize is not None:
+                    with self.assertNumQueries(expected):
+                        data = serialize()
+                else:
+                    path = url() if callable(url) else url
+                    with self.assertNumQueries(expected):
+                        response = self.client.get(path)
+                    self.assertEqual(response.status_code, 200)
+                    data = response.json()
+                self.assertTrue(data)
+
+    def test_complete_export(self):
+        # regions, cities, terminals, routes, stops, modes + last updated and two totals
+        self.assert_constant_queries(9, reverse('complete-data-export'))
+
+    def test_export_regions_cities(self):
+        self.assert_constant_queries(6, reverse('export-regions-cities'))
+
+    def test_export_terminals(self):
+        # terminals, routes, stops, modes + last updated
+        self.assert_constant_queries(5, reverse('export-terminals'))
+
+    def test_export_routes_stops(self):
+        self.assert_constant_queries(3, reverse('export-routes-stops'))
+
+    def test_terminals_by_region(self):
+        self.assert_constant_queries(3, lambda: reverse('terminals-by-region', args=[Region.objects.first().id]))
+
+    def test_terminal_pins(self):
+        # terminals, then the mode badges of all of them
+        self.assert_constant_queries(2, lambda: reverse('terminals-by-region', args=[Region.objects.first().id]) + '?view=pins')
+        self.assert_constant_queries(2, lambda: reverse('terminals-by-city', args=[City.objects.first().id]) + '?view=pins')
+
+    def test_export_serializers(self):
+        self.assert_constant_queries(5, serialize=lambda: RegionSerializer(
+            RegionSerializer.setup_eager_loading(Region.objects.all()), many=True
+        ).data)
+        self.assert_constant_queries(3, serialize=lambda: TerminalSerializer(
+            TerminalSerializer.setup_eager_loading(Terminal.objects.filter(verified=True)), many=True
+        ).data)
+        self.assert_constant_queries(2, serialize=lambda: RouteSerializer(
+            RouteSerializer.setup_eager_loading(Route.objects.filter(verified=True)), many=True
+        ).data)
+
+    def test_unverified_routes_are_not_embedded(self):
+        build_network(routes=2)
+        terminals = TerminalSerializer(
+            TerminalSerializer.setup_eager_loading(Terminal.objects.all()), many=True
+        ).data
+        route_ids = [route['id'] for terminal in terminals for route in terminal['routes']]
+        self.assertEqual(sorted(route_ids), list(Route.objects.filter(verified=True).values_list('id', flat=True)))
+
+
+class ExportRecordsParityTests(TestCase):
+    """The fast export builders return exactly what the DRF serializers return"""
+
+    CONTEXTS = (
+        {},
+        {'polyline': 'encoded'},
+        {'polyline': 'none'},
+        {'polyline': 'none', 'simplify': '10'},
+        {'polyline': 'raw', 'simplify': '8'},
+        {'polyline': 'encoded', 'simplify': '14'},
+    )
+
+    def setUp(self):
+        build_network(regions=2, cities=2, terminals=2, routes=2, stops=3)
+        # Values DRF has to quantize or leave empty
+        RouteStop.objects.filter(order=1).update(distance=Decimal('1.5'), latitude=None, longitude=None)
+        Terminal.objects.filter(id=Terminal.objects.first().id).update(verified=False, description='Closed', rating=-2)
+        route = Route.objects.filter(verified=True).first()
+        route.polyline = [[14.0 + i / 1000, 121.0 + (i % 7) / 100] for i in range(50)]
+        route.save()
+
+    def assert_same(self, records, serializer):
+        # Compare as JSON so Decimal/str and dict/OrderedDict differences would show up
+        self.assertEqual(json.dumps(records), json.dumps(serializer.data))
+
+    def test_regions(self):
+        for context in self.CONTEXTS:
+            with self.subTest(context=context):
+                regions = RegionSerializer.setup_eager_loading(Region.objects.all())
+                self.assert_same(region_records(Region.objects.all(), context), RegionSerializer(regions, many=True, context=context))
+
+    def test_terminals(self):
+        for context in self.CONTEXTS:
+            with self.subTest(context=context):
+                terminals = TerminalSerializer.setup_eager_loading(Terminal.objects.all())
+                self.assert_same(terminal_records(Terminal.objects.all(), context), TerminalSerializer(terminals, many=True, context=context))
+
+    def test_routes(self):
+        for context in self.CONTEXTS:
+            with self.subTest(context=context):
+                routes = RouteSerializer.setup_eager_loading(Route.objects.all())
+                self.assert_same(route_records(Route.objects.all(), context), RouteSerializer(routes, many=True, context=context))
+
+
+class CachedExportBuildTests(TestCase):
+    """update_export_cache streams the same payloads as the export builders in bounded memory"""
+
+    def build(self, context=None):
+        # Tiny chunks and spools so the test walks many chunks and spills to disk
+        build = CachedExportBuild(context, chunk_size=3, spool_size=512, read_size=100).build()
+        self.addCleanup(build.close)
+        payloads = {}
+        for export_type, chunks, size, count in build.payloads('now'):
+            text = ''.join(chunks)
+            self.assertEqual(len(text), size)
+            payloads[export_type] = (json.loads(text), count)
+        return payloads
+
+    def test_payloads_match_records(self):
+        build_network(regions=2, cities=2, terminals=2, routes=2, stops=3)
+        Terminal.objects.filter(id=Terminal.objects.first().id).update(verified=False)
+        for context in ExportRecordsParityTests.CONTEXTS:
+            with self.subTest(context=context):
+                payloads = self.build(context)
+                regions = region_records(Region.objects.order_by('id'), context)
+                terminals = terminal_records(
+                    Terminal.objects.filter(verified=True).order_by('city__region_id', 'city_id', 'id'), context
+                )
+                routes = route_records(
+                    Route.objects.filter(verified=True)
+                    .order_by('terminal__city__region_id', 'terminal__city_id', 'terminal_id', 'id'),
+                    context,
+                )
+                self.assertEqual(payloads['complete'], ({
+                    'regions': regions,
+                    'last_updated': 'now',
+                    'total_terminals': len(terminals),
+                    'total_routes': len(routes),
+                    'export_timestamp': 'now',
+                }, 2))
+                self.assertEqual(payloads['regions'], ({'regions': regions, 'export_timestamp': 'now'}, 2))
+                self.assertEqual(payloads['terminals'], ({'terminals': terminals, 'export_timestamp': 'now'}, 7))
+                self.assertEqual(payloads['routes'], ({'routes': routes, 'export_timestamp': 'now'}, 16))
+
+    def add_terminals(self, city, mode, count, routes=2):
+        start = Terminal.objects.count()
+        terminals = Terminal.objects.bulk_create([
+            Terminal(name=f'Terminal {i}', latitude=14 + Decimal(i) / 10000, longitude=Decimal(121), city=city, verified=True)
+            for i in range(start, start + count)
+        ])
+        routes = Route.objects.bulk_create([
+            Route(terminal=terminal, destination_name=f'Destination {k}', mode=mode, verified=True,
+                  polyline=[[14.5 + i / 1000, 121.0] for i in range(20)])
+            for terminal in terminals for k in range(routes)
+        ])
+        RouteStop.objects.bulk_create([
+            RouteStop(route=route, stop_name=f'Stop {s}', fare=Decimal(13), time=5, order=s,
+                      latitude=Decimal('14.5'), longitude=Decimal('121.0'))
+            for route in routes for s in range(10)
+        ])
+
+    def peak_memory(self):
+        """Peak traced memory of a full update_export_cache run and the size of the complete export"""
+        with tempfile.TemporaryDirectory() as data_dir, override_settings(ROUTING_DATA_DIR=data_dir), \
+                mock.patch.multiple(CachedExportBuild, chunk_size=100, spool_size=64 * 1024, read_size=64 * 1024), \
+                mock.patch.object(update_export_cache.Command, 'write_routing_index', return_value=''):
+            # The routing graph holds the whole network by design, as every worker does
+            tracemalloc.start()
+            try:
+                call_command('update_export_cache', stdout=io.StringIO())
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        return peak, CachedExport.objects.get(export_type='complete').file_size_kb
+
+    @skipUnless(connection.vendor == 'postgresql', "only the COPY write keeps exports out of memory")
+    def test_peak_memory_is_flat(self):
+        mode = ModeOfTransport.objects.create(mode_name='jeepney', fare_type='fixed')
+        city = City.objects.create(name='City', region=Region.objects.create(name='Region'))
+        self.add_terminals(city, mode, 200)
+        small_peak, small_size = self.peak_memory()
+        # 4x the routes and stops; terminals only double, since the cluster index the
+        # command also builds holds every verified terminal by design
+        self.add_terminals(city, mode, 200, routes=6)
+        large_peak, large_size = self.peak_memory()
+
+        self.assertGreater(large_size, 3.5 * small_size)
+        self.assertLess(large_peak, 1.25 * small_peak)
+
+
+class ExportReaderTests(TestCase):
+    """The COPY source hands back the export text, escaped, in any read sizes"""
+
+    CHUNKS = ['{"name": "a\\\\b', '\tc"', ', "n": 1}']
+
+    def test_reads(self):
+        text = ''.join(self.CHUNKS)
+        for size in (1, 3, 7, 1000):
+            compressor = compression.ExportCompressor()
+            reader = ExportReader(self.CHUNKS, compressor)
+            pieces = iter(lambda: reader.read(size), '')
+            self.assertEqual(''.join(pieces), text)
+            self.assertEqual(gzip.decompress(compressor.finish()['data_gzip']).decode(), text)
+        self.assertEqual(ExportReader(self.CHUNKS, compression.ExportCompressor()).read(), text)
+
+    def test_copy_escapes(self):
+        reader = ExportReader(self.CHUNKS, compression.ExportCompressor(), escape=True)
+        self.assertEqual(reader.read(4) + reader.read(), '{"name": "a\\\\\\\\b\\tc", "n": 1}')
+
+
+class CachedExportEncodingTests(TestCase):
+    """The cached views serve the stored compressed bodies by Accept-Encoding"""
+
+    DATA = {'regions': [{'id': 1, 'name': 'Laguna', 'cities': []}], 'export_timestamp': 'now'}
+
+    def setUp(self):
+        CachedExport.objects.create(
+            export_type='complete', data=self.DATA, data_version='v1',
+            **compression.compress_export(json.dumps(self.DATA)),
+        )
+        self.url = reverse('cached-complete')
+
+    def test_accepted_encodings(self):
+        self.assertEqual(compression.accepted_encodings('gzip, deflate, br'), ['br', 'gzip'])
+        self.assertEqual(compression.accepted_encodings('br;q=0.5, gzip'), ['gzip', 'br'])
+        self.assertEqual(compression.accepted_encodings('gzip;q=0, *'), ['br'])
+        self.assertEqual(compression.accepted_encodings('identity'), [])
+        self.assertEqual(compression.accepted_encodings(None), [])
+
+    def test_gzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.DATA)
+
+    def test_brotli(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(brotli.decompress(response.content)), self.DATA)
+
+    def test_missing_encoding_falls_back(self):
+        # As stored by a build without the brotli package
+        CachedExport.objects.update(data_br=None)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.json(), self.DATA)
+
+    def test_identity(self):
+        for headers in ({}, {'HTTP_ACCEPT_ENCODING': 'identity'}, {'HTTP_ACCEPT_ENCODING': 'gzip', 'HTTP_ACCEPT': 'text/html'}):
+            with self.subTest(headers=headers):
+                response = self.client.get(self.url, **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_not_initialized(self):
+        response = self.client.get(reverse('cached-routes'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 503)
+
+
+class WalkingTransferTests(TestCase):
+    """Transfer edges link stops to the terminals within walking radius, and saves only recompute them when needed"""
+
+    def setUp(self):
+        mode = ModeOfTransport.objects.create(mode_name='jeepney', fare_type='fixed')
+        city = City.objects.create(name='City', region=Region.objects.create(name='Region'))
+        self.terminals = [
+            Terminal.objects.create(
+                name=f'Terminal {i}', latitude=Decimal('14.5') + Decimal('0.0015') * i ** 2,
+                longitude=Decimal('121.0'), city=city, verified=True,
+            )
+            for i in range(4)
+        ]
+        route = Route.objects.create(terminal=self.terminals[0], destination_name='Somewhere', mode=mode, verified=True)
+        self.stops = [
+            RouteStop.objects.create(
+                route=route, stop_name=f'Stop {s}', fare=Decimal(13), time=5, order=s + 1,
+                terminal=self.terminals[s] if s < 2 else None,
+                latitude=Decimal('14.5') + Decimal('0.002') * s, longitude=Decimal('121.0005'),
+            )
+            for s in range(4)
+        ]
+
+    def pairs(self):
+        return {
+            (stop_id, terminal_id): distance_m
+            for stop_id, terminal_id, distance_m in TransferEdge.objects.values_list('stop_id', 'terminal_id', 'distance_m')
+        }
+
+    def expected_pairs(self):
+        """Brute force over every stop and terminal"""
+        expected = {}
+        for stop in RouteStop.objects.all():
+            for terminal in Terminal.objects.all():
+                distance = haversine_km(
+                    float(stop.latitude), float(stop.longitude), float(terminal.latitude), float(terminal.longitude)
+                )
+                if terminal.id != stop.terminal_id and distance * 1000 <= transfers.walk_radius_m():
+                    expected[stop.id, terminal.id] = int(round(distance * 1000))
+        return expected
+
+    def test_rebuild_matches_brute_force(self):
+        self.assertEqual(transfers.rebuild_transfers(), len(self.expected_pairs()))
+        self.assertEqual(self.pairs(), self.expected_pairs())
+        # Stop 0 is linked to Terminal 0, so walking there is no transfer
+        self.assertNotIn((self.stops[0].id, self.terminals[0].id), self.pairs())
+        edge = TransferEdge.objects.first()
+        self.assertEqual(edge.walk_time_ms, transfers.walk_time_ms(edge.distance_m))
+
+    def test_saves_keep_pairs_current(self):
+        # Built one save at a time by the signals
+        self.assertEqual(self.pairs(), self.expected_pairs())
+        terminal = self.terminals[3]
+        terminal.latitude = Decimal('14.5045')
+        terminal.save()
+        stop = self.stops[3]
+        stop.latitude = Decimal('14.51')
+        stop.save()
+        self.assertEqual(self.pairs(), self.expected_pairs())
+
+    def test_saves_that_cannot_move_pairs_are_skipped(self):
+        terminal, stop = self.terminals[1], self.stops[2]
+        with mock.patch('api.routing.transfers.refresh_terminal_transfers') as refresh_terminal, \
+                mock.patch('api.routing.transfers.refresh_stop_transfers') as refresh_stop:
+            terminal.rating = 4
+            terminal.save()
+            Terminal.objects.get(id=terminal.id).save(update_fields=['description'])
+            stop.fare = Decimal(20)
+            stop.save()
+            terminal.verified = False
+            terminal.latitude = Decimal('14.6')
+            terminal.save()
+            refresh_terminal.assert_not_called()
+            refresh_stop.assert_not_called()
+
+            terminal.verified = True
+            terminal.save()
+            refresh_terminal.assert_called_once_with(terminal)
+            stop.longitude = Decimal('121.001')
+            stop.save()
+            refresh_stop.assert_called_once_with(stop)
+
+    def test_refresh_errors_do_not_break_saves(self):
+        terminal = self.terminals[1]
+        terminal.latitude = Decimal('14.49')
+        with mock.patch('api.routing.transfers.refresh_terminal_transfers', side_effect=RuntimeError('boom')), \
+                self.assertLogs('api.models', 'ERROR'):
+            terminal.save()
+        self.assertEqual(Terminal.objects.get(id=terminal.id).latitude, Decimal('14.49'))
+
+
+class TerminalListTests(TestCase):
+    """The city and region terminal lists return only their verified terminals, in full or as pins"""
+
+    def setUp(self):
+        build_network(regions=2, cities=2, terminals=2, routes=2)
+        self.city = City.objects.first()
+        self.hidden = Terminal.objects.filter(city=self.city).last()
+        self.hidden.verified = False
+        self.hidden.save()
+
+    def test_city(self):
+        url = reverse('terminals-by-city', args=[self.city.id])
+        expected = list(Terminal.objects.filter(city=self.city, verified=True).values_list('id', flat=True))
+        full = self.client.get(url).json()
+        self.assertEqual([terminal['id'] for terminal in full], expected)
+        self.assertEqual(len(full[0]['routes']), 2)
+        pins = self.client.get(url, {'view': 'pins'}).json()
+        self.assertEqual(pins, [
+            {'id': terminal.id, 'name': terminal.name, 'latitude': str(terminal.latitude),
+             'longitude': str(terminal.longitude), 'modes': ['bus', 'jeepney']}
+            for terminal in Terminal.objects.filter(id__in=expected)
+        ])
+
+    def test_region(self):
+        region = self.city.region
+        expected = sorted(Terminal.objects.filter(city__region=region, verified=True).values_list('id', flat=True))
+        for params in ({}, {'view': 'pins'}):
+            with self.subTest(params=params):
+                data = self.client.get(reverse('terminals-by-region', args=[region.id]), params).json()
+                self.assertEqual(sorted(terminal['id'] for terminal in data), expected)
+
+
+class TerminalIndexTests(TestCase):
+    """The NumPy terminal index answers exactly like a brute-force scan, and stays current"""
+
+    def setUp(self):
+        rng = random.Random(12)
+        jeepney = ModeOfTransport.objects.create(mode_name='jeepney', fare_type='distance_based')
+        bus = ModeOfTransport.objects.create(mode_name='bus', fare_type='fixed')
+        city = City.objects.create(name='City', region=Region.objects.create(name='Region'))
+        terminals = Terminal.objects.bulk_create([
+            Terminal(
+                name=f'Terminal {i}', city=city, verified=i % 10 != 0,
+                latitude=Decimal(f'{rng.uniform(14.0, 14.6):.6f}'), longitude=Decimal(f'{rng.uniform(120.8, 121.3):.6f}'),
+            )
+            for i in range(300)
+        ])
+        routes = Route.objects.bulk_create([
+            Route(terminal=terminal, destination_name='Somewhere', mode=(jeepney, bus)[i % 3 == 0], verified=i % 7 != 0)
+            for i, terminal in enumerate(terminals[::2])
+        ])
+        RouteStop.objects.bulk_create([
+            RouteStop(route=route, stop_name='Stop', fare=Decimal(13), order=1, terminal=rng.choice(terminals))
+            for route in routes
+        ])
+        self.points = [(rng.uniform(14.0, 14.6), rng.uniform(120.8, 121.3)) for _ in range(20)]
+        snapping.invalidate()
+        self.addCleanup(snapping.invalidate)
+
+    def brute_force(self, lat, lng, radius_km=None, k=None, mode=None):
+        terminals = Terminal.objects.filter(verified=True)
+        if mode:
+            terminals = terminals.filter(
+                Q(origin_routes__mode__mode_name=mode, origin_routes__verified=True)
+                | Q(route_stops__route__mode__mode_name=mode, route_stops__route__verified=True)
+            ).distinct()
+        hits = sorted(
+            (haversine_km(lat, lng, float(terminal.latitude), float(terminal.longitude)), terminal.id)
+            for terminal in terminals
+        )
+        hits = [(terminal_id, distance) for distance, terminal_id in hits if radius_km is None or distance <= radius_km]
+        return hits[:k] if k else hits
+
+    def assert_same_hits(self, hits, expected):
+        self.assertEqual([terminal_id for terminal_id, _ in hits], [terminal_id for terminal_id, _ in expected])
+        for (_, distance), (_, expected_distance) in zip(hits, expected):
+            self.assertAlmostEqual(distance, expected_distance, places=9)
+
+    def test_matches_brute_force(self):
+        index = snapping.get_index()
+        for lat, lng in self.points:
+            for radius_km, k, mode in ((5, None, None), (10, 4, None), (None, 7, None), (8, None, 'bus'), (None, 3, 'jeepney')):
+                with self.subTest(point=(lat, lng), radius_km=radius_km, k=k, mode=mode):
+                    self.assert_same_hits(
+                        index.nearest(lat, lng, k=k, radius_km=radius_km, mode=mode),
+                        self.brute_force(lat, lng, radius_km, k, mode),
+                    )
+
+    def test_route_changes_invalidate(self):
+        snapping.get_index()
+        route = Route.objects.filter(verified=True).first()
+        stop = route.stops.first()
+        stop.fare = Decimal(20)
+        stop.save()
+        route.polyline = [[14.0, 121.0], [14.1, 121.1]]
+        route.save()
+        Route.objects.get(id=route.id).save()
+        self.assertIsNotNone(snapping._index)
+
+        for change in (
+            lambda: setattr(route, 'mode', ModeOfTransport.objects.get(mode_name='bus')) or route.save(),
+            lambda: setattr(stop, 'terminal', None) or stop.save(),
+            lambda: stop.delete(),
+            lambda: setattr(route, 'verified', False) or route.save(),
+        ):
+            snapping.get_index()
+            change()
+            self.assertIsNone(snapping._index)
+
+        bus = ModeOfTransport.objects.get(mode_name='bus')
+        lat, lng = self.points[0]
+        Route.objects.create(terminal=Terminal.objects.get(id=self.brute_force(lat, lng, k=1)[0][0]), destination_name='New', mode=bus, verified=True)
+        self.assert_same_hits(snapping.get_index().nearest(lat, lng, k=5, mode='bus'), self.brute_force(lat, lng, k=5, mode='bus'))
+
+    def test_nearby_radius_is_capped(self):
+        url = reverse('nearby-terminals')
+        snapping.get_index()
+        self.assertEqual(self.client.get(url, {'lat': 14.3, 'lng': 121, 'radius': 201}).status_code, 400)
+        response = self.client.get(url, {'lat': 14.3, 'lng': 121, 'radius': 200, 'view': 'pins'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), Terminal.objects.filter(verified=True).count())
+
+
+def small_graph():
+    """
+    Terminals 1-4 and three ways from 1 to 4: a slow, dear direct bus; two cheap
+    jeepneys via 2; a fast tricycle and jeepney via 3.
+    """
+    terminals = [(i, f'T{i}', 14 + i / 100, 121) for i in range(1, 5)]
+    routes = [
+        (10, 1, 'T4', 'bus', 'fixed', None),
+        (11, 1, 'T2', 'jeepney', 'fixed', None),
+        (12, 2, 'T4', 'jeepney', 'fixed', None),
+        (13, 1, 'T3', 'tricycle', 'fixed', None),
+        (14, 3, 'T4', 'jeepney', 'fixed', None),
+    ]
+    stops = [
+        (100, 10, 4, 'T4', 100, 60, None, None),
+        (110, 11, 2, 'T2', 13, 10, None, None),
+        (120, 12, 4, 'T4', 13, 15, None, None),
+        (130, 13, 3, 'T3', 50, 5, None, None),
+        (140, 14, 4, 'T4', 20, 10, None, None),
+    ]
+    return TransitGraph.from_rows(terminals, routes, stops, data_version='v1')
+
+
+class RaptorTests(TestCase):
+    """The Pareto search returns every journey worth taking, tagged by what it is best at"""
+
+    def test_pareto_set(self):
+        result = raptor.pareto_journeys(small_graph(), 1, 4)
+        journeys = [
+            (j['total_time_ms'] // MS_PER_MINUTE, j['total_fare'], j['transfers'], [leg['route_id'] for leg in j['legs']], j['tags'])
+            for j in result['journeys']
+        ]
+        # The bus is beaten on time and fare, but is the only ride without a transfer
+        self.assertEqual(journeys, [
+            (15, 70.0, 1, [13, 14], ['fastest']),
+            (25, 26.0, 1, [11, 12], ['cheapest']),
+            (60, 100.0, 0, [10], ['fewest_transfers']),
+        ])
+        self.assertFalse(result['truncated'])
+
+    def test_max_transfers(self):
+        journeys = raptor.pareto_journeys(small_graph(), 1, 4, max_transfers=0)['journeys']
+        self.assertEqual([[leg['route_id'] for leg in j['legs']] for j in journeys], [[10]])
+
+    def test_full_bag_keeps_fewest_rides(self):
+        bag = []
+        direct = raptor.Label(1000, 1000, 1, None, 0, 0, 1, 0)
+        self.assertTrue(raptor._insert(bag, direct))
+        for i in range(raptor.MAX_BAG_SIZE):
+            raptor._insert(bag, raptor.Label(100 + i, 900 - i, 2, None, 0, 0, 1, 0))
+        self.assertEqual(len(bag), raptor.MAX_BAG_SIZE)
+        self.assertIn(direct, bag)
+        self.assertEqual(bag, sorted(bag, key=lambda l: (l.time, l.fare)))
+
+
+def planner_network():
+    """
+    Verified terminals A, B, C and D (unverified) in a line, with jeepneys A -> B
+    (10 min, P13) and B -> C (20 min, P15) and a slower, dearer bus A -> C (45 min, P30)
+    """
+    jeepney = ModeOfTransport.objects.create(mode_name='jeepney', fare_type='fixed')
+    bus = ModeOfTransport.objects.create(mode_name='bus', fare_type='fixed')
+    city = City.objects.create(name='City', region=Region.objects.create(name='Region'))
+    terminals = {
+        name: Terminal.objects.create(
+            name=name, latitude=Decimal('14.5') + Decimal('0.05') * i, longitude=Decimal('121.0'),
+            city=city, verified=name != 'D',
+        )
+        for i, name in enumerate('ABCD')
+    }
+
+    def add_route(origin, destination, mode, fare, minutes):
+        route = Route.objects.create(
+            terminal=terminals[origin], destination_name=destination, mode=mode, verified=True
+        )
+        RouteStop.objects.create(
+            route=route, stop_name=destination, terminal=terminals[destination], fare=Decimal(fare), time=minutes, order=1
+        )
+        return route
+
+    routes = {
+        'AB': add_route('A', 'B', jeepney, 13, 10),
+        'BC': add_route('B', 'C', jeepney, 15, 20),
+        'AC': add_route('A', 'C', bus, 30, 45),
+    }
+    return terminals, routes
+
+
+class FreshRoutingMixin:
+    """Every test starts without a loaded graph, snapping index, cached plans or cached tiles"""
+
+    def setUp(self):
+        super().setUp()
+        graph_module._graph = None
+        snapping.invalidate()
+        self.addCleanup(setattr, graph_module, '_graph', None)
+        self.addCleanup(snapping.invalidate)
+        plans = cache.PlanCache(64)
+        for patcher in (
+            mock.patch.object(cache, 'plan_cache', plans),
+            mock.patch('api.views.plan_cache', plans),
+            mock.patch.object(tiles, 'tile_cache', cache.PlanCache(64)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class JourneyPlannerTests(FreshRoutingMixin, TestCase):
+    """/plan/ returns the fastest journey over verified routes, leg by leg"""
+
+    def setUp(self):
+        super().setUp()
+        self.terminals, self.routes = planner_network()
+        self.url = reverse('plan-journey')
+
+    def test_fastest_journey(self):
+        a, b, c = (self.terminals[name] for name in 'ABC')
+        response = self.client.get(self.url, {'from': a.id, 'to': c.id})
+        self.assertEqual(response.status_code, 200)
+        journey = response.json()
+        # Two jeepneys (10 + 20 min, P13 + P15) beat the 45 min bus
+        self.assertEqual(journey['total_time_ms'], 30 * MS_PER_MINUTE)
+        self.assertEqual(journey['total_fare'], 28)
+        self.assertEqual(journey['transfers'], 1)
+        self.assertEqual(
+            [(leg['route_id'], leg['from']['terminal_id'], leg['to']['terminal_id'], leg['time_ms'], leg['fare'])
+             for leg in journey['legs']],
+            [(self.routes['AB'].id, a.id, b.id, 10 * MS_PER_MINUTE, 13), (self.routes['BC'].id, b.id, c.id, 20 * MS_PER_MINUTE, 15)],
+        )
+
+    def test_coordinates_snap_to_terminals(self):
+        response = self.client.get(self.url, {'from_lat': 14.501, 'from_lng': 121.0, 'to_lat': 14.549, 'to_lng': 121.001})
+        self.assertEqual(response.status_code, 200)
+        journey = response.json()
+        self.assertEqual(journey['origin']['terminal_id'], self.terminals['A'].id)
+        self.assertEqual(journey['destination']['terminal_id'], self.terminals['B'].id)
+        self.assertEqual(journey['total_time_ms'], 10 * MS_PER_MINUTE)
+
+    def test_errors(self):
+        a, c, d = (self.terminals[name] for name in 'ACD')
+        self.assertEqual(self.client.get(self.url, {'from': a.id}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'from': a.id, 'to': d.id}).status_code, 404)
+        # Nothing leaves C
+        self.assertEqual(self.client.get(self.url, {'from': c.id, 'to': a.id}).status_code, 404)
+
+
+def synthetic_graph(**kwargs):
+    terminals, routes, stops = generate_network(**{'cities': 6, 'terminals_per_city': 8, 'local_routes': 3, **kwargs})
+    return TransitGraph.from_rows(terminals, routes, stops, data_version='v1')
+
+
+class ContractionHierarchyTests(TestCase):
+    """Hierarchy queries find paths exactly as short as plain Dijkstra"""
+
+    def path_cost(self, graph, source, target, path):
+        if path is None:
+            return None
+        node = source
+        for e in path:
+            # Unpacked shortcuts must chain original edges end to end
+            self.assertEqual(graph.edge_source[e], node)
+            node = graph.edge_target[e]
+        self.assertEqual(node, target)
+        return sum(graph.edge_weight[e] for e in path)
+
+    def test_parity_with_dijkstra(self):
+        graph = synthetic_graph()
+        hierarchy = ContractionHierarchy.build(graph)
+        self.assertTrue(hierarchy.matches(graph))
+        nodes = sorted(graph.terminal_node.values())
+        unreachable = 0
+        for source in nodes:
+            for target in nodes:
+                expected = self.path_cost(graph, source, target, graph.shortest_path(source, target))
+                unreachable += expected is None
+                self.assertEqual(
+                    self.path_cost(graph, source, target, hierarchy.shortest_path(source, target)), expected,
+                    (source, target),
+                )
+        # Both reachable and unreachable pairs were compared
+        self.assertGreater(unreachable, 0)
+        self.assertLess(unreachable, len(nodes) ** 2 / 2)
+
+    def test_plan_uses_hierarchy(self):
+        graph = synthetic_graph()
+        terminal_ids = sorted(graph.terminal_node)[:12]
+        plain = {(a, b): graph.plan(a, b) for a in terminal_ids for b in terminal_ids}
+        graph.hierarchy = ContractionHierarchy.build(graph)
+        with mock.patch.object(TransitGraph, 'shortest_path', side_effect=AssertionError('Dijkstra was used')):
+            for (a, b), journey in plain.items():
+                planned = graph.plan(a, b)
+                self.assertEqual(planned and planned['total_time_ms'], journey and journey['total_time_ms'])
+
+
+class GraphPatchTests(FreshRoutingMixin, TestCase):
+    """Routing changes reach every worker's graph through the GraphChange log"""
+
+    def setUp(self):
+        super().setUp()
+        self.terminals, self.routes = planner_network()
+        self.a, self.c = self.terminals['A'], self.terminals['C']
+
+    def fastest(self):
+        journey = graph_module.get_graph().plan(self.a.id, self.c.id)
+        return journey and journey['total_time_ms'] // MS_PER_MINUTE
+
+    def assert_matches_fresh_build(self):
+        graph = graph_module.get_graph()
+        fresh = graph_module.build_graph(graph.data_version)
+        self.assertEqual(sorted(graph.terminal_node), sorted(fresh.terminal_node))
+        for a in fresh.terminal_node:
+            for b in fresh.terminal_node:
+                patched, built = graph.plan(a, b), fresh.plan(a, b)
+                self.assertEqual(patched and patched['total_time_ms'], built and built['total_time_ms'], (a, b))
+
+    def test_verify_edit_and_delete(self):
+        self.assertEqual(self.fastest(), 30)
+        first = graph_module.get_graph()
+        express = Route.objects.create(
+            terminal=self.a, destination_name='C', mode=ModeOfTransport.objects.get(mode_name='bus'), verified=False
+        )
+        stop = RouteStop.objects.create(route=express, stop_name='C', terminal=self.c, fare=Decimal(50), time=12, order=1)
+        self.assertEqual(self.fastest(), 30)
+        self.assertIs(graph_module.get_graph(), first)
+
+        express.verified = True
+        express.save()
+        self.assertEqual(self.fastest(), 12)
+        self.assertIsNot(graph_module.get_graph(), first)
+        stop.time = 40
+        stop.save()
+        self.assertEqual(self.fastest(), 30)
+        self.routes['BC'].delete()
+        self.assertEqual(self.fastest(), 40)
+        self.assert_matches_fresh_build()
+
+        self.c.verified = False
+        self.c.save()
+        self.assertNotIn(self.c.id, graph_module.get_graph().terminal_node)
+        self.assert_matches_fresh_build()
+
+    def walks(self, graph):
+        """{(from, to): walk_ms} keyed by terminal id or ('stop', stop id)"""
+        def key(node):
+            terminal_id = graph.node_terminal[node]
+            return terminal_id if terminal_id >= 0 else ('stop', graph.node_stop[node])
+
+        return {
+            (key(graph.edge_source[e]), key(graph.edge_target[e])): graph.edge_weight[e]
+            for e in range(graph.edge_count) if graph.edge_route[e] == graph_module.WALK
+        } if graph.edge_count else {}
+
+    def test_moved_terminal_walks(self):
+        local = Route.objects.create(
+            terminal=self.c, destination_name='Loop', mode=ModeOfTransport.objects.get(mode_name='jeepney'), verified=True
+        )
+        near_a, near_b = (
+            RouteStop.objects.create(
+                route=local, stop_name=name, fare=Decimal(13), time=minutes, order=order,
+                latitude=latitude, longitude=Decimal('121.002'),
+            )
+            for name, minutes, order, latitude in (('Near A', 5, 1, Decimal('14.501')), ('Near B', 10, 2, Decimal('14.549')))
+        )
+        call_command('build_transfers', stdout=io.StringIO())
+        before = self.walks(graph_module.get_graph())
+        self.assertIn((self.a.id, ('stop', near_a.id)), before)
+        self.assertNotIn((self.a.id, ('stop', near_b.id)), before)
+
+        # A moves next to the second stop, out of reach of the first
+        self.a.latitude, self.a.longitude = Decimal('14.5485'), Decimal('121.0015')
+        self.a.save()
+        graph = graph_module.get_graph()
+        self.assertGreater(graph.revision, 0)
+        walks = self.walks(graph)
+        self.assertEqual(walks, self.walks(graph_module.build_graph(graph.data_version)))
+        stored = dict(TransferEdge.objects.filter(terminal=self.a).values_list('stop_id', 'walk_time_ms'))
+        self.assertNotIn(near_a.id, stored)
+        self.assertNotIn((self.a.id, ('stop', near_a.id)), walks)
+        self.assertNotIn((('stop', near_a.id), self.a.id), walks)
+        self.assertEqual(walks[self.a.id, ('stop', near_b.id)], stored[near_b.id])
+        self.assertEqual(walks[('stop', near_b.id), self.a.id], stored[near_b.id])
+
+    def test_other_workers_catch_up(self):
+        stale = graph_module.get_graph()
+        self.routes['AB'].verified = False
+        self.routes['AB'].save()
+        # This process patches its graph once the change commits...
+        with self.captureOnCommitCallbacks(execute=True):
+            self.routes['BC'].delete()
+        patched = graph_module._graph
+        self.assertIsNot(patched, stale)
+        self.assertEqual(patched.change_id, GraphChange.latest_id())
+        # ...while a worker still holding the old graph replays the log on its next request
+        graph_module._graph = stale
+        self.assertEqual(self.fastest(), 45)
+        self.assertEqual(graph_module.get_graph().change_id, GraphChange.latest_id())
+
+    def test_saves_that_leave_routing_alone_are_not_logged(self):
+        graph_module.get_graph()
+        logged = GraphChange.objects.count()
+        self.a.rating = 5
+        self.a.save()
+        self.routes['AB'].save(update_fields=['updated_at'])
+        Route.objects.create(
+            terminal=self.a, destination_name='Pending', mode=ModeOfTransport.objects.get(mode_name='bus'), verified=False
+        ).delete()
+        self.assertEqual(GraphChange.objects.count(), logged)
+
+    def test_prune_keeps_latest(self):
+        for route in self.routes.values():
+            route.delete()
+        latest = GraphChange.latest_id()
+        GraphChange.prune(timezone.now() + timedelta(seconds=1))
+        self.assertEqual(list(GraphChange.objects.values_list('id', flat=True)), [latest])
+
+
+class GraphSnapshotTests(TestCase):
+    """A graph written to a snapshot and memory-mapped back is the same graph"""
+
+    def setUp(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        self.path = os.path.join(data_dir.name, 'graph.bin')
+        self.graph = synthetic_graph(cities=4)
+        self.graph.change_id = 7
+        self.graph.save_snapshot(self.path)
+
+    def test_round_trip(self):
+        loaded = TransitGraph.load_snapshot(self.path)
+        self.assertEqual((loaded.data_version, loaded.change_id), ('v1', 7))
+        for name in TransitGraph.ARRAY_NAMES:
+            # Used in place from the mapping, not copied
+            self.assertIsInstance(getattr(loaded, name), memoryview, name)
+            self.assertEqual(list(getattr(loaded, name)), list(getattr(self.graph, name)), name)
+        for name in TransitGraph.STRING_NAMES:
+            self.assertEqual(list(getattr(loaded, name)), list(getattr(self.graph, name)), name)
+        self.assertEqual(loaded.terminal_node, self.graph.terminal_node)
+        self.assertEqual(loaded.route_index, self.graph.route_index)
+        self.assertEqual(loaded.stop_node, self.graph.stop_node)
+
+        terminal_ids = sorted(self.graph.terminal_node)[::3]
+        for a in terminal_ids:
+            for b in terminal_ids:
+                self.assertEqual(loaded.plan(a, b), self.graph.plan(a, b))
+
+    def test_loaded_graph_can_be_patched(self):
+        route_id = self.graph.route_id[0]
+        expected = self.graph.clone().patch_routes(removed=[route_id])
+        patched = TransitGraph.load_snapshot(self.path).clone().patch_routes(removed=[route_id])
+        for name in ('offsets', 'edge_target', 'edge_weight', 'node_route_offsets', 'node_route_seq'):
+            self.assertEqual(list(getattr(patched, name)), list(getattr(expected, name)), name)
+
+    def test_unusable_files(self):
+        with open(self.path, 'rb') as fh:
+            data = fh.read()
+        for name, content in (('empty', b''), ('truncated', data[:len(data) // 2]), ('foreign', b'PK' + data[2:])):
+            with self.subTest(name):
+                with open(self.path, 'wb') as fh:
+                    fh.write(content)
+                with self.assertRaises(RoutingIndexError):
+                    TransitGraph.load_snapshot(self.path)
+        with self.assertRaises(RoutingIndexError):
+            TransitGraph.load_snapshot(self.path + '.missing')
+
+    def test_stale_snapshot_is_ignored(self):
+        with override_settings(ROUTING_DATA_DIR=os.path.dirname(self.path)):
+            self.assertIsNotNone(graph_module.load_snapshot('v1'))
+            self.assertIsNone(graph_module.load_snapshot('v2'))
+
+
+class RoutingIndexPipelineTests(FreshRoutingMixin, TestCase):
+    """Every export cache rebuild leaves a snapshot and hierarchy the workers can map for the new version"""
+
+    def setUp(self):
+        super().setUp()
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        settings = override_settings(ROUTING_DATA_DIR=data_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Rebuilds are run by the test itself, not by the verification signal
+        thread = mock.patch('api.models.Thread')
+        thread.start()
+        self.addCleanup(thread.stop)
+        self.terminals, self.routes = planner_network()
+
+    def rebuild(self, minute):
+        moment = timezone.now().replace(hour=12, minute=minute, second=0)
+        with mock.patch('api.management.commands.update_export_cache.timezone.now', return_value=moment):
+            call_command('update_export_cache', stdout=io.StringIO())
+
+    def test_snapshot_follows_rebuilds(self):
+        a, c = self.terminals['A'].id, self.terminals['C'].id
+        self.rebuild(0)
+        graph = graph_module.get_graph()
+        self.assertEqual(graph.data_version, CachedExport.current_version())
+        self.assertIsInstance(graph.offsets, memoryview)
+        self.assertTrue(graph.hierarchy.matches(graph))
+        self.assertIsNone(graph.plan(c, a))
+
+        # Verified between rebuilds: patched onto a private copy, without shortcuts
+        route = Route.objects.create(terminal=self.terminals['C'], destination_name='A', mode=self.routes['AB'].mode, verified=True)
+        with self.assertLogs('api.routing.updates', 'WARNING') as logs:
+            RouteStop.objects.create(route=route, stop_name='A', terminal=self.terminals['A'], fare=Decimal(20), time=25, order=1)
+            graph = graph_module.get_graph()
+        self.assertIn('plain Dijkstra', logs.output[0])
+        self.assertNotIsInstance(graph.offsets, memoryview)
+        self.assertIsNone(graph.hierarchy)
+        self.assertEqual(graph.plan(c, a)['total_time_ms'], 25 * MS_PER_MINUTE)
+
+        # The next rebuild maps the shared snapshot again, with the new route in it
+        self.rebuild(1)
+        graph = graph_module.get_graph()
+        self.assertEqual(graph.data_version, CachedExport.current_version())
+        self.assertIsInstance(graph.offsets, memoryview)
+        self.assertTrue(graph.hierarchy.matches(graph))
+        self.assertEqual(graph.plan(c, a)['total_time_ms'], 25 * MS_PER_MINUTE)
+
+
+class BatchPlanTests(FreshRoutingMixin, TestCase):
+    """/plan/batch/ streams one NDJSON line per pair, each matching a single /plan/ answer"""
+
+    def setUp(self):
+        super().setUp()
+        self.terminals, _ = planner_network()
+        self.url = reverse('plan-journey-batch')
+        # Throttle history lives in the default cache
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+
+    def post(self, body, query=''):
+        return self.client.post(self.url + query, json.dumps(body), content_type='application/json')
+
+    def test_throttled(self):
+        body = {'pairs': [{'from': self.terminals['A'].id, 'to': self.terminals['C'].id}]}
+        with mock.patch.object(views.PlanBatchThrottle, 'rate', '2/min', create=True):
+            self.assertEqual([self.post(body).status_code for _ in range(3)], [200, 200, 429])
+            # Counted per user once logged in
+            user = User.objects.create_user('planner', 'planner@example.com', 'secret-password')
+            client = APIClient()
+            client.force_authenticate(user)
+            response = client.post(self.url, body, format='json')
+            self.assertEqual(response.status_code, 200)
+
+    def test_lines(self):
+        a, b, c, d = (self.terminals[name].id for name in 'ABCD')
+        pairs = [
+            {'from': a, 'to': c}, {'from': b, 'to': c}, {'from': c, 'to': a},
+            {'from': {'lat': 14.5001, 'lng': 121.0}, 'to': b}, {'from': a, 'to': d}, {'from': a, 'to': a},
+        ]
+        response = self.post({'pairs': pairs})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content.endswith('\n'))
+        lines = {line['index']: line for line in map(json.loads, content.splitlines())}
+        self.assertEqual(sorted(lines), list(range(len(pairs))))
+
+        self.assertEqual((lines[0]['total_time_ms'], lines[0]['total_fare'], lines[0]['transfers']), (30 * MS_PER_MINUTE, 28, 1))
+        self.assertEqual(lines[1]['total_time_ms'], 20 * MS_PER_MINUTE)
+        self.assertEqual(lines[2]['error'], 'No route found between these terminals')
+        self.assertEqual((lines[3]['from'], lines[3]['total_time_ms']), (a, 10 * MS_PER_MINUTE))
+        self.assertEqual(lines[4]['error'], 'Terminal not found or not verified')
+        self.assertEqual((lines[5]['total_time_ms'], lines[5]['transfers']), (0, 0))
+        self.assertNotIn('legs', lines[0])
+
+        graph = graph_module.get_graph()
+        for index in (0, 1):
+            single = graph.plan(pairs[index]['from'], pairs[index]['to'])
+            self.assertEqual(lines[index]['total_time_ms'], single['total_time_ms'])
+
+        legs = json.loads(b''.join(self.post({'pairs': pairs[:1]}, '?legs=true').streaming_content))['legs']
+        self.assertEqual(legs, graph.plan(a, c)['legs'])
+
+    def test_invalid_bodies(self):
+        a = self.terminals['A'].id
+        for body in ({}, {'pairs': []}, {'pairs': [{'from': a}]}, {'pairs': [{'from': True, 'to': a}]},
+                     {'pairs': [{'from': {'lat': 'x', 'lng': 1}, 'to': a}]}):
+            with self.subTest(body=body):
+                response = self.post(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+        with override_settings(PLAN_BATCH_MAX_PAIRS=2):
+            self.assertEqual(self.post({'pairs': [{'from': a, 'to': a}] * 3}).status_code, 400)
+
+    def test_plan_many_matches_plan(self):
+        graph = synthetic_graph()
+        origin = min(graph.terminal_node)
+        destinations = sorted(graph.terminal_node)
+        journeys = graph.plan_many(origin, destinations)
+        for destination in destinations:
+            single = graph.plan(origin, destination)
+            self.assertEqual(journeys[destination] and journeys[destination]['total_time_ms'], single and single['total_time_ms'])
+
+
+class IsochroneTests(FreshRoutingMixin, TestCase):
+    """Isochrones list every terminal within the time or fare budget at its best cost"""
+
+    def reach(self, **budget):
+        result = raptor.isochrone(small_graph(), 1, **budget)
+        return [
+            (t['terminal_id'], t['time_ms'] // MS_PER_MINUTE, t['fare'], t['transfers']) for t in result['terminals']
+        ]
+
+    def test_time_budget(self):
+        self.assertEqual(self.reach(max_minutes=12), [(1, 0, 0, 0), (3, 5, 50, 0), (2, 10, 13, 0)])
+        self.assertEqual(self.reach(max_minutes=20), [(1, 0, 0, 0), (3, 5, 50, 0), (2, 10, 13, 0), (4, 15, 70, 1)])
+        # Without a transfer, 4 is only reachable by the hour-long bus
+        self.assertEqual(self.reach(max_minutes=90, max_transfers=0)[-1], (4, 60, 100, 0))
+
+    def test_fare_budget(self):
+        # Sorted by fare; the cheap way to 4 takes longer
+        self.assertEqual(self.reach(max_fare=30), [(1, 0, 0, 0), (2, 10, 13, 0), (4, 25, 26, 1)])
+        self.assertEqual(self.reach(max_minutes=20, max_fare=60), [(1, 0, 0, 0), (3, 5, 50, 0), (2, 10, 13, 0)])
+
+    def test_hull(self):
+        hull = raptor.isochrone(small_graph(), 1, max_minutes=20, hull=True)['hull']
+        # The terminals lie on one meridian, so the hull is its two ends
+        self.assertEqual(sorted(hull), [[14.01, 121.0], [14.04, 121.0]])
+
+    def test_endpoint(self):
+        terminals, _ = planner_network()
+        url = reverse('plan-isochrone')
+        response = self.client.get(url, {'from': terminals['A'].id, 'max_minutes': 25})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(t['terminal_id'], t['time_ms']) for t in response.json()['terminals']],
+            [(terminals['A'].id, 0), (terminals['B'].id, 10 * MS_PER_MINUTE)],
+        )
+        for params in ({'from': terminals['A'].id}, {'from': terminals['A'].id, 'max_fare': -1},
+                       {'from': terminals['A'].id, 'max_minutes': 5, 'hull': 'concave'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': terminals['D'].id, 'max_minutes': 5}).status_code, 404)
+
+
+class SnappingTests(FreshRoutingMixin, TestCase):
+    """Coordinates snap to the nearest verified terminal the graph can route from"""
+
+    def setUp(self):
+        super().setUp()
+        self.terminals, _ = planner_network()
+
+    def test_nearest_terminals(self):
+        a, b, c = (self.terminals[name].id for name in 'ABC')
+        hits = snapping.nearest_terminals(14.54, 121.0, k=3)
+        self.assertEqual([terminal_id for terminal_id, _ in hits], [b, a, c])
+        self.assertAlmostEqual(hits[0][1], haversine_km(14.54, 121.0, 14.55, 121.0))
+        self.assertEqual([terminal_id for terminal_id, _ in snapping.nearest_terminals(14.54, 121.0, k=5, radius_km=2)], [b])
+
+    def test_snap_skips_terminals_the_graph_lacks(self):
+        graph = graph_module.get_graph()
+        a = self.terminals['A']
+        self.assertEqual(snapping.snap_to_graph(graph, 14.49, 121.0)[0], a.id)
+        # Verified after the graph was built: the index knows it, the graph does not yet
+        newer = Terminal.objects.create(name='E', latitude=Decimal('14.49'), longitude=Decimal('121.0'), city=a.city, verified=True)
+        self.assertEqual(snapping.nearest_terminals(14.49, 121.0)[0][0], newer.id)
+        self.assertEqual(snapping.snap_to_graph(graph, 14.49, 121.0)[0], a.id)
+        self.assertEqual(snapping.snap_to_graph(graph_module.get_graph(), 14.49, 121.0)[0], newer.id)
+
+    def test_index_follows_terminal_edits(self):
+        index = snapping.get_index()
+        a = self.terminals['A']
+        a.rating = 3
+        a.save()
+        self.assertIs(snapping.get_index(), index)
+        a.latitude = Decimal('14.7')
+        a.save()
+        self.assertIsNot(snapping.get_index(), index)
+        self.assertEqual(snapping.nearest_terminals(14.7, 121.0)[0], (a.id, 0.0))
+        a.verified = False
+        a.save()
+        self.assertNotIn(a.id, [terminal_id for terminal_id, _ in snapping.nearest_terminals(14.7, 121.0, k=10)])
+
+
+class PlanCacheTests(FreshRoutingMixin, TestCase):
+    """Cached plans are reused only while the graph version and patch revision stay put"""
+
+    def test_lru(self):
+        plans = cache.PlanCache(2)
+        compute = mock.Mock(side_effect=lambda: object())
+        first = plans.get_or_compute(('v1', 0), 'a', compute)
+        self.assertIs(plans.get_or_compute(('v1', 0), 'a', compute), first)
+        plans.get_or_compute(('v1', 0), 'b', compute)
+        plans.get_or_compute(('v1', 0), 'a', compute)
+        # 'b' is now the least recently used
+        plans.get_or_compute(('v1', 0), 'c', compute)
+        self.assertEqual(list(plans.entries), ['a', 'c'])
+        self.assertEqual(compute.call_count, 3)
+        self.assertEqual(
+            {key: plans.stats()[key] for key in ('entries', 'hits', 'misses', 'evictions')},
+            {'entries': 2, 'hits': 2, 'misses': 3, 'evictions': 1},
+        )
+
+    def test_version_and_revision_changes_clear(self):
+        plans = cache.PlanCache(8)
+        plans.get_or_compute(('v1', 0), 'a', lambda: 1)
+        for version in (('v1', 1), ('v2', 1)):
+            with self.subTest(version=version):
+                self.assertEqual(plans.get_or_compute(version, 'a', lambda: version), version)
+                self.assertEqual(list(plans.entries), ['a'])
+
+    def test_results_that_are_not_kept(self):
+        plans = cache.PlanCache(8)
+        plans.get_or_compute(('v1', 0), 'truncated', lambda: 1, cacheable=lambda result: False)
+        # The graph moved on while this plan was computed
+        plans.get_or_compute(('v1', 0), 'stale', lambda: plans.get_or_compute(('v1', 1), 'other', lambda: 2))
+        self.assertEqual(list(plans.entries), ['other'])
+        plans.get_or_compute(('v1', 1), 'unreachable', lambda: None)
+        self.assertIn('unreachable', plans.entries)
+
+    def test_verification_invalidates_cached_plans(self):
+        terminals, _ = planner_network()
+        params = {'from': terminals['A'].id, 'to': terminals['C'].id}
+        url = reverse('plan-journey')
+        self.assertEqual(self.client.get(url, params).json()['total_time_ms'], 30 * MS_PER_MINUTE)
+        self.assertEqual(self.client.get(url, params).json()['total_time_ms'], 30 * MS_PER_MINUTE)
+        self.assertEqual(cache.plan_cache.stats()['hits'], 1)
+
+        express = Route.objects.create(
+            terminal=terminals['A'], destination_name='C', mode=ModeOfTransport.objects.get(mode_name='bus'), verified=True
+        )
+        RouteStop.objects.create(route=express, stop_name='C', terminal=terminals['C'], fare=Decimal(50), time=12, order=1)
+        self.assertEqual(self.client.get(url, params).json()['total_time_ms'], 12 * MS_PER_MINUTE)
+        self.assertEqual(self.client.get(reverse('plan-cache-stats')).status_code, 401)
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        stats = admin.get(reverse('plan-cache-stats')).json()
+        self.assertEqual(stats['version'], [graph_module.get_graph().data_version, graph_module.get_graph().revision])
+        self.assertEqual(stats['entries'], 1)
+
+
+class GeohashSearchTests(TestCase):
+    """The geohash cover of a circle never misses a point inside it"""
+
+    def test_encode_reference(self):
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geohash_encode(42.6, -5.6, 5), 'ezs42')
+        self.assertEqual(geohash_encode(-33.8568, 151.2153, 7), 'r3gx2ux')
+
+    def test_cover_contains_every_point_in_the_circle(self):
+        rng = random.Random(11)
+        for lat, lng, radius_km in ((14.5, 121.0, 0.3), (14.5, 121.0, 5), (10.3, 123.9, 40), (0.0, 179.99, 3), (-33.9, 151.2, 120)):
+            with self.subTest(lat=lat, lng=lng, radius_km=radius_km):
+                cells = geohash_radius_cover(lat, lng, radius_km)
+                self.assertLessEqual(len(cells), 32)
+                inside = 0
+                for _ in range(2000):
+                    point_lat = lat + rng.uniform(-1.2, 1.2) * radius_km / 111
+                    point_lng = lng + rng.uniform(-1.2, 1.2) * radius_km / 111
+                    point_lng = (point_lng + 180) % 360 - 180
+                    if haversine_km(lat, lng, point_lat, point_lng) <= radius_km:
+                        inside += 1
+                        geohash = geohash_encode(point_lat, point_lng)
+                        self.assertTrue(any(geohash.startswith(cell) for cell in cells), (point_lat, point_lng))
+                self.assertGreater(inside, 1000)
+
+    def test_search_matches_brute_force(self):
+        rng = random.Random(5)
+        city = City.objects.create(name='City', region=Region.objects.create(name='Region'))
+        terminals = []
+        for i in range(400):
+            lat, lng = round(rng.uniform(14.3, 14.7), 6), round(rng.uniform(120.9, 121.2), 6)
+            terminals.append(Terminal(
+                name=f'Terminal {i}', latitude=Decimal(str(lat)), longitude=Decimal(str(lng)), city=city,
+                verified=i % 5 != 0, geohash=geohash_encode(lat, lng),
+            ))
+        Terminal.objects.bulk_create(terminals)
+        verified = list(Terminal.objects.filter(verified=True).values_list('id', 'latitude', 'longitude'))
+        for _ in range(10):
+            lat, lng = rng.uniform(14.3, 14.7), rng.uniform(120.9, 121.2)
+            for radius_km, limit in ((1, None), (4, None), (4, 3), (None, 6)):
+                with self.subTest(point=(lat, lng), radius_km=radius_km, limit=limit):
+                    expected = sorted(
+                        (haversine_km(lat, lng, float(t_lat), float(t_lng)), terminal_id) for terminal_id, t_lat, t_lng in verified
+                    )
+                    expected = [terminal_id for distance, terminal_id in expected if radius_km is None or distance <= radius_km]
+                    hits = snapping.search_terminals(lat, lng, radius_km=radius_km, limit=limit)
+                    self.assertEqual([terminal_id for terminal_id, _ in hits], expected[:limit] if limit else expected)
+
+    def test_save_derives_geohash(self):
+        city = City.objects.create(name='City', region=Region.objects.create(name='Region'))
+        terminal = Terminal.objects.create(name='T', latitude=Decimal('14.5'), longitude=Decimal('121.0'), city=city)
+        self.assertEqual(terminal.geohash, geohash_encode(14.5, 121.0))
+        terminal.longitude = Decimal('121.1')
+        terminal.save()
+        self.assertEqual(Terminal.objects.get(id=terminal.id).geohash, geohash_encode(14.5, 121.1))
+
+
+class ClusterIndexTests(TestCase):
+    """Clusters keep every terminal counted exactly once at every zoom"""
+
+    # Five terminals a few dozen meters apart in each of three cities
+    CITIES = {'Manila': (14.5995, 120.9842), 'Cebu': (10.3157, 123.8854), 'Davao': (7.1907, 125.4553)}
+    WORLD = (-180, -85, 180, 85)
+
+    def setUp(self):
+        self.points = [
+            (10 * c + i + 1, f'{name} {i}', lat + 0.0004 * i, lng + 0.0003 * (i % 2))
+            for c, (name, (lat, lng)) in enumerate(self.CITIES.items()) for i in range(5)
+        ]
+        self.index = clusters.ClusterIndex.build(self.points, 'v1')
+
+    def summary(self, zoom, bbox=WORLD):
+        return sorted((item['type'], item.get('count', 1)) for item in self.index.clusters(*bbox, zoom))
+
+    def test_counts_per_zoom(self):
+        for zoom in range(clusters.MIN_ZOOM, clusters.MAX_ZOOM + 2):
+            with self.subTest(zoom=zoom):
+                self.assertEqual(sum(count for _, count in self.summary(zoom)), len(self.points))
+        self.assertEqual(self.summary(0), [('cluster', 15)])
+        self.assertEqual(self.summary(10), [('cluster', 5)] * 3)
+        # Past the deepest clustered zoom every terminal stands alone, at its own position
+        items = self.index.clusters(*self.WORLD, clusters.MAX_ZOOM + 1)
+        self.assertEqual(
+            sorted((item['id'], item['latitude'], item['longitude']) for item in items),
+            sorted((terminal_id, lat, lng) for terminal_id, _, lat, lng in self.points),
+        )
+
+    def test_viewport_and_expansion(self):
+        lat, lng = self.CITIES['Cebu']
+        bbox = (lng - 0.1, lat - 0.1, lng + 0.1, lat + 0.1)
+        [cluster] = self.index.clusters(*bbox, 10)
+        self.assertEqual(cluster['count'], 5)
+        self.assertAlmostEqual(cluster['latitude'], lat + 0.0008, places=6)
+        # Zooming to the expansion zoom splits the cluster
+        self.assertGreater(cluster['expansion_zoom'], 10)
+        self.assertGreater(len(self.index.clusters(*bbox, cluster['expansion_zoom'])), 1)
+        self.assertEqual(len(self.index.clusters(*bbox, cluster['expansion_zoom'] - 1)), 1)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            path = self.index.save(os.path.join(data_dir, clusters.INDEX_FILENAME))
+            loaded = clusters.ClusterIndex.load(path)
+            self.assertTrue(loaded.matches('v1'))
+            self.assertFalse(loaded.matches('v2'))
+            for zoom in (0, 8, 12, 17):
+                self.assertEqual(loaded.clusters(*self.WORLD, zoom), self.index.clusters(*self.WORLD, zoom))
+
+    def test_stored_empty_index_is_used(self):
+        with tempfile.TemporaryDirectory() as data_dir, override_settings(ROUTING_DATA_DIR=data_dir), \
+                mock.patch.object(clusters, '_index', None), \
+                mock.patch.object(CachedExport, 'current_version', return_value='v2'):
+            clusters.ClusterIndex.build([], 'v2').save()
+            with mock.patch.object(clusters, 'build_cluster_index', side_effect=AssertionError('rebuilt')):
+                index = clusters.get_cluster_index()
+            self.assertEqual((len(index), index.data_version), (0, 'v2'))
+            self.assertEqual(index.clusters(*self.WORLD, 5), [])
+
+    def test_endpoint(self):
+        url = reverse('map-clusters')
+        for params in ({'zoom': 3}, {'bbox': '1,2,3', 'zoom': 3}, {'bbox': '120,5,127,19'}, {'bbox': '120,5,127,19', 'zoom': -1}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+        with mock.patch.object(clusters, '_index', self.index), mock.patch.object(CachedExport, 'current_version', return_value='v1'):
+            data = self.client.get(url, {'bbox': '120,5,127,19', 'zoom': 10}).json()
+        self.assertEqual((data['count'], data['clustered'], data['data_version']), (3, True, 'v1'))
+
+
+def tile_graph():
+    """Two nearby terminals joined both ways (one route with a dense polyline), plus a far one"""
+    terminals = [(1, 'Near', 14.50, 121.00), (2, 'Also near', 14.52, 121.02), (3, 'Far', 10.30, 123.90)]
+    polyline = [[14.50 + 0.0002 * i, 121.00 + 0.0002 * i] for i in range(101)]
+    routes = [(10, 1, 'Also near', 'jeepney', 'fixed', polyline), (11, 2, 'Near', 'bus', 'fixed', None)]
+    stops = [(100, 10, 2, 'Also near', 13, 10, None, None), (110, 11, 1, 'Near', 15, 12, None, None)]
+    return TransitGraph.from_rows(terminals, routes, stops, data_version='v1')
+
+
+def tile_of(lat, lng, z):
+    x, y = project(lat, lng)
+    return int(x * 2 ** z), int(y * 2 ** z)
+
+
+class MapTileTests(FreshRoutingMixin, TestCase):
+    """Tiles hold the terminals and route paths on screen, simplified to the tile's pixels"""
+
+    def setUp(self):
+        super().setUp()
+        self.source = tiles.TileSource(tile_graph())
+
+    def render(self, z, x, y):
+        tile = self.source.render(z, x, y)
+        return sorted(t['id'] for t in tile['terminals']), {route['id']: route['paths'] for route in tile['routes']}
+
+    def test_tile_around_a_terminal(self):
+        terminals, routes = self.render(12, *tile_of(14.50, 121.00, 12))
+        self.assertEqual(terminals, [1, 2])
+        self.assertEqual(sorted(routes), [10, 11])
+        [path] = routes[10]
+        # Vertices sharing a pixel are dropped, the ends are kept
+        self.assertLess(len(path), 101)
+        self.assertEqual((path[0], path[-1]), ([14.5, 121.0], [14.52, 121.02]))
+        self.assertEqual(routes[11], [[[14.52, 121.02], [14.5, 121.0]]])
+
+    def test_deep_tile_keeps_only_what_is_on_screen(self):
+        z = 17
+        x, y = tile_of(14.51, 121.01, z)
+        terminals, routes = self.render(z, x, y)
+        self.assertEqual(terminals, [])
+        # The stop-to-stop line of route 11 crosses the tile without a vertex in it
+        self.assertEqual(sorted(routes), [10, 11])
+        min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+        pad = (max_x - min_x) * tiles.TILE_BUFFER
+        for lat, lng in routes[10][0][1:-1]:
+            px, py = project(lat, lng)
+            self.assertTrue(min_x - pad <= px <= max_x + pad and min_y - pad <= py <= max_y + pad)
+        self.assertEqual(self.render(12, *tile_of(10.30, 123.90, 12)), ([3], {}))
+        self.assertEqual(self.render(12, 0, 0), ([], {}))
+
+    def test_covering_tiles(self):
+        z = 14
+        covering = set(self.source.covering_tiles(z))
+        for lat, lng in ((14.50, 121.00), (14.51, 121.01), (14.52, 121.02), (10.30, 123.90)):
+            self.assertIn(tile_of(lat, lng, z), covering)
+        for x, y in covering:
+            terminals, routes = self.render(z, x, y)
+            self.assertTrue(terminals or routes, (x, y))
+
+    def test_endpoint(self):
+        terminals, _ = planner_network()
+        CachedExport.objects.create(export_type='complete', data={}, data_version='v1')
+        a = terminals['A']
+        url = reverse('map-tile', args=[12, *tile_of(float(a.latitude), float(a.longitude), 12)])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(a.id, [t['id'] for t in json.loads(response.content)['terminals']])
+        self.assertEqual(response['ETag'], '"v1"')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={tiles.TILE_MAX_AGE}')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"v1"').status_code, 304)
+        self.assertIn('immutable', self.client.get(url, {'v': 'v1'})['Cache-Control'])
+        self.assertEqual(self.client.get(reverse('map-tile', args=[3, 8, 0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('map-tile', args=[21, 0, 0])).status_code, 404)
+
+
+def decode_vector_tile(data):
+    """Minimal Mapbox Vector Tile 2.1 reader: {layer name: (version, extent, [feature dicts])}"""
+
+    def varint(buffer, i):
+        value = shift = 0
+        while True:
+            byte = buffer[i]
+            i += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                return value, i
+
+    def fields(buffer):
+        i = 0
+        while i < len(buffer):
+            key, i = varint(buffer, i)
+            if key & 7 == 0:
+                value, i = varint(buffer, i)
+            elif key & 7 == 1:
+                value, i = struct.unpack('<d', buffer[i:i + 8])[0], i + 8
+            else:
+                size, i = varint(buffer, i)
+                value, i = bytes(buffer[i:i + size]), i + size
+            yield key >> 3, value
+
+    def packed(buffer):
+        values, i = [], 0
+        while i < len(buffer):
+            value, i = varint(buffer, i)
+            values.append(value)
+        return values
+
+    def unzigzag(n):
+        return (n >> 1) ^ -(n & 1)
+
+    def decode_value(buffer):
+        [(field, value)] = fields(buffer)
+        return {1: lambda: value.decode(), 3: lambda: value, 5: lambda: value, 6: lambda: unzigzag(value), 7: lambda: bool(value)}[field]()
+
+    def geometry(commands):
+        parts, x, y, i = [], 0, 0, 0
+        while i < len(commands):
+            command, count = commands[i] & 7, commands[i] >> 3
+            i += 1
+            for _ in range(count):
+                x, y = x + unzigzag(commands[i]), y + unzigzag(commands[i + 1])
+                i += 2
+                if command == mvt.MOVE_TO:
+                    parts.append([(x, y)])
+                else:
+                    parts[-1].append((x, y))
+        return parts
+
+    layers = {}
+    for field, layer in fields(data):
+        assert field == 3
+        items = list(fields(layer))
+        keys = [value.decode() for f, value in items if f == 3]
+        values = [decode_value(value) for f, value in items if f == 4]
+        features = []
+        for f, raw in items:
+            if f != 2:
+                continue
+            feature = dict(fields(raw))
+            tags = packed(feature.get(2, b''))
+            features.append({
+                'id': feature.get(1),
+                'type': feature[3],
+                'properties': {keys[tags[j]]: values[tags[j + 1]] for j in range(0, len(tags), 2)},
+                'geometry': geometry(packed(feature[4])),
+            })
+        meta = dict(items)
+        layers[meta[1].decode()] = (meta[15], meta[5], features)
+    return layers
+
+
+class VectorTileTests(FreshRoutingMixin, TestCase):
+    """Vector tiles decode back to the JSON tile's features, in tile coordinates"""
+
+    def setUp(self):
+        super().setUp()
+        self.source = tiles.TileSource(tile_graph())
+
+    def to_tile(self, z, x, y, lat, lng):
+        min_x, min_y, _, _ = tile_bounds(z, x, y)
+        px, py = project(lat, lng)
+        scale = mvt.EXTENT * 2 ** z
+        return round((px - min_x) * scale), round((py - min_y) * scale)
+
+    def test_decodes_to_json_tile(self):
+        z, (x, y) = 12, tile_of(14.50, 121.00, 12)
+        layers = decode_vector_tile(mvt.encode_tile(self.source, z, x, y))
+        json_tile = self.source.render(z, x, y)
+        self.assertEqual(sorted(layers), ['routes', 'terminals'])
+
+        version, extent, terminals = layers['terminals']
+        self.assertEqual((version, extent), (2, mvt.EXTENT))
+        self.assertEqual([(f['id'], f['type']) for f in terminals], [(1, mvt.POINT), (2, mvt.POINT)])
+        self.assertEqual(terminals[0]['properties'], {'id': 1, 'name': 'Near', 'modes': 'bus,jeepney', 'verified': True})
+        for feature, terminal in zip(terminals, json_tile['terminals']):
+            self.assertEqual(feature['geometry'], [[self.to_tile(z, x, y, terminal['latitude'], terminal['longitude'])]])
+
+        _, _, routes = layers['routes']
+        self.assertEqual(
+            [f['properties'] for f in routes],
+            [{'id': 10, 'terminal_id': 1, 'destination_name': 'Also near', 'mode': 'jeepney', 'verified': True},
+             {'id': 11, 'terminal_id': 2, 'destination_name': 'Near', 'mode': 'bus', 'verified': True}],
+        )
+        for feature, route in zip(routes, json_tile['routes']):
+            self.assertEqual(feature['type'], mvt.LINESTRING)
+            # Vertices that round to the same tile unit are merged
+            expected = [self.to_tile(z, x, y, lat, lng) for lat, lng in route['paths'][0]]
+            expected = [point for i, point in enumerate(expected) if i == 0 or point != expected[i - 1]]
+            self.assertEqual(feature['geometry'], [expected])
+
+    def test_empty_tile(self):
+        self.assertEqual(mvt.encode_tile(self.source, 12, 0, 0), b'')
+
+    def test_store(self):
+        graph = self.source.graph
+        with tempfile.TemporaryDirectory() as data_dir, override_settings(ROUTING_DATA_DIR=data_dir), \
+                mock.patch('api.management.commands.build_vector_tiles.get_graph', return_value=graph), \
+                mock.patch.object(tiles, 'get_graph', return_value=graph):
+            call_command('build_vector_tiles', min_zoom=10, max_zoom=12, stdout=io.StringIO())
+            version = mvt.store_version('v1', 0)
+            z, (x, y) = 12, tile_of(14.50, 121.00, 12)
+            stored = mvt.stored_tile(version, z, x, y)
+            self.assertEqual(stored, mvt.encode_tile(self.source, z, x, y))
+            self.assertIsNone(mvt.stored_tile(version, 12, 0, 0))
+
+            url = reverse('map-vector-tile', args=[z, x, y])
+            response = self.client.get(url)
+            self.assertEqual(response['Content-Type'], mvt.CONTENT_TYPE)
+            self.assertEqual(response.content, stored)
+            # Not generated: rendered on demand
+            self.assertEqual(self.client.get(reverse('map-vector-tile', args=[12, 0, 0])).content, b'')
+
+            # A graph of the same data version that includes later changes (even one
+            # freshly built, so unpatched) never gets tiles drawn before them
+            mvt.save_tile(version, z, x, y, b'stale')
+            graph.change_id = 5
+            self.assertEqual(self.client.get(url).content, stored)
+
+            mvt.save_tile('v0-0', 1, 0, 0, b'old')
+            mvt.prune_tile_store(version)
+            self.assertIsNone(mvt.stored_tile('v0-0', 1, 0, 0))
+
+
+class GeoJsonExportTests(TestCase):
+    """The streamed export is one valid FeatureCollection of verified terminals and routes"""
+
+    def setUp(self):
+        self.terminals, self.routes = planner_network()
+        self.routes['AB'].polyline = [[14.5, 121.0], [14.52, 121.01], 'bad', [14.55, 121.0]]
+        self.routes['AB'].save()
+        # Verified route from an unverified terminal: left out with its terminal
+        Route.objects.create(
+            terminal=self.terminals['D'], destination_name='A', mode=self.routes['AB'].mode, verified=True
+        )
+
+    def fetch(self, query=''):
+        response = self.client.get(reverse('export-geojson') + query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/geo+json')
+        return json.loads(b''.join(response.streaming_content))
+
+    def assertValidFeature(self, feature):
+        self.assertEqual(feature['type'], 'Feature')
+        self.assertIsInstance(feature['properties'], dict)
+        geometry = feature['geometry']
+        if geometry['type'] == 'Point':
+            positions = [geometry['coordinates']]
+        else:
+            self.assertEqual(geometry['type'], 'LineString')
+            positions = geometry['coordinates']
+            self.assertGreaterEqual(len(positions), 2)
+        for lng, lat in positions:
+            self.assertTrue(-180 <= lng <= 180 and -90 <= lat <= 90)
+
+    def test_feature_collection(self):
+        collection = self.fetch()
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        self.assertIn('export_timestamp', collection)
+        for feature in collection['features']:
+            self.assertValidFeature(feature)
+
+        features = {feature['id']: feature for feature in collection['features']}
+        self.assertEqual(len(features), len(collection['features']))
+        t = self.terminals
+        r = self.routes
+        self.assertEqual(sorted(features), sorted(
+            [f"terminal.{t[name].id}" for name in 'ABC'] + [f"route.{r[name].id}" for name in ('AB', 'BC', 'AC')]
+        ))
+
+        # [longitude, latitude]
+        self.assertEqual(features[f"terminal.{t['B'].id}"]['geometry']['coordinates'], [121.0, 14.55])
+        self.assertEqual(features[f"terminal.{t['A'].id}"]['properties']['city'], 'City')
+        # Stored polyline, bad vertices skipped
+        self.assertEqual(
+            features[f"route.{r['AB'].id}"]['geometry']['coordinates'], [[121.0, 14.5], [121.01, 14.52], [121.0, 14.55]]
+        )
+        # No polyline: drawn from the origin terminal through the stops
+        bc = features[f"route.{r['BC'].id}"]
+        self.assertEqual(bc['geometry']['coordinates'], [[121.0, 14.55], [121.0, 14.6]])
+        self.assertEqual(bc['properties']['mode'], 'jeepney')
+        self.assertEqual(
+            [(stop['terminal_id'], stop['fare'], stop['time']) for stop in bc['properties']['stops']],
+            [(t['C'].id, 15.0, 20)],
+        )
+
+    def test_layers(self):
+        features = self.fetch('?layers=routes')['features']
+        self.assertEqual({feature['properties']['feature_type'] for feature in features}, {'route'})
+        response = self.client.get(reverse('export-geojson') + '?layers=terminals,stops')
+        self.assertEqual(response.status_code, 400)
+
+    def test_paging_and_chunking(self):
+        # Pages smaller than the table must neither drop nor repeat rows
+        self.assertEqual(
+            [feature['properties']['name'] for feature in geojson.terminal_features(size=2)], ['A', 'B', 'C']
+        )
+        with mock.patch.object(geojson, 'WRITE_SIZE', 1):
+            chunks = list(geojson.feature_collection())
+        # Header, one write per feature, closing bracket
+        self.assertEqual(len(chunks), 1 + 6 + 1)
+        self.assertEqual(len(json.loads(''.join(chunks))['features']), 6)
+        self.assertEqual(json.loads(''.join(geojson.feature_collection(layers=())))['features'], [])
+
+
+class EncodedPolylineTests(TestCase):
+    """Google encoded polylines, against the algorithm's published example"""
+
+    # https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+    POINTS = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+    ENCODED = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+    def test_reference_vector(self):
+        self.assertEqual(encode_polyline(self.POINTS), self.ENCODED)
+        self.assertEqual(decode_polyline(self.ENCODED), self.POINTS)
+        self.assertEqual(encode_polyline([]), '')
+        self.assertEqual(decode_polyline(''), [])
+        # -179.9832104 -> -17998321, the algorithm description's worked value
+        self.assertEqual(encode_polyline([(0, -179.9832104)]), '?`~oia@')
+
+    def test_round_trip(self):
+        rng = random.Random(18)
+        points = [[round(rng.uniform(4.5, 21.0), 6), round(rng.uniform(116.0, 127.0), 6)] for _ in range(200)]
+        for precision in (5, 6):
+            decoded = decode_polyline(encode_polyline(points, precision), precision)
+            for (lat, lng), (decoded_lat, decoded_lng) in zip(points, decoded):
+                self.assertAlmostEqual(lat, decoded_lat, delta=0.5 / 10 ** precision + 1e-12)
+                self.assertAlmostEqual(lng, decoded_lng, delta=0.5 / 10 ** precision + 1e-12)
+        # Halves round away from zero on both sides
+        self.assertEqual(decode_polyline(encode_polyline([(0.000005, -0.000005)])), [[0.00001, -0.00001]])
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            decode_polyline(self.ENCODED[:-1])
+
+    def test_route_output(self):
+        terminals, routes = planner_network()
+        route = routes['AB']
+        route.polyline = self.POINTS
+        route.save()
+        route.refresh_from_db()
+        self.assertEqual((route.encoded_polyline, route.polyline_precision), (self.ENCODED, 5))
+
+        url = reverse('terminal-detail', args=[terminals['A'].id])
+        served = {r['id']: r for r in self.client.get(url + '?polyline=encoded').json()['routes']}
+        self.assertEqual((served[route.id]['polyline'], served[route.id]['polyline_precision']), (self.ENCODED, 5))
+        # Routes without a polyline have nothing to encode
+        self.assertIsNone(served[routes['AC'].id]['polyline'])
+        served = {r['id']: r for r in self.client.get(url).json()['routes']}
+        self.assertEqual(served[route.id]['polyline'], self.POINTS)
+        self.assertNotIn('polyline', self.client.get(url + '?polyline=none').json()['routes'][0])
+        self.assertEqual(self.client.get(url + '?polyline=wkt').status_code, 400)
+
+
+def line_distances(points):
+    """distance(i, lo, hi): meters from vertex i to segment lo-hi, in simplify.py's local projection"""
+    scale = math.cos(math.radians(sum(lat for lat, _ in points) / len(points))) * simplify.METERS_PER_DEGREE
+    xy = [(lng * scale, lat * simplify.METERS_PER_DEGREE) for lat, lng in points]
+
+    def distance(i, lo, hi):
+        (ax, ay), (bx, by), (px, py) = xy[lo], xy[hi], xy[i]
+        dx, dy = bx - ax, by - ay
+        t = max(0, min(1, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy))) if dx or dy else 0
+        return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+    return distance
+
+
+def douglas_peucker(points, tolerance):
+    """Indices the textbook recursive Douglas-Peucker keeps"""
+    if len(points) < 2:
+        return list(range(len(points)))
+    distance = line_distances(points)
+
+    def split(lo, hi):
+        if hi - lo < 2:
+            return []
+        pivot = max(range(lo + 1, hi), key=lambda i: (distance(i, lo, hi), -i))
+        if distance(pivot, lo, hi) <= tolerance:
+            return []
+        return split(lo, pivot) + [pivot] + split(pivot, hi)
+
+    return [0] + split(0, len(points) - 1) + [len(points) - 1]
+
+
+class PolylineSimplificationTests(TestCase):
+    """One vectorized pass gives the same lines as running Douglas-Peucker per tolerance"""
+
+    def random_line(self, rng, size):
+        lat, lng = rng.uniform(5, 20), rng.uniform(117, 126)
+        points = []
+        for _ in range(size):
+            lat += rng.uniform(-0.002, 0.002)
+            lng += rng.uniform(-0.002, 0.002)
+            points.append((lat, lng))
+        return points
+
+    def test_matches_recursive(self):
+        rng = random.Random(19)
+        lines = [self.random_line(rng, size) for size in (0, 1, 2, 3, 50, 400)] + [
+            self.random_line(rng, rng.randint(2, 120)) for _ in range(20)
+        ]
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line))
+        coordinates = [point for line in lines for point in line]
+        importance = simplify.dp_importance(
+            [lat for lat, _ in coordinates], [lng for _, lng in coordinates], offsets
+        )
+        for i, line in enumerate(lines):
+            line_importance = importance[offsets[i]:offsets[i + 1]]
+            if line:
+                # Endpoints survive every tolerance
+                self.assertEqual((line_importance[0], line_importance[-1]), (math.inf, math.inf))
+            for tolerance in (0, 5, 10, 40, 150, 600):
+                kept = [j for j, value in enumerate(line_importance) if value > tolerance]
+                self.assertEqual(kept, douglas_peucker(line, tolerance), (i, tolerance))
+
+    def test_error_bound(self):
+        line = self.random_line(random.Random(190), 300)
+        importance = simplify.dp_importance([lat for lat, _ in line], [lng for _, lng in line], [0, len(line)])
+        distance = line_distances(line)
+        for tolerance in simplify.SIMPLIFY_TOLERANCES_M.values():
+            kept = [j for j, value in enumerate(importance) if value > tolerance]
+            # Every dropped vertex lies within the tolerance of the segment replacing it
+            for lo, hi in zip(kept, kept[1:]):
+                for j in range(lo + 1, hi):
+                    self.assertLessEqual(distance(j, lo, hi), tolerance)
+
+    def test_variants(self):
+        straight = [(14.5, 121.0 + 0.001 * i) for i in range(5)]
+        line = self.random_line(random.Random(191), 200)
+        straight_variants, variants = simplify.polyline_variants([straight, line])
+        # Collinear vertices drop at every zoom; an unchanged line stores no variant
+        self.assertEqual(straight_variants, {
+            str(zoom): encode_polyline([straight[0], straight[-1]]) for zoom in simplify.SIMPLIFY_TOLERANCES_M
+        })
+        self.assertEqual(simplify.polyline_variants([straight[:2]]), [{}])
+        sizes = [len(decode_polyline(variants[str(zoom)])) for zoom in sorted(simplify.SIMPLIFY_TOLERANCES_M)]
+        self.assertEqual(sizes, sorted(sizes))
+        self.assertLess(sizes[-1], len(line))
+
+        self.assertEqual(simplify.variant_for(zoom=9), '10')
+        self.assertEqual(simplify.variant_for(zoom=14), '14')
+        self.assertIsNone(simplify.variant_for(zoom=15))
+        self.assertEqual(simplify.variant_for(tolerance_m=100), '12')
+        self.assertIsNone(simplify.variant_for(tolerance_m=5))
+        self.assertIsNone(simplify.variant_for())
+
+    def test_route_output(self):
+        terminals, routes = planner_network()
+        line = self.random_line(random.Random(192), 200)
+        route = routes['AB']
+        route.polyline = [list(point) for point in line]
+        route.save()
+        url = reverse('terminal-detail', args=[terminals['A'].id])
+
+        served = {r['id']: r for r in self.client.get(url + '?zoom=11').json()['routes']}
+        self.assertEqual(served[route.id]['polyline'], decode_polyline(route.polyline_variants['12']))
+        served = {r['id']: r for r in self.client.get(url + '?tolerance=600&polyline=encoded').json()['routes']}
+        self.assertEqual(served[route.id]['polyline'], route.polyline_variants['8'])
+        self.assertEqual(self.client.get(url + '?zoom=-1').status_code, 400)
+
+        # Variants wiped by a bulk write are rebuilt by the command
+        Route.objects.filter(id=route.id).update(polyline_variants={})
+        call_command('simplify_polylines', stdout=io.StringIO())
+        route.refresh_from_db()
+        self.assertEqual(route.polyline_variants, simplify.polyline_variants([line])[0])
+
+
+class CorridorSearchTests(FreshRoutingMixin, TestCase):
+    """Routes passing near a point, with where along them the rider meets them"""
+
+    def brute_force(self, graph, lat, lng, radius_m, mode=None):
+        """{route id: distance_m} over every segment and stop of every live route"""
+        scale = math.cos(math.radians(lat)) * corridors.METERS_PER_DEGREE
+
+        def distance(a, b):
+            ax, ay = (a[1] - lng) * scale, (a[0] - lat) * corridors.METERS_PER_DEGREE
+            dx, dy = (b[1] - a[1]) * scale, (b[0] - a[0]) * corridors.METERS_PER_DEGREE
+            t = max(0, min(1, -(ax * dx + ay * dy) / (dx * dx + dy * dy))) if dx or dy else 0
+            return math.hypot(ax + t * dx, ay + t * dy)
+
+        found = {}
+        for r, route_id in enumerate(graph.route_id):
+            if not graph.route_live[r] or (mode is not None and graph.route_mode[r] != mode):
+                continue
+            stops = [
+                (graph.node_lat[node], graph.node_lng[node])
+                for node in graph.seq_node[graph.route_seq_offsets[r]:graph.route_seq_offsets[r + 1]]
+            ]
+            lo, hi = graph.route_poly_offsets[r], graph.route_poly_offsets[r + 1]
+            line = list(zip(graph.poly_lat[lo:hi], graph.poly_lng[lo:hi])) if hi - lo >= 2 else stops
+            segments = list(zip(line, line[1:]))
+            if hi - lo >= 2:
+                segments += [(stop, stop) for stop in stops]
+            best = min(distance(a, b) for a, b in segments)
+            if best <= radius_m:
+                found[route_id] = best
+        return found
+
+    def test_matches_brute_force(self):
+        graph = synthetic_graph()
+        index = corridors.CorridorIndex(graph)
+        rng = random.Random(20)
+        nodes = list(graph.terminal_node.values())
+        for _ in range(60):
+            node = rng.choice(nodes)
+            lat = graph.node_lat[node] + rng.uniform(-0.02, 0.02)
+            lng = graph.node_lng[node] + rng.uniform(-0.02, 0.02)
+            radius = rng.choice([50, 200, 800, corridors.MAX_CORRIDOR_RADIUS_M])
+            mode = rng.choice([None, 'jeepney', 'bus'])
+            hits = index.nearby(lat, lng, radius_m=radius, mode=mode)
+            expected = self.brute_force(graph, lat, lng, radius, mode)
+
+            found = {graph.route_id[index.route[i]]: distance for i, distance, _, _, _ in hits}
+            self.assertEqual(sorted(found), sorted(expected))
+            for route_id, distance in found.items():
+                self.assertAlmostEqual(distance, expected[route_id], places=6)
+            distances = [hit[1] for hit in hits]
+            self.assertEqual(distances, sorted(distances))
+            # The projected point is where the distance is measured to
+            for i, distance, projected_lat, projected_lng, along in hits:
+                self.assertAlmostEqual(haversine_km(lat, lng, projected_lat, projected_lng) * 1000, distance, delta=1 + distance * 0.01)
+                self.assertTrue(0 <= along <= index.line_length[i] + 1e-6)
+            self.assertEqual(index.nearby(lat, lng, radius_m=radius, mode=mode, limit=2), hits[:2])
+
+    def test_projection_and_along_distance(self):
+        terminals, routes = planner_network()
+        # East 0.01 degrees, then north 0.05 degrees
+        routes['AB'].polyline = [[14.5, 121.0], [14.5, 121.01], [14.55, 121.01]]
+        routes['AB'].save()
+        response = self.client.get(reverse('nearby-routes'), {'lat': 14.52, 'lng': 121.011, 'radius': 2000})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        # BC starts 3 km north
+        self.assertEqual([route['route_id'] for route in body['routes']], [routes['AB'].id, routes['AC'].id])
+
+        ab, ac = body['routes']
+        meters = corridors.METERS_PER_DEGREE
+        east = 0.01 * math.cos(math.radians(14.5)) * meters
+        self.assertEqual((ab['position']['latitude'], ab['position']['longitude']), (14.52, 121.01))
+        self.assertAlmostEqual(ab['distance_m'], 0.001 * math.cos(math.radians(14.52)) * meters, delta=0.1)
+        self.assertAlmostEqual(ab['position']['along_m'], east + 0.02 * meters, delta=0.1)
+        self.assertAlmostEqual(ab['position']['fraction'], (east + 0.02 * meters) / (east + 0.05 * meters), places=3)
+        self.assertEqual((ab['terminal_id'], ab['mode']), (terminals['A'].id, 'jeepney'))
+        self.assertEqual((ab['nearest_stop']['terminal_id'], ab['nearest_stop']['sequence']), (terminals['A'].id, 0))
+
+        # No polyline: the line runs through the stops
+        self.assertEqual((ac['position']['latitude'], ac['position']['longitude']), (14.52, 121.0))
+        self.assertAlmostEqual(ac['position']['along_m'], 0.02 * meters, delta=0.1)
+        self.assertAlmostEqual(ac['position']['fraction'], 0.2, places=3)
+
+        # The index follows the patched graph
+        routes['AB'].polyline = [[14.5, 121.0], [14.55, 121.0]]
+        routes['AB'].save()
+        body = self.client.get(reverse('nearby-routes'), {'lat': 14.52, 'lng': 121.011, 'mode': 'jeepney'}).json()
+        self.assertEqual(body['count'], 0)
+
+    def test_parameters(self):
+        planner_network()
+        url = reverse('nearby-routes')
+        self.assertEqual(self.client.get(url, {'lat': 14.5}).status_code, 400)
+        for params in (
+            {'radius': corridors.MAX_CORRIDOR_RADIUS_M + 1},
+            {'radius': 0},
+            {'limit': 0},
+            {'mode': 'ferry'},
+            {'radius': 'far'},
+        ):
+            response = self.client.get(url, {'lat': 14.5, 'lng': 121.0, **params})
+            self.assertEqual(response.status_code, 400, params)
+        body = self.client.get(url, {'lat': 14.5, 'lng': 121.0, 'limit': 1}).json()
+        self.assertEqual((body['radius_m'], body['count']), (corridors.DEFAULT_CORRIDOR_RADIUS_M, 1))
@@ -17,11 +17,27 @@ urlpatterns = [
     path('export/regions-cities/', views.export_regions_cities, name='export-regions-cities'),
     path('export/terminals/', views.export_terminals, name='export-terminals'),
     path('export/routes-stops/', views.export_routes_stops, name='export-routes-stops'),
+    path('export/geojson/', views.export_geojson, name='export-geojson'),
     
     # Terminals
     path('terminals/city/<int:city_id>/', views.TerminalsByCityView.as_view(), name='terminals-by-city'),
     path('terminals/region/<int:region_id>/', views.TerminalsByRegionView.as_view(), name='terminals-by-region'),
     path('terminals/nearby/', views.nearby_terminals, name='nearby-terminals'),
+    path('terminals/<int:terminal_id>/', views.TerminalDetailView.as_view(), name='terminal-detail'),
+
+    # Routes
+    path('routes/nearby/', views.nearby_routes, name='nearby-routes'),
+
+    # Journey Planner
+    path('plan/', views.plan_journey, name='plan-journey'),
+    path('plan/batch/', views.plan_journey_batch, name='plan-journey-batch'),
+    path('plan/isochrone/', views.plan_isochrone, name='plan-isochrone'),
+    path('plan/cache-stats/', views.plan_cache_stats, name='plan-cache-stats'),
+
+    # Map
+    path('clusters/', views.map_clusters, name='map-clusters'),
+    path('tiles/<int:z>/<int:x>/<int:y>/', views.map_tile, name='map-tile'),
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', views.map_vector_tile, name='map-vector-tile'),
 
     # User Contributions
     path('contribute/terminal/', views.contribute_terminal, name='contribute-terminal'),
@@ -0,0 +1,201 @@
+"""
+Geographic Helpers
+
+Small great-circle helpers shared by the routing engine and the proximity endpoints.
+Coordinates are plain floats in decimal degrees; callers convert from DecimalField first.
+"""
+
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """
+    Great-circle distance between two points.
+
+    Returns:
+        Distance in kilometers
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def coerce_point(point):
+    """
+    Normalize a polyline vertex to a (lat, lng) float tuple.
+
+    Accepts `[lat, lng]` pairs as well as `{"lat": .., "lng": ..}` dicts.
+    Returns None for anything that cannot be read as a coordinate.
+    """
+    try:
+        if isinstance(point, dict):
+            lat = point.get('lat', point.get('latitude'))
+            lng = point.get('lng', point.get('lon', point.get('longitude')))
+            return float(lat), float(lng) # type: ignore
+        return float(point[0]), float(point[1])
+    except (TypeError, ValueError, IndexError, KeyError):
+        return None
+
+
+def coerce_polyline(polyline):
+    """Return a route polyline as a list of (lat, lng) tuples, skipping bad vertices."""
+    if not polyline or not isinstance(polyline, list):
+        return []
+    points = []
+    for vertex in polyline:
+        point = coerce_point(vertex)
+        if point is not None:
+            points.append(point)
+    return points
+
+
+def bounding_box(lat: float, lng: float, radius_km: float):
+    """
+    Lat/lng window that fully contains a circle of `radius_km` around a point.
+
+    Returns:
+        (min_lat, max_lat, min_lng, max_lng)
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    lng_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return lat - lat_delta, lat + lat_delta, lng - lng_delta, lng + lng_delta
+
+
+class GridIndex:
+    """
+    Uniform lat/lng grid for radius queries over in-memory points.
+
+    Points are bucketed into square cells of `cell_km`; a query scans only the cells
+    overlapping the search circle and then filters by exact haversine distance.
+    """
+
+    def __init__(self, cell_km: float):
+        self.cell_deg = max(cell_km / KM_PER_DEGREE, 1e-6)
+        self.cells = {}
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def add(self, key, lat: float, lng: float):
+        self.cells.setdefault(self._cell(lat, lng), []).append((key, lat, lng))
+
+    def within(self, lat: float, lng: float, radius_km: float):
+        """Yield (key, distance_km) for every point within `radius_km`"""
+        min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+        lo_i, lo_j = self._cell(min_lat, min_lng)
+        hi_i, hi_j = self._cell(max_lat, max_lng)
+        for i in range(lo_i, hi_i + 1):
+            for j in range(lo_j, hi_j + 1):
+                for key, plat, plng in self.cells.get((i, j), ()):
+                    distance = haversine_km(lat, lng, plat, plng)
+                    if distance <= radius_km:
+                        yield key, distance
+
+
+def convex_hull(points):
+    """
+    Convex hull of (lat, lng) points (Andrew's monotone chain on planar degrees).
+
+    Returns:
+        Hull vertices counter-clockwise in (lat, lng), without repeating the first vertex
+    """
+    pts = sorted(set((lng, lat) for lat, lng in points))
+    if len(pts) < 3:
+        return [(lat, lng) for lng, lat in pts]
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower = []
+    for p in pts:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    upper = []
+    for p in reversed(pts):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return [(lat, lng) for lng, lat in lower[:-1] + upper[:-1]]
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Stored precision: 9 characters is a ~5 m cell
+GEOHASH_PRECISION = 9
+
+
+def geohash_encode(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Standard base32 geohash of a point"""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = value * 2 + 1
+                lng_lo = mid
+            else:
+                value *= 2
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = value * 2 + 1
+                lat_lo = mid
+            else:
+                value *= 2
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision: int):
+    """(lat_degrees, lng_degrees) spanned by one geohash cell"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def geohash_cover(min_lat, max_lat, min_lng, max_lng, precision: int):
+    """Geohash cells of `precision` that together cover a lat/lng window"""
+    lat_size, lng_size = geohash_cell_size(precision)
+    cells = set()
+    lat = math.floor(min_lat / lat_size) * lat_size + lat_size / 2
+    while lat - lat_size / 2 <= max_lat:
+        lng = math.floor(min_lng / lng_size) * lng_size + lng_size / 2
+        while lng - lng_size / 2 <= max_lng:
+            cells.add(geohash_encode(max(min(lat, 90.0), -90.0), ((lng + 180.0) % 360.0) - 180.0, precision))
+            lng += lng_size
+        lat += lat_size
+    return cells
+
+
+def geohash_radius_cover(lat: float, lng: float, radius_km: float, max_cells: int = 32):
+    """
+    Geohash prefixes covering a circle, using the finest precision that needs at most
+    `max_cells` prefixes.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        lat_size, lng_size = geohash_cell_size(candidate)
+        estimate = ((max_lat - min_lat) / lat_size + 2) * ((max_lng - min_lng) / lng_size + 2)
+        if estimate <= max_cells:
+            precision = candidate
+            break
+    return geohash_cover(min_lat, max_lat, min_lng, max_lng, precision)
@@ -0,0 +1,77 @@
+"""
+Encoded Polylines
+
+Google's encoded polyline algorithm: every coordinate is scaled to an integer
+(10**precision), delta-encoded against the previous vertex and written as base64-like
+ASCII chunks of 5 bits. Precision 5 (~1 m) is what the Google Maps SDKs expect;
+precision 6 matches OSRM/Valhalla. Points are (lat, lng) pairs, as in Route.polyline.
+"""
+
+import math
+
+DEFAULT_PRECISION = 5
+
+
+def _round(value):
+    # Round half away from zero, like the reference implementation (Math.round on |x|)
+    return int(math.copysign(math.floor(abs(value) + 0.5), value))
+
+
+def _write(delta, out):
+    value = ~(delta << 1) if delta < 0 else delta << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_polyline(points, precision=DEFAULT_PRECISION) -> str:
+    """
+    Encode (lat, lng) points.
+
+    Returns:
+        Encoded polyline string ('' for no points)
+    """
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        lat, lng = _round(lat * factor), _round(lng * factor)
+        _write(lat - prev_lat, out)
+        _write(lng - prev_lng, out)
+        prev_lat, prev_lng = lat, lng
+    return ''.join(out)
+
+
+def decode_polyline(encoded: str, precision=DEFAULT_PRECISION):
+    """
+    Decode an encoded polyline.
+
+    Returns:
+        List of [lat, lng] float pairs
+
+    Raises:
+        ValueError: If the string is truncated
+    """
+    factor = 10 ** precision
+    points = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = value = 0
+            while True:
+                if index >= length:
+                    raise ValueError("Truncated encoded polyline")
+                chunk = ord(encoded[index]) - 63
+                index += 1
+                value |= (chunk & 0x1F) << shift
+                shift += 5
+                if chunk < 0x20:
+                    break
+            deltas.append(~(value >> 1) if value & 1 else value >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append([round(lat / factor, precision), round(lng / factor, precision)])
+    return points
@@ -0,0 +1,137 @@
+"""
+Polyline Simplification
+
+Douglas-Peucker simplification of route polylines, vectorized with NumPy across many
+lines at once. Instead of running the algorithm once per tolerance, one pass records
+for every vertex the largest tolerance at which Douglas-Peucker would still keep it
+(its split distance, capped by the split distances of the ranges containing it).
+Simplifying at tolerance t is then just `importance > t`, so all zoom variants of
+every route come from a single pass.
+
+Variants are keyed by the map zoom they are meant for; SIMPLIFY_TOLERANCES_M is about
+one screen pixel at that zoom at Philippine latitudes.
+"""
+
+import math
+
+import numpy as np
+
+from .polyline import encode_polyline, DEFAULT_PRECISION
+
+METERS_PER_DEGREE = 111320.0
+
+# Zoom -> Douglas-Peucker tolerance in meters; above the last zoom the full polyline is used
+SIMPLIFY_TOLERANCES_M = {8: 600, 10: 150, 12: 40, 14: 10}
+
+
+def dp_importance(lats, lngs, offsets):
+    """
+    Douglas-Peucker keep-threshold of every vertex.
+
+    Args:
+        lats, lngs: Vertices of all lines, concatenated
+        offsets: Line i is lats[offsets[i]:offsets[i + 1]]
+
+    Returns:
+        Array of distances in meters (inf for line endpoints); a vertex survives
+        simplification at tolerance t when its value is greater than t
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    importance = np.zeros(len(lats))
+    if not len(lats):
+        return importance
+
+    # Local equirectangular meters, scaled by each line's mean latitude
+    counts = np.diff(offsets)
+    starts, ends = offsets[:-1][counts > 0], offsets[1:][counts > 0] - 1
+    mean_lat = np.add.reduceat(lats, starts) / (ends - starts + 1)
+    scale = np.repeat(np.cos(np.radians(mean_lat)), ends - starts + 1)
+    x = lngs * scale * METERS_PER_DEGREE
+    y = lats * METERS_PER_DEGREE
+
+    importance[starts] = math.inf
+    importance[ends] = math.inf
+    lo, hi = starts, ends
+    cap = np.full(len(lo), math.inf)
+
+    # Split every open range of every line at once, one tree level per iteration
+    while len(lo):
+        inner = hi - lo - 1
+        open_ranges = inner > 0
+        lo, hi, cap, inner = lo[open_ranges], hi[open_ranges], cap[open_ranges], inner[open_ranges]
+        if not len(lo):
+            break
+
+        group = np.repeat(np.arange(len(lo)), inner)
+        group_start = np.cumsum(inner) - inner
+        vertex = lo[group] + 1 + np.arange(len(group)) - group_start[group]
+
+        ax, ay = x[lo][group], y[lo][group]
+        dx, dy = x[hi][group] - ax, y[hi][group] - ay
+        length_sq = dx * dx + dy * dy
+        t = np.where(
+            length_sq > 0,
+            ((x[vertex] - ax) * dx + (y[vertex] - ay) * dy) / np.where(length_sq > 0, length_sq, 1),
+            0,
+        ).clip(0, 1)
+        distance = np.hypot(x[vertex] - (ax + t * dx), y[vertex] - (ay + t * dy))
+
+        # First vertex reaching each range's maximum distance is the split point
+        peak = np.maximum.reduceat(distance, group_start)
+        candidates = np.flatnonzero(distance == peak[group])
+        _, first = np.unique(group[candidates], return_index=True)
+        pivot = vertex[candidates[first]]
+
+        threshold = np.minimum(peak, cap)
+        importance[pivot] = threshold
+        lo, hi = np.concatenate([lo, pivot]), np.concatenate([pivot, hi])
+        cap = np.concatenate([threshold, threshold])
+
+    return importance
+
+
+def polyline_variants(polylines, precision=DEFAULT_PRECISION):
+    """
+    Simplified encoded variants of many polylines.
+
+    Args:
+        polylines: List of [(lat, lng), ...] lists
+
+    Returns:
+        One {zoom (str): encoded polyline} dict per input; only variants with fewer
+        vertices than the full line are included
+    """
+    offsets = np.zeros(len(polylines) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(points) for points in polylines])
+    coordinates = np.array([point for points in polylines for point in points], dtype=np.float64).reshape(-1, 2)
+    importance = dp_importance(coordinates[:, 0], coordinates[:, 1], offsets)
+
+    variants = []
+    for i, points in enumerate(polylines):
+        line = {}
+        lo, hi = offsets[i], offsets[i + 1]
+        for zoom, tolerance in SIMPLIFY_TOLERANCES_M.items():
+            keep = np.flatnonzero(importance[lo:hi] > tolerance)
+            if len(keep) < hi - lo:
+                line[str(zoom)] = encode_polyline([points[k] for k in keep], precision)
+        variants.append(line)
+    return variants
+
+
+def variant_for(zoom=None, tolerance_m=None):
+    """
+    Variant key for a map zoom or a maximum tolerance in meters.
+
+    Returns:
+        The coarsest variant that is still within the requested detail (for a zoom, the
+        variant of the nearest variant zoom at or above it), or None for the full polyline
+    """
+    if zoom is not None:
+        eligible = [z for z in SIMPLIFY_TOLERANCES_M if z >= zoom]
+        return str(min(eligible)) if eligible else None
+    if tolerance_m is not None:
+        eligible = [z for z, tolerance in SIMPLIFY_TOLERANCES_M.items() if tolerance <= tolerance_m]
+        return str(min(eligible)) if eligible else None
+    return None
@@ -1,3 +1,4 @@
+import json
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -14,24 +15,41 @@ from django.core.mail import send_mail
 from django.conf import settings
 from allauth.account.models import EmailAddress
 from functools import wraps
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes, throttle_classes
+from rest_framework.throttling import UserRateThrottle
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from django.utils import timezone
 from django.db.models import Max, Count
 from django.db.models.functions import TruncDate, TruncHour
 from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from .models import Terminal, Region, Route, ModeOfTransport, City, RouteStop, CachedExport
 from .serializers import (
     UserRegistrationSerializer,
     UserLoginSerializer,
     UserProfileSerializer,
-    RegionSerializer,
     TerminalSerializer,
-    RouteSerializer,
+    TerminalPinSerializer,
+    POLYLINE_FORMATS,
     TerminalContributionSerializer,
     RouteContributionSerializer,
     RouteStopContributionSerializer,
     UserLakbayPointsSerializer,
 )
+from .routing.graph import get_graph
+from .routing.raptor import pareto_journeys, isochrone, DEFAULT_MAX_ROUNDS, MAX_ROUNDS
+from .routing.batch import BatchRequestError, parse_pairs, plan_batch, ndjson_lines
+from .routing.snapping import find_terminals, snap_to_graph, MAX_SEARCH_RADIUS_KM
+from .routing.corridors import routes_near, DEFAULT_CORRIDOR_RADIUS_M, MAX_CORRIDOR_RADIUS_M
+from .routing.cache import cached_plan, plan_cache
+from .utils.simplify import variant_for
+from .maps.clusters import get_cluster_index, MIN_ZOOM, MAX_ZOOM
+from .maps.tiles import get_tile, get_vector_tile, MAX_TILE_ZOOM, TILE_MAX_AGE, TILE_IMMUTABLE_MAX_AGE
+from .maps.mvt import CONTENT_TYPE as MVT_CONTENT_TYPE
+from .exports.geojson import feature_collection, LAYERS as GEOJSON_LAYERS
+from .exports.records import region_records, terminal_records, route_records
+from .exports.compression import ENCODING_FIELDS, accepted_encodings
 
 #Account System
 class RegisterView(generics.CreateAPIView):
@@ -423,14 +441,51 @@ class DeleteAccountView(APIView):
     
 
 #Export All Data
+def _route_geometry(request):
+    """
+    Serializer context for embedded route polylines: ?polyline=raw|encoded|none (default raw)
+    and an optional ?zoom= or ?tolerance= (meters) selecting a simplified variant.
+    Returns None if a value is invalid.
+    """
+    polyline_format = request.GET.get('polyline', 'raw')
+    if polyline_format not in POLYLINE_FORMATS:
+        return None
+    try:
+        zoom = request.GET.get('zoom')
+        zoom = int(zoom) if zoom is not None else None
+        tolerance = request.GET.get('tolerance')
+        tolerance = float(tolerance) if tolerance is not None else None
+    except ValueError:
+        return None
+    if (zoom is not None and zoom < 0) or (tolerance is not None and tolerance < 0):
+        return None
+    return {'polyline': polyline_format, 'simplify': variant_for(zoom=zoom, tolerance_m=tolerance)}
+
+def _route_geometry_error():
+    return Response({
+        'error': f"polyline must be one of: {', '.join(POLYLINE_FORMATS)}; "
+                 "zoom and tolerance must be non-negative numbers"
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+class RouteGeometryMixin:
+    """Honours ?polyline=, ?zoom= and ?tolerance= on generic views whose serializer embeds routes"""
+
+    def get(self, request, *args, **kwargs):
+        if _route_geometry(request) is None:
+            return _route_geometry_error()
+        return super().get(request, *args, **kwargs)  # type: ignore
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()  # type: ignore
+        context.update(_route_geometry(self.request))  # type: ignore
+        return context
+
 @api_view(['GET'])
 def complete_data_export(request):
-    # Get all regions
-    regions = Region.objects.prefetch_related(
-        'city_set__terminals__origin_routes__stops',
-        'city_set__terminals__origin_routes__mode'
-    ).all()
-    
+    route_geometry = _route_geometry(request)
+    if route_geometry is None:
+        return _route_geometry_error()
+
     # Get transport modes
     terminal_last_updated = Terminal.objects.aggregate(Max('updated_at'))['updated_at__max']
     
@@ -441,7 +496,7 @@ def complete_data_export(request):
     total_routes = Route.objects.filter(verified=True).count()
     
     # Serialize data
-    regions_data = RegionSerializer(regions, many=True).data
+    regions_data = region_records(Region.objects.all(), route_geometry)
     
     response_data = {
         'regions': regions_data,
@@ -491,64 +546,437 @@ def metadata(request):
         "check_timestamp": timezone.now()
     })
 #Terminals
-class TerminalsByCityView(generics.ListAPIView):
+def _wants_pins(request):
+    return request.query_params.get('view') == 'pins'
+
+def _terminal_pins(terminals):
+    """Serialize terminals as map pins (two queries, no route or stop prefetch)"""
+    terminals = list(terminals)
+    modes = TerminalPinSerializer.modes_for([terminal.id for terminal in terminals])
+    return TerminalPinSerializer(terminals, many=True, context={'modes': modes}).data
+
+class TerminalListMixin(RouteGeometryMixin):
+    """
+    Full terminals with nested routes by default; `?view=pins` returns compact map pins
+    (id, name, coordinates, mode badges) without loading routes or stops.
+    """
     serializer_class = TerminalSerializer
-    
+    queryset = Terminal.objects.filter(verified=True)
+
+    def get_queryset(self):  # type: ignore
+        terminals = super().get_queryset()  # type: ignore
+        if _wants_pins(self.request):  # type: ignore
+            return terminals.only(*TerminalPinSerializer.PIN_FIELDS)
+        return TerminalSerializer.setup_eager_loading(terminals)
+
+    def list(self, request, *args, **kwargs):
+        if _wants_pins(request):
+            return Response(_terminal_pins(self.get_queryset()))
+        return super().list(request, *args, **kwargs)
+
+class TerminalsByCityView(TerminalListMixin, generics.ListAPIView):
     def get_queryset(self):  # type: ignore
         city_id = self.kwargs.get('city_id')
-        return Terminal.objects.filter(
-            city_id=city_id,
-            verified=True
-        ).select_related('city__region').prefetch_related(
-            'origin_routes__mode',
-            'origin_routes__stops'
-        )
+        return super().get_queryset().filter(city_id=city_id)
 
-class TerminalsByRegionView(generics.ListAPIView):
-    serializer_class = TerminalSerializer
-    
+class TerminalsByRegionView(TerminalListMixin, generics.ListAPIView):
     def get_queryset(self):  # type: ignore
         region_id = self.kwargs.get('region_id')
-        return Terminal.objects.filter(
-            city__region_id=region_id,
-            verified=True
-        ).select_related('city__region').prefetch_related(
-            'origin_routes__mode',
-            'origin_routes__stops'
-        )
+        return super().get_queryset().filter(city__region_id=region_id)
+
+class TerminalDetailView(RouteGeometryMixin, generics.RetrieveAPIView):
+    """One verified terminal with its routes and stops, e.g. when a map pin is tapped"""
+    serializer_class = TerminalSerializer
+    lookup_url_kwarg = 'terminal_id'
+    queryset = TerminalSerializer.setup_eager_loading(Terminal.objects.filter(verified=True))
 
 @api_view(['GET'])
 def nearby_terminals(request):
+    """
+    Verified terminals within `radius` km (default 25), nearest first.
+    `limit` caps the results; `limit` without `radius` returns the k nearest terminals.
+    `mode` keeps only terminals served by a verified route of that mode.
+    `view=pins` returns compact map pins instead of full terminals.
+    """
     lat = request.GET.get('lat')
     lng = request.GET.get('lng')
-    radius = float(request.GET.get('radius', 25))  # Default 25km
+    radius = request.GET.get('radius')
+    limit = request.GET.get('limit')
+    mode = request.GET.get('mode')
     
     if not lat or not lng:
         return Response({
             'error': 'lat and lng parameters are required'
         }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        lat, lng = float(lat), float(lng)
+        limit = int(limit) if limit else None
+        if radius is not None:
+            radius = float(radius)
+        elif limit is None:
+            radius = 25  # Default 25km
+    except ValueError:
+        return Response({
+            'error': 'lat, lng, radius and limit must be numbers'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if (radius is not None and not 0 < radius <= MAX_SEARCH_RADIUS_KM) or (limit is not None and limit <= 0):
+        return Response({
+            'error': f'radius must be between 0 and {MAX_SEARCH_RADIUS_KM} km and limit must be positive'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if mode and mode not in dict(ModeOfTransport.MODE_CHOICES):
+        return Response({
+            'error': f"mode must be one of: {', '.join(dict(ModeOfTransport.MODE_CHOICES))}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    route_geometry = _route_geometry(request)
+    if route_geometry is None:
+        return _route_geometry_error()
     
-    # Simple bounding box filter
-    lat_range = radius / 111  # Rough conversion: 1 degree ≈ 111km
-    lng_range = radius / (111 * max(abs(float(lat)), 0.01))
-    
-    terminals = Terminal.objects.filter(
-        latitude__range=(float(lat) - lat_range, float(lat) + lat_range),
-        longitude__range=(float(lng) - lng_range, float(lng) + lng_range),
-        verified=True
-    ).select_related('city__region').prefetch_related(
-        'origin_routes__mode',
-        'origin_routes__stops'
+    # In-memory index when current, geohash-indexed query otherwise; nearest first
+    hits = find_terminals(lat, lng, radius_km=radius, limit=limit, mode=mode)
+    distances = dict(hits)
+    terminals = Terminal.objects.filter(id__in=distances, verified=True)
+    if _wants_pins(request):
+        terminals = sorted(terminals.only(*TerminalPinSerializer.PIN_FIELDS), key=lambda terminal: distances[terminal.id])
+        data = _terminal_pins(terminals)
+    else:
+        terminals = sorted(TerminalSerializer.setup_eager_loading(terminals), key=lambda terminal: distances[terminal.id])
+        data = TerminalSerializer(terminals, many=True, context=route_geometry).data
+    for item in data:
+        item['distance_km'] = round(distances[item['id']], 3)
+    return Response(data)
+
+@api_view(['GET'])
+def nearby_routes(request):
+    """
+    Verified routes passing within `radius` meters (default 200, max 2000) of lat/lng,
+    nearest first, wherever their origin terminal is. Each route carries the closest
+    point on its path, how far along the route that point is, and its nearest stop.
+    `mode` keeps only routes of that mode; `limit` caps the results.
+    """
+    lat = request.GET.get('lat')
+    lng = request.GET.get('lng')
+    mode = request.GET.get('mode')
+
+    if not lat or not lng:
+        return Response({
+            'error': 'lat and lng parameters are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        lat, lng = float(lat), float(lng)
+        radius = float(request.GET.get('radius', DEFAULT_CORRIDOR_RADIUS_M))
+        limit = request.GET.get('limit')
+        limit = int(limit) if limit else None
+    except ValueError:
+        return Response({
+            'error': 'lat, lng, radius and limit must be numbers'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return Response({
+            'error': 'lat and lng are out of range'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if not 0 < radius <= MAX_CORRIDOR_RADIUS_M or (limit is not None and limit <= 0):
+        return Response({
+            'error': f'radius must be between 0 and {MAX_CORRIDOR_RADIUS_M} meters and limit must be positive'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if mode and mode not in dict(ModeOfTransport.MODE_CHOICES):
+        return Response({
+            'error': f"mode must be one of: {', '.join(dict(ModeOfTransport.MODE_CHOICES))}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    routes, data_version = routes_near(lat, lng, radius_m=radius, mode=mode or None, limit=limit)
+    return Response({
+        'latitude': lat,
+        'longitude': lng,
+        'radius_m': radius,
+        'data_version': data_version,
+        'count': len(routes),
+        'routes': routes,
+    })
+
+# Journey Planner
+def _planner_terminal(request, graph, name, lat_param, lng_param):
+    """
+    Terminal id from `<name>=<id>`, or the routable terminal nearest to `<lat_param>`/`<lng_param>`.
+    Raises KeyError when neither is given and ValueError when a value is malformed.
+    """
+    value = request.GET.get(name)
+    if value:
+        return int(value)
+    lat, lng = float(request.GET[lat_param]), float(request.GET[lng_param])
+    snapped = snap_to_graph(graph, lat, lng)
+    return snapped[0] if snapped else None
+
+@api_view(['GET'])
+def plan_journey(request):
+    """
+    Plan a terminal-to-terminal journey over verified routes.
+    Endpoints are terminal ids (from, to) or coordinates (from_lat/from_lng, to_lat/to_lng)
+    snapped to the nearest verified terminal.
+    criteria=fastest (default) returns the single fastest path;
+    criteria=pareto returns every journey that is optimal on time, fare or transfers.
+    """
+    criteria = request.GET.get('criteria', 'fastest')
+    graph = get_graph()
+
+    try:
+        origin_id = _planner_terminal(request, graph, 'from', 'from_lat', 'from_lng')
+        destination_id = _planner_terminal(request, graph, 'to', 'to_lat', 'to_lng')
+    except KeyError:
+        return Response({
+            'error': 'from and to terminal ids (or from_lat/from_lng and to_lat/to_lng) are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        return Response({
+            'error': 'from and to must be terminal ids or coordinates'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if criteria not in ('fastest', 'pareto'):
+        return Response({
+            'error': 'criteria must be one of: fastest, pareto'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        max_transfers = int(request.GET.get('max_transfers', DEFAULT_MAX_ROUNDS - 1))
+    except ValueError:
+        return Response({
+            'error': 'max_transfers must be an integer'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    max_transfers = max(0, min(max_transfers, MAX_ROUNDS - 1))
+
+    for terminal_id in (origin_id, destination_id):
+        if terminal_id not in graph.terminal_node:
+            return Response({
+                'error': 'Terminal not found or not verified',
+                'terminal_id': terminal_id
+            }, status=status.HTTP_404_NOT_FOUND)
+
+    if criteria == 'pareto':
+        return Response(cached_plan(
+            graph, (origin_id, destination_id, criteria, max_transfers),
+            lambda: pareto_journeys(graph, origin_id, destination_id, max_transfers=max_transfers),
+            # A search cut short by its time budget may be incomplete
+            cacheable=lambda result: not result['truncated'],
+        ))
+
+    journey = cached_plan(
+        graph, (origin_id, destination_id, criteria),
+        lambda: graph.plan(origin_id, destination_id),
     )
-    
-    serializer = TerminalSerializer(terminals, many=True)
-    return Response(serializer.data)
+    if journey is None:
+        return Response({
+            'error': 'No route found between these terminals',
+            'from': origin_id,
+            'to': destination_id
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(journey)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def plan_cache_stats(request):
+    """Hit/miss counters of this worker's plan result cache"""
+    return Response(plan_cache.stats())
+
+class PlanBatchThrottle(UserRateThrottle):
+    """Batch plans per user (per IP when anonymous), each up to PLAN_BATCH_MAX_PAIRS searches"""
+    scope = 'plan_batch'
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([PlanBatchThrottle])
+def plan_journey_batch(request):
+    """
+    Fastest journeys for many origin/destination pairs in one request.
+    Pairs sharing an origin reuse one search; results stream back as NDJSON, one line per pair.
+    """
+    try:
+        pairs = parse_pairs(request.data)
+    except BatchRequestError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    include_legs = request.query_params.get('legs', '').lower() in ('1', 'true', 'yes')
+    graph = get_graph()
+    return StreamingHttpResponse(
+        ndjson_lines(plan_batch(graph, pairs, include_legs=include_legs)),
+        content_type='application/x-ndjson'
+    )
+
+@api_view(['GET'])
+def plan_isochrone(request):
+    """
+    Every verified terminal reachable from a start point within max_minutes and/or max_fare.
+    Start from a terminal (from=<id>) or a coordinate (lat, lng), snapped to the nearest terminal.
+    """
+    graph = get_graph()
+    try:
+        origin_id = _planner_terminal(request, graph, 'from', 'lat', 'lng')
+    except KeyError:
+        return Response({
+            'error': 'from or lat and lng are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        return Response({
+            'error': 'Invalid start point'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        max_minutes = request.GET.get('max_minutes')
+        max_minutes = float(max_minutes) if max_minutes is not None else None
+        max_fare = request.GET.get('max_fare')
+        max_fare = float(max_fare) if max_fare is not None else None
+        max_transfers = int(request.GET.get('max_transfers', DEFAULT_MAX_ROUNDS - 1))
+    except ValueError:
+        return Response({
+            'error': 'max_minutes, max_fare and max_transfers must be numbers'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    max_transfers = max(0, min(max_transfers, MAX_ROUNDS - 1))
+
+    if max_minutes is None and max_fare is None:
+        return Response({
+            'error': 'max_minutes or max_fare is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if (max_minutes is not None and max_minutes < 0) or (max_fare is not None and max_fare < 0):
+        return Response({
+            'error': 'Budgets must not be negative'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    hull = request.GET.get('hull')
+    if hull not in (None, 'convex'):
+        return Response({
+            'error': 'hull must be: convex'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if origin_id not in graph.terminal_node:
+        return Response({
+            'error': 'Terminal not found or not verified',
+            'terminal_id': origin_id
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(isochrone(
+        graph, origin_id,
+        max_minutes=max_minutes,
+        max_fare=max_fare,
+        max_transfers=max_transfers,
+        hull=hull == 'convex',
+    ))
+
+# Map
+def _parse_bbox(value):
+    """min_lng,min_lat,max_lng,max_lat -> tuple of floats, or raises ValueError"""
+    parts = [float(part) for part in (value or '').split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox must have four numbers')
+    min_lng, min_lat, max_lng, max_lat = parts
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= max_lng <= 180):
+        raise ValueError('bbox is out of range')
+    return min_lng, min_lat, max_lng, max_lat
+
+@api_view(['GET'])
+def map_clusters(request):
+    """
+    Terminal clusters for a map viewport.
+    bbox=min_lng,min_lat,max_lng,max_lat and zoom are required; above the deepest
+    cluster zoom every terminal is returned individually.
+    """
+    try:
+        bbox = _parse_bbox(request.GET.get('bbox'))
+    except ValueError:
+        return Response({
+            'error': 'bbox must be min_lng,min_lat,max_lng,max_lat'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        zoom = int(request.GET['zoom'])
+    except (KeyError, ValueError):
+        return Response({
+            'error': 'zoom must be an integer'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if zoom < MIN_ZOOM:
+        return Response({
+            'error': f'zoom must be at least {MIN_ZOOM}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    index = get_cluster_index()
+    items = index.clusters(*bbox, zoom)
+    return Response({
+        'zoom': zoom,
+        'clustered': zoom <= MAX_ZOOM,
+        'data_version': index.data_version,
+        'count': len(items),
+        'items': items,
+    })
+
+def _tile_out_of_range(z, x, y):
+    return z > MAX_TILE_ZOOM or x >= 2 ** z or y >= 2 ** z
+
+def _tile_response(request, body, data_version, content_type):
+    """Tile body with an ETag of the data version and long-lived cache headers"""
+    etag = f'"{data_version}"' if data_version else None
+    if etag and request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = HttpResponse(body, content_type=content_type)
+    if etag:
+        response['ETag'] = etag
+    if data_version and request.GET.get('v') == data_version:
+        response['Cache-Control'] = f'public, max-age={TILE_IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={TILE_MAX_AGE}'
+    return response
+
+@api_view(['GET'])
+def map_tile(request, z, x, y):
+    """
+    Verified terminals and simplified route paths inside slippy-map tile z/x/y.
+    Tiles are cached per data version; add ?v=<data_version> to make them immutable.
+    """
+    if _tile_out_of_range(z, x, y):
+        return Response({
+            'error': 'Tile out of range'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    body, data_version = get_tile(z, x, y)
+    return _tile_response(request, body, data_version, 'application/json')
+
+class VectorTileRenderer(BaseRenderer):
+    """Lets clients that only accept vector tiles reach map_vector_tile"""
+    media_type = MVT_CONTENT_TYPE
+    format = 'mvt'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only error bodies go through the renderer; tiles are returned as raw bytes
+        return json.dumps(data).encode()
+
+@api_view(['GET'])
+@renderer_classes([JSONRenderer, VectorTileRenderer])
+def map_vector_tile(request, z, x, y):
+    """Same content as map_tile, encoded as a Mapbox Vector Tile"""
+    if _tile_out_of_range(z, x, y):
+        return Response({
+            'error': 'Tile out of range'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    body, data_version = get_vector_tile(z, x, y)
+    return _tile_response(request, body, data_version, MVT_CONTENT_TYPE)
 
 # Seperate Exports
 @api_view(['GET'])
 def export_regions_cities(request):
-    regions = Region.objects.prefetch_related("city_set").all()
-    data = RegionSerializer(regions, many=True).data
+    route_geometry = _route_geometry(request)
+    if route_geometry is None:
+        return _route_geometry_error()
+
+    data = region_records(Region.objects.all(), route_geometry)
     return Response({
         "regions": data,
         "export_timestamp": timezone.now()
@@ -558,11 +986,11 @@ def export_regions_cities(request):
 # 2. Terminals
 @api_view(['GET'])
 def export_terminals(request):
-    terminals = Terminal.objects.select_related("city__region").prefetch_related(
-        "origin_routes__mode",
-        "origin_routes__stops"
-    ).all()
-    data = TerminalSerializer(terminals, many=True).data
+    route_geometry = _route_geometry(request)
+    if route_geometry is None:
+        return _route_geometry_error()
+
+    data = terminal_records(Terminal.objects.all(), route_geometry)
     return Response({
         "terminals": data,
         "last_updated": Terminal.objects.aggregate(Max("updated_at"))["updated_at__max"],
@@ -573,13 +1001,36 @@ def export_terminals(request):
 # 3. Routes + Stops
 @api_view(['GET'])
 def export_routes_stops(request):
-    routes = Route.objects.prefetch_related("stops", "mode", "terminal").all()
-    data = RouteSerializer(routes, many=True).data
+    route_geometry = _route_geometry(request)
+    if route_geometry is None:
+        return _route_geometry_error()
+
+    data = route_records(Route.objects.all(), route_geometry)
     return Response({
         "routes": data,
         "export_timestamp": timezone.now()
     })
 
+# 4. GeoJSON
+@api_view(['GET'])
+def export_geojson(request):
+    """
+    Verified terminals (points) and routes (line strings with their stops) as one
+    streamed GeoJSON FeatureCollection. `layers=terminals,routes` picks the layers.
+    """
+    layers = [layer for layer in request.GET.get('layers', ','.join(GEOJSON_LAYERS)).split(',') if layer]
+    if not layers or any(layer not in GEOJSON_LAYERS for layer in layers):
+        return Response({
+            'error': f"layers must be a comma-separated subset of: {', '.join(GEOJSON_LAYERS)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        feature_collection(layers, export_timestamp=timezone.now().isoformat()),
+        content_type='application/geo+json'
+    )
+    response['Content-Disposition'] = 'inline; filename="lakbayan.geojson"'
+    return response
+
 # User Contribution
 
 @api_view(['POST'])
@@ -940,63 +1391,75 @@ def resend_verification_email(request):
             'details': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+def _cached_export_response(request, export_type, unavailable):
+    """
+    Cached export as stored: the precompressed body for the best encoding the client
+    accepts, else the JSONB data. Precompressed bodies are only sent when JSON is the
+    negotiated format, so the browsable API keeps working.
+    """
+    exports = CachedExport.objects.filter(export_type=export_type)
+    if request.accepted_renderer.format == 'json':
+        for encoding in accepted_encodings(request.headers.get('Accept-Encoding')):
+            bodies = list(exports.values_list(ENCODING_FIELDS[encoding], flat=True))
+            if not bodies:
+                break
+            # None until update_export_cache has stored this encoding
+            if bodies[0] is not None:
+                response = HttpResponse(bytes(bodies[0]), content_type='application/json')
+                response['Content-Encoding'] = encoding
+                patch_vary_headers(response, ['Accept-Encoding'])
+                return response
+
+    cached = exports.defer(*ENCODING_FIELDS.values()).first()
+    if cached is None:
+        return Response(unavailable, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response = Response(cached.data)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
 @api_view(['GET'])
 def cached_complete_export(request):
-    """Serve cached complete export from JSONB"""
-    try:
-        cached = CachedExport.objects.get(export_type='complete')
-        return Response(cached.data)
-    except CachedExport.DoesNotExist:
-        return Response({
-            'error': 'Cache not initialized',
-            'message': 'Please run: python manage.py update_export_cache',
-            'fallback': '/api/complete/'
-        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    """Serve cached complete export from JSONB (precompressed when the client accepts it)"""
+    return _cached_export_response(request, 'complete', {
+        'error': 'Cache not initialized',
+        'message': 'Please run: python manage.py update_export_cache',
+        'fallback': '/api/complete/'
+    })
 
 @api_view(['GET'])
 def cached_terminals_export(request):
-    """Serve cached terminals export from JSONB"""
-    try:
-        cached = CachedExport.objects.get(export_type='terminals')
-        return Response(cached.data)
-    except CachedExport.DoesNotExist:
-        return Response({
-            'error': 'Cache not initialized',
-            'fallback': '/api/export/terminals/'
-        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    """Serve cached terminals export from JSONB (precompressed when the client accepts it)"""
+    return _cached_export_response(request, 'terminals', {
+        'error': 'Cache not initialized',
+        'fallback': '/api/export/terminals/'
+    })
 
 @api_view(['GET'])
 def cached_routes_export(request):
-    """Serve cached routes export from JSONB"""
-    try:
-        cached = CachedExport.objects.get(export_type='routes')
-        return Response(cached.data)
-    except CachedExport.DoesNotExist:
-        return Response({
-            'error': 'Cache not initialized',
-            'fallback': '/api/export/routes-stops/'
-        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    """Serve cached routes export from JSONB (precompressed when the client accepts it)"""
+    return _cached_export_response(request, 'routes', {
+        'error': 'Cache not initialized',
+        'fallback': '/api/export/routes-stops/'
+    })
 
 @api_view(['GET'])
 def cached_regions_export(request):
-    """Serve cached regions export from JSONB"""
-    try:
-        cached = CachedExport.objects.get(export_type='regions')
-        return Response(cached.data)
-    except CachedExport.DoesNotExist:
-        return Response({
-            'error': 'Cache not initialized',
-            'fallback': '/api/export/regions-cities/'
-        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    """Serve cached regions export from JSONB (precompressed when the client accepts it)"""
+    return _cached_export_response(request, 'regions', {
+        'error': 'Cache not initialized',
+        'fallback': '/api/export/regions-cities/'
+    })
 
 @api_view(['GET'])
 def cached_metadata(request):
     """Get cache status and metadata"""
     try:
-        complete_cache = CachedExport.objects.get(export_type='complete')
+        # Metadata only; the compressed bodies can be several megabytes each
+        caches = CachedExport.objects.defer(*ENCODING_FIELDS.values())
+        complete_cache = caches.get(export_type='complete')
         
         # Get all cache info
-        all_caches = CachedExport.objects.all()
+        all_caches = caches.all()
         cache_info = {
             cache.export_type: {
                 'data_version': cache.data_version,
@@ -120,6 +120,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
+    'DEFAULT_THROTTLE_RATES': {
+        # POST /plan/batch/: every request can plan PLAN_BATCH_MAX_PAIRS journeys
+        'plan_batch': os.getenv("PLAN_BATCH_THROTTLE_RATE", "10/min"),
+    },
 }
 
 SIMPLE_JWT = {
@@ -221,3 +225,23 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Journey planner
+# Built routing indexes (see `python manage.py build_routing_index`)
+
+ROUTING_DATA_DIR = Path(os.getenv("ROUTING_DATA_DIR", BASE_DIR / "routing_data"))
+
+# Max walking distance (meters) between a route stop and another terminal for a transfer
+TRANSFER_WALK_RADIUS_M = int(os.getenv("TRANSFER_WALK_RADIUS_M", 400))
+
+# Max origin/destination pairs accepted by /api/plan/batch/
+PLAN_BATCH_MAX_PAIRS = int(os.getenv("PLAN_BATCH_MAX_PAIRS", 500))
+
+# Planner results kept per worker in the LRU plan cache
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", 2048))
+
+# Rendered map tiles kept per worker in the LRU tile cache
+TILE_CACHE_MAX_ENTRIES = int(os.getenv("TILE_CACHE_MAX_ENTRIES", 1024))
+
+# Decimal places kept by encoded route polylines (5 for Google Maps, 6 for OSRM-style clients)
+POLYLINE_PRECISION = int(os.getenv("POLYLINE_PRECISION", 5))